@@ -0,0 +1,339 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from array import array
+from collections import defaultdict
+
+log = logging.getLogger('bundleplacer')
+
+
+class _Interner:
+
+    """Maps hashable keys to small ints and back.
+
+    Ids are never reused, so an interner can be shared between copies of
+    a store. It is never pruned either: keys stay referenced for as long
+    as any store of the family does, even after their placements are
+    removed. A new AssignmentStore() starts a new family, which is what
+    PlacementController does when all assignments are cleared or
+    replaced.
+
+    Interning a key equal to a known one replaces the stored object, so
+    keys read back are the ones most recently added, e.g. the current
+    Service objects rather than ones from before a bundle change.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.ids = {}
+
+    def intern(self, key):
+        i = self.ids.get(key, None)
+        if i is None:
+            i = len(self.keys)
+            self.keys.append(key)
+            self.ids[key] = i
+        else:
+            self.keys[i] = key
+        return i
+
+    def lookup(self, key):
+        return self.ids.get(key, None)
+
+
+class AssignmentStore:
+
+    """Tracks services placed on machines, indexed in both directions.
+
+    Each placement is a row of (machine, service, atype). Rows are held
+    in three integer arrays, with the keys interned to ints. There are
+    indexes from each machine and each service to a list of its row
+    numbers, so both per-machine and per-service queries only look at
+    their own rows.
+
+    copy() is O(1): both stores share their columns and indexes until
+    one of them next changes, then that store copies the columns and
+    index dicts once, and each row list the first time it changes it.
+    The store has no closures in it, so it can be pickled.
+
+    For compatibility with code that used the plain nested dict, reading
+    store[machine_id] returns a {atype: [service]} dict built from that
+    machine's rows, and iterating the store yields the ids of machines
+    with at least one service.
+    """
+
+    def __init__(self, assignments=None):
+        self._keys = _Interner()
+        self._machines = array('i')
+        self._services = array('i')
+        self._atypes = array('i')
+        # interned key: list of row numbers
+        self._machine_rows = {}
+        self._service_rows = {}
+        # True while the columns and indexes are shared with another store
+        self._shared = False
+        # keys whose row lists this store has copied since it was last
+        # shared, or None if it owns them all
+        self._owned_machine_rows = None
+        self._owned_service_rows = None
+        if assignments is not None:
+            for machine_id, ad in assignments.items():
+                for atype, services in ad.items():
+                    for service in services:
+                        self.add(machine_id, service, atype)
+
+    def _unshare(self):
+        if self._shared:
+            self._machines = self._machines[:]
+            self._services = self._services[:]
+            self._atypes = self._atypes[:]
+            self._machine_rows = dict(self._machine_rows)
+            self._service_rows = dict(self._service_rows)
+            self._owned_machine_rows = set()
+            self._owned_service_rows = set()
+            self._shared = False
+
+    def _own_machine_rows(self, mi):
+        """Returns the row list for mi, copied first if it is shared."""
+        return _own_rows(self._machine_rows, self._owned_machine_rows, mi)
+
+    def _own_service_rows(self, si):
+        return _own_rows(self._service_rows, self._owned_service_rows, si)
+
+    def _rows_for_machine(self, machine_id):
+        return self._machine_rows.get(self._keys.lookup(machine_id), ())
+
+    def _rows_for_service(self, service):
+        return self._service_rows.get(self._keys.lookup(service), ())
+
+    def _group(self, rows, column):
+        """Returns {atype: [key]} for rows, reading keys from column."""
+        keys = self._keys.keys
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[keys[self._atypes[row]]].append(keys[column[row]])
+        return grouped
+
+    def add(self, machine_id, service, atype):
+        self._unshare()
+        row = len(self._machines)
+        mi = self._keys.intern(machine_id)
+        si = self._keys.intern(service)
+        self._machines.append(mi)
+        self._services.append(si)
+        self._atypes.append(self._keys.intern(atype))
+        self._own_machine_rows(mi).append(row)
+        self._own_service_rows(si).append(row)
+
+    def remove(self, machine_id, service, atype):
+        """Removes one placement of service on machine_id as atype.
+
+        Raises ValueError if there is no such placement.
+        """
+        si = self._keys.lookup(service)
+        ai = self._keys.lookup(atype)
+        for row in self._rows_for_machine(machine_id):
+            if self._services[row] == si and self._atypes[row] == ai:
+                self._discard(row)
+                return
+        raise ValueError("{} is not placed on {} as {}".format(
+            service, machine_id, atype))
+
+    def remove_any(self, machine_id, service):
+        """Removes one placement of service on machine_id, of any type.
+
+        Returns the atype removed, or None if there was none.
+        """
+        for atype, services in self.services_for_machine(machine_id).items():
+            if service in services:
+                self.remove(machine_id, service, atype)
+                return atype
+        return None
+
+    def remove_service(self, service):
+        """Removes every placement of service.
+
+        Returns a list of the (machine_id, atype) pairs removed.
+        """
+        removed = []
+        for atype, machine_ids in self.machines_for_service(service).items():
+            for machine_id in machine_ids:
+                removed.append((machine_id, atype))
+        rows = self._rows_for_service(service)
+        while rows:
+            self._discard(rows[-1])
+            rows = self._rows_for_service(service)
+        return removed
+
+    def clear_machine(self, machine_id):
+        """Removes every placement on machine_id.
+
+        Returns a list of the (service, atype) pairs removed.
+        """
+        removed = []
+        for atype, services in self.services_for_machine(machine_id).items():
+            for service in services:
+                removed.append((service, atype))
+        rows = self._rows_for_machine(machine_id)
+        while rows:
+            self._discard(rows[-1])
+            rows = self._rows_for_machine(machine_id)
+        return removed
+
+    def _discard(self, row):
+        """Removes row by moving the last row into its place."""
+        self._unshare()
+        mi = self._machines[row]
+        si = self._services[row]
+        _drop_row(self._machine_rows, self._own_machine_rows(mi), mi, row)
+        _drop_row(self._service_rows, self._own_service_rows(si), si, row)
+        last = len(self._machines) - 1
+        if row != last:
+            for column in (self._machines, self._services, self._atypes):
+                column[row] = column[last]
+            _move_row(self._own_machine_rows(self._machines[row]), last, row)
+            _move_row(self._own_service_rows(self._services[row]), last, row)
+        for column in (self._machines, self._services, self._atypes):
+            column.pop()
+
+    def machines_for_service(self, service):
+        """Returns {atype: [machine_id]} for service."""
+        return self._group(self._rows_for_service(service), self._machines)
+
+    def services_for_machine(self, machine_id):
+        """Returns {atype: [service]} for machine_id."""
+        return self._group(self._rows_for_machine(machine_id), self._services)
+
+    def count_for_service(self, service):
+        return len(self._rows_for_service(service))
+
+    def count_for_machine(self, machine_id):
+        return len(self._rows_for_machine(machine_id))
+
+    def service_counts(self):
+        """Returns {service: number of placements}."""
+        keys = self._keys.keys
+        return {keys[si]: len(rows) for si, rows in self._service_rows.items()}
+
+    def is_placed_on(self, service, machine_id):
+        mi = self._keys.lookup(machine_id)
+        return any(self._machines[row] == mi
+                   for row in self._rows_for_service(service))
+
+    def services(self):
+        """Returns the services with at least one placement."""
+        keys = self._keys.keys
+        return [keys[si] for si in self._service_rows]
+
+    def copy(self):
+        """Returns an independent copy of this store in O(1) time."""
+        new = AssignmentStore()
+        new._keys = self._keys
+        new._machines = self._machines
+        new._services = self._services
+        new._atypes = self._atypes
+        new._machine_rows = self._machine_rows
+        new._service_rows = self._service_rows
+        new._shared = self._shared = True
+        return new
+
+    def diff(self, other):
+        """Returns the ids of machines whose placements differ between this
+        store and other."""
+        if self._machines is other._machines:
+            return []
+        changed = []
+        for machine_id in set(self.keys()) | set(other.keys()):
+            if self[machine_id] != other[machine_id]:
+                changed.append(machine_id)
+        return changed
+
+    def update_from(self, other):
+        """Makes this store's placements equal to other's, touching only
+        the machines that differ.
+
+        Returns the set of services whose placements changed.
+        """
+        changed = set()
+        for machine_id in self.diff(other):
+            for service, _ in self.clear_machine(machine_id):
+                changed.add(service)
+            for atype, services in other.services_for_machine(
+                    machine_id).items():
+                for service in services:
+                    self.add(machine_id, service, atype)
+                    changed.add(service)
+        return changed
+
+    def as_dict(self):
+        return {machine_id: self.services_for_machine(machine_id)
+                for machine_id in self.keys()}
+
+    def __getitem__(self, machine_id):
+        return self.services_for_machine(machine_id)
+
+    def __contains__(self, machine_id):
+        return self._keys.lookup(machine_id) in self._machine_rows
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._machine_rows)
+
+    def keys(self):
+        keys = self._keys.keys
+        return [keys[mi] for mi in self._machine_rows]
+
+    def items(self):
+        return [(machine_id, self.services_for_machine(machine_id))
+                for machine_id in self.keys()]
+
+    def __eq__(self, other):
+        if isinstance(other, AssignmentStore):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __repr__(self):
+        return "<AssignmentStore {}>".format(self.as_dict())
+
+
+def _own_rows(index, owned, key):
+    rows = index.get(key, None)
+    if rows is None:
+        rows = index[key] = []
+    elif owned is not None and key not in owned:
+        rows = index[key] = list(rows)
+    if owned is not None:
+        owned.add(key)
+    return rows
+
+
+def _drop_row(index, rows, key, row):
+    # rows are most often dropped from the end
+    for i in range(len(rows) - 1, -1, -1):
+        if rows[i] == row:
+            del rows[i]
+            break
+    if not rows:
+        del index[key]
+
+
+def _move_row(rows, old, new):
+    for i in range(len(rows) - 1, -1, -1):
+        if rows[i] == old:
+            rows[i] = new
+            break
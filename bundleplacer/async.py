@@ -16,42 +16,341 @@
 """ Async Handler
 Provides async operations for various api calls and other non-blocking
 work.
+
+Work runs on a Scheduler with several worker threads. Queued jobs run
+in Priority order, so a search the user is waiting on doesn't queue
+behind prefetched READMEs, and jobs submitted with the same key while
+one is still pending share its future.
+
+map(), then(), recover() and gather() build futures from other futures
+with done-callbacks, so waiting on a result never holds a worker.
 """
 
+import heapq
+import itertools
 import logging
 import time
-from concurrent.futures import ThreadPoolExecutor
-from threading import Event
+from collections import Counter, defaultdict
+from concurrent.futures import Future
+from enum import IntEnum
+from threading import Condition, Event, Lock, Thread
 
 log = logging.getLogger("bundleplacer.async")
 
+DEFAULT_WORKERS = 4
+
 
 class ThreadCancelledException(Exception):
     """Exception meaning intentional cancellation"""
 
-AsyncPool = ThreadPoolExecutor(1)
+
+class Priority(IntEnum):
+    """Queued jobs with a lower value run first."""
+    INTERACTIVE = 0  # the user is waiting on it, eg. a search
+    VISIBLE = 1  # data for what is on screen
+    PREFETCH = 2  # may be needed later, eg. READMEs
+
+
+class _Job:
+
+    __slots__ = ('future', 'func', 'key', 'priority', 'queued', 'started')
+
+    def __init__(self, future, func, key, priority):
+        self.future = future
+        self.func = func
+        self.key = key
+        self.priority = priority
+        self.queued = time.time()
+        self.started = False
+
+
+class Scheduler:
+
+    """ Runs functions on up to 'workers' threads, highest priority
+    first and in submission order within a priority.
+
+    Worker threads are started as jobs arrive. A job deduplicated at a
+    higher priority than it was queued with is moved up.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = Condition()
+        self._threads = []
+        self._idle = 0
+        # key: queued or running _Job
+        self._pending = {}
+        self._shutdown = False
+        # jobs queued and not yet started
+        self._depth = 0
+        self._max_depth = 0
+        self._counts = Counter()
+        # per priority: jobs started, seconds queued and seconds running
+        self._started = Counter()
+        self._wait = defaultdict(float)
+        self._max_wait = defaultdict(float)
+        self._run = defaultdict(float)
+
+    def submit(self, func, priority=Priority.VISIBLE, key=None):
+        """ Queues func() and returns a Future for its result
+
+        If key is given and a job with the same key is queued or
+        running, its Future is returned instead.
+        """
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new jobs after shutdown")
+            priority = Priority(priority)
+            job = self._pending.get(key, None) if key is not None else None
+            if job is not None:
+                self._counts['deduplicated'] += 1
+                if not job.started and priority < job.priority:
+                    # the old heap entry is skipped once this one runs
+                    job.priority = priority
+                    heapq.heappush(self._queue,
+                                   (priority, next(self._seq), job))
+                    self._counts['promoted'] += 1
+                return job.future
+            job = _Job(Future(), func, key, priority)
+            heapq.heappush(self._queue, (job.priority, next(self._seq), job))
+            if key is not None:
+                self._pending[key] = job
+            self._counts['submitted'] += 1
+            self._depth += 1
+            self._max_depth = max(self._max_depth, self._depth)
+            # start another worker while the idle ones can't take every
+            # queued job
+            if self._depth > self._idle and \
+               len(self._threads) < self.workers:
+                t = Thread(target=self._work,
+                           name='bundleplacer-async-{}'.format(
+                               len(self._threads)),
+                           daemon=True)
+                self._threads.append(t)
+                t.start()
+            self._cond.notify()
+        return job.future
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                self._idle += 1
+                while not self._queue and not self._shutdown:
+                    self._cond.wait()
+                self._idle -= 1
+                if self._shutdown:
+                    return None
+                _, _, job = heapq.heappop(self._queue)
+                if not job.started:
+                    break
+            job.started = True
+            self._depth -= 1
+            waited = time.time() - job.queued
+            self._started[job.priority] += 1
+            self._wait[job.priority] += waited
+            self._max_wait[job.priority] = max(self._max_wait[job.priority],
+                                               waited)
+            return job
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            if not job.future.set_running_or_notify_cancel():
+                self._finish(job, 'cancelled', 0)
+                continue
+            start = time.time()
+            try:
+                result = job.func()
+            except BaseException as e:
+                self._finish(job, 'failed', time.time() - start)
+                job.future.set_exception(e)
+            else:
+                self._finish(job, 'completed', time.time() - start)
+                job.future.set_result(result)
+
+    def _finish(self, job, outcome, ran):
+        with self._cond:
+            self._counts[outcome] += 1
+            self._run[job.priority] += ran
+            if job.key is not None and self._pending.get(job.key) is job:
+                del self._pending[job.key]
+
+    def shutdown(self):
+        """Stops the workers after their current jobs, cancelling queued
+        jobs."""
+        with self._cond:
+            self._shutdown = True
+            queued, self._queue = self._queue, []
+            self._pending.clear()
+            self._depth = 0
+            self._cond.notify_all()
+        for _, _, job in queued:
+            job.future.cancel()
+
+    def metrics(self):
+        """ Returns a dict of job counts (submitted, deduplicated,
+        promoted, completed, failed, cancelled), the current and maximum
+        queue depth, the number of worker threads, and for each priority
+        name, eg. 'interactive', a dict of jobs started and the mean and
+        maximum seconds they waited in the queue, and mean seconds run.
+        """
+        with self._cond:
+            m = dict(submitted=0, deduplicated=0, promoted=0, completed=0,
+                     failed=0, cancelled=0)
+            m.update(self._counts)
+            m['queue_depth'] = self._depth
+            m['max_queue_depth'] = self._max_depth
+            m['workers'] = len(self._threads)
+            for p in Priority:
+                n = self._started[p]
+                m[p.name.lower()] = dict(
+                    started=n,
+                    mean_wait=self._wait[p] / n if n else 0.0,
+                    max_wait=self._max_wait[p],
+                    mean_run=self._run[p] / n if n else 0.0)
+            return m
+
+
+AsyncPool = Scheduler(DEFAULT_WORKERS)
 log.debug('AsyncPool={}'.format(AsyncPool))
 
 
 ShutdownEvent = Event()
 
 
-def submit(func, exc_callback):
+def set_workers(workers):
+    """Sets the number of worker threads, for jobs submitted from now."""
+    AsyncPool.workers = max(1, workers)
+
+
+def submit(func, exc_callback, priority=Priority.VISIBLE, key=None):
     def cb(cb_f):
+        if cb_f.cancelled():
+            return
         e = cb_f.exception()
         if e:
             exc_callback(e)
     if ShutdownEvent.is_set():
         log.debug("ignoring async.submit due to impending shutdown.")
-        return
-    f = AsyncPool.submit(func)
+        return cancelled()
+    f = AsyncPool.submit(func, priority, key)
     f.add_done_callback(cb)
     return f
 
 
+def metrics():
+    return AsyncPool.metrics()
+
+
 def shutdown():
     ShutdownEvent.set()
-    AsyncPool.shutdown(wait=False)
+    AsyncPool.shutdown()
+
+
+def cancelled():
+    """Returns a Future that is already cancelled."""
+    f = Future()
+    f.cancel()
+    f.set_running_or_notify_cancel()
+    return f
+
+
+def resolved(value):
+    """Returns a Future that already has value as its result."""
+    f = Future()
+    f.set_result(value)
+    return f
+
+
+def _chain(source, on_done):
+    """Returns a new Future, set by on_done(source, target) once source
+    is done, or set to the exception on_done raises."""
+    target = Future()
+
+    def cb(f):
+        try:
+            on_done(f, target)
+        except BaseException as e:
+            if not target.done():
+                target.set_exception(e)
+    source.add_done_callback(cb)
+    return target
+
+
+def _copy_result(source, target):
+    if source.cancelled():
+        target.cancel()
+        target.set_running_or_notify_cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def map(future, func):
+    """ Returns a Future for func(result of future)
+
+    func runs in whichever thread completes future, without taking a
+    worker. Exceptions from either are passed on.
+    """
+    def on_done(f, target):
+        if f.cancelled() or f.exception() is not None:
+            _copy_result(f, target)
+        else:
+            target.set_result(func(f.result()))
+    return _chain(future, on_done)
+
+
+def then(future, func):
+    """ Like map(), for a func that itself returns a Future """
+    def on_done(f, target):
+        if f.cancelled() or f.exception() is not None:
+            _copy_result(f, target)
+        else:
+            func(f.result()).add_done_callback(
+                lambda inner: _copy_result(inner, target))
+    return _chain(future, on_done)
+
+
+def recover(future, func):
+    """Returns a Future for the result of future, or func(exception) if
+    it failed."""
+    def on_done(f, target):
+        if not f.cancelled() and f.exception() is not None:
+            target.set_result(func(f.exception()))
+        else:
+            _copy_result(f, target)
+    return _chain(future, on_done)
+
+
+def gather(futures):
+    """Returns a Future for the list of results of futures, in order, or
+    the first exception among them."""
+    futures = list(futures)
+    target = Future()
+    if len(futures) == 0:
+        target.set_result([])
+        return target
+    remaining = [len(futures)]
+    lock = Lock()
+
+    def cb(f):
+        with lock:
+            if target.done():
+                return
+            if f.cancelled() or f.exception() is not None:
+                _copy_result(f, target)
+                return
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                target.set_result([g.result() for g in futures])
+    for f in futures:
+        f.add_done_callback(cb)
+    return target
 
 
 def sleep_until(s):
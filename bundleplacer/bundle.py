@@ -15,6 +15,7 @@
 
 import logging
 import os
+from collections import defaultdict
 
 import yaml
 
@@ -144,6 +145,38 @@ class Bundle:
         if self.application_key not in self._bundle.keys():
             raise Exception("Invalid Bundle.")
 
+        # cached Service objects, rebuilt lazily when their bundle
+        # entries change. 'version' is bumped on every change that can
+        # affect the result of self.services.
+        self.version = 0
+        self._services = {}
+        self._services_list = None
+        self._stale_services = set()
+        self._relations_by_service = None
+
+    def _invalidate_services(self, service_names):
+        """Marks the cached services named in service_names as out of
+        date, so they are rebuilt on next access."""
+        self._stale_services.update(service_names)
+        self._services_list = None
+        self.version += 1
+
+    def _invalidate_relations(self, relations):
+        """Marks the services at either end of 'relations' as out of date
+        and drops the relations index."""
+        self._relations_by_service = None
+        self._invalidate_services(set(r.split(':')[0]
+                                      for pair in relations for r in pair))
+
+    def _relations_for_service(self, service_name):
+        if self._relations_by_service is None:
+            self._relations_by_service = defaultdict(list)
+            for src, dst in self._bundle.get('relations', []):
+                names = set([src.split(':')[0], dst.split(':')[0]])
+                for name in names:
+                    self._relations_by_service[name].append((src, dst))
+        return self._relations_by_service.get(service_name, [])
+
     def add_new_service(self, charm_name, charm_dict, service_name=None,
                         is_subordinate=False):
         if service_name is None:
@@ -156,32 +189,43 @@ class Bundle:
         new_dict = {'charm': charm_dict['Id'],
                     'num_units': 0 if is_subordinate else 1}
         self._bundle[self.application_key][service_name] = new_dict
+        self._invalidate_services([service_name])
         return service_name
 
     def remove_service(self, service_name):
         if service_name in self._bundle[self.application_key]:
             del self._bundle[self.application_key][service_name]
 
+        removed = []
+        kept = []
         for r1, r2 in self._bundle['relations']:
             s1 = r1.split(':')[0]
             s2 = r2.split(':')[0]
             if s1 == service_name or s2 == service_name:
-                self._bundle['relations'].remove([r1, r2])
+                removed.append([r1, r2])
+            else:
+                kept.append([r1, r2])
+        self._bundle['relations'] = kept
+        self._invalidate_relations(removed)
+        self._invalidate_services([service_name])
 
     def scale_service(self, service_name, amount):
         sd = self._bundle[self.application_key][service_name]
         new = sd.get('num_units', 0) + amount
         if new > 0:
             sd['num_units'] = new
+            self._invalidate_services([service_name])
 
     def add_relation(self, s1_name, s1_rel, s2_name, s2_rel):
         r = ["{}:{}".format(s1_name, s1_rel),
              "{}:{}".format(s2_name, s2_rel)]
         self._bundle['relations'].append(r)
+        self._invalidate_relations([r])
 
     def remove_relation(self, s1_name, s1_rel, s2_name, s2_rel):
         r = self.find_relation(s1_name, s1_rel, s2_name, s2_rel)
         self._bundle['relations'].remove(r)
+        self._invalidate_relations([r])
 
     def is_related(self, s1_name, s1_rel, s2_name, s2_rel):
         """Checks if a relation exists. If the relation in the bundle does not
@@ -203,22 +247,52 @@ class Bundle:
         sd = self._bundle[self.application_key][service_name]
         opts = sd.setdefault('options', {})
         opts[opname] = value
+        self._invalidate_services([service_name])
+
+    def _create_service(self, servicename, sd):
+        metadata = self._metadata.get(self.application_key, {})
+        sm = metadata.get(servicename, {})
+        service = create_service(servicename, sd, sm,
+                                 self._relations_for_service(servicename))
+        if service.csid.series == "":
+            service.csid.series = self.series
+        return service
 
     @property
     def services(self):
-        services = []
-        metadata = self._metadata.get(self.application_key, {})
+        """Returns a list of Service objects for the bundle's applications.
+
+        Service objects are cached, and only those whose bundle entries
+        changed since the last call are recreated.
+        """
+        return list(self._refresh_services())
+
+    def _refresh_services(self):
+        if self._services_list is not None:
+            return self._services_list
+
         bundle_services = self._bundle.get(self.application_key, {})
-        relations = self._bundle.get('relations', [])
+        for servicename in self._stale_services:
+            self._services.pop(servicename, None)
+        self._stale_services = set()
+
+        services = []
         for servicename, sd in bundle_services.items():
-            sm = metadata.get(servicename, {})
-            service = create_service(servicename, sd,
-                                     sm, relations)
-            if service.csid.series == "":
-                service.csid.series = self.series
+            service = self._services.get(servicename, None)
+            if service is None:
+                service = self._create_service(servicename, sd)
+                self._services[servicename] = service
             services.append(service)
+        self._services_list = services
         return services
 
+    def get_service(self, service_name):
+        """Returns the Service named service_name, or None."""
+        if service_name not in self._bundle.get(self.application_key, {}):
+            return None
+        self._refresh_services()
+        return self._services.get(service_name, None)
+
     @property
     def charm_ids(self):
         seen = set()
@@ -253,9 +327,12 @@ class Bundle:
 
     def clear_machines_and_placement(self):
         self._bundle['machines'] = {}
+        cleared = []
         for sname, sd in self._bundle[self.application_key].items():
             if 'to' in sd:
                 del(sd['to'])
+                cleared.append(sname)
+        self._invalidate_services(cleared)
 
     @property
     def assignments(self):
@@ -329,6 +406,7 @@ class Bundle:
                [nr2, nr1] in self._bundle['relations']:
                 continue
             self._bundle['relations'].append([nr1, nr2])
+            self._invalidate_relations([[nr1, nr2]])
 
         # apply machine renames to services
         def rename_machine(to, md):
@@ -348,6 +426,7 @@ class Bundle:
             new_service_names.append(service_renames[sname])
             if 'to' in sd:
                 new_assignments[service_renames[sname]] = new_sd['to']
+        self._invalidate_services(new_service_names)
 
         new_services = [s for s in self.services
                         if s.service_name in new_service_names]
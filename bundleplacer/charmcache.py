@@ -0,0 +1,225 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Charm store responses kept on disk between runs
+
+Entries are keyed by a kind ('meta', 'readme') and a charm id without
+revision. An entry older than the ttl is still served straight away,
+while it is revalidated in the background with a conditional request
+(If-None-Match / If-Modified-Since).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict, namedtuple
+from functools import partial
+from threading import Lock, RLock
+
+import requests
+
+from bundleplacer.async import Priority, submit
+from bundleplacer.charmstore_client import charmstore_session
+
+log = logging.getLogger('bundleplacer')
+
+# seconds before a cached charm store response is revalidated
+CHARM_CACHE_TTL = 24 * 60 * 60
+
+CACHE_FILENAME = 'charmstore-cache.sqlite'
+
+# bytes of text kept in memory by a TextLRU
+TEXT_CACHE_BYTES = 1024 * 1024
+
+CacheEntry = namedtuple('CacheEntry', ['value', 'etag', 'last_modified',
+                                       'fetched'])
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched REAL NOT NULL,
+    PRIMARY KEY (kind, key))"""
+
+
+class CharmCache:
+
+    """ sqlite backed cache of charm store responses
+
+    :param str path: database file, or ':memory:'
+    :param ttl: seconds an entry is fresh for
+    """
+
+    def __init__(self, path, ttl=CHARM_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = RLock()
+        try:
+            if path != ':memory:':
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            with self._db:
+                self._db.execute(_SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            log.warning("Can't use charm cache {}, not caching: {}".format(
+                path, e))
+            self._db = sqlite3.connect(':memory:', check_same_thread=False)
+            with self._db:
+                self._db.execute(_SCHEMA)
+
+    @classmethod
+    def for_config(cls, config):
+        """Returns the cache kept under config.cfg_path, with the ttl from
+        the 'charm_cache_ttl' option if set."""
+        ttl = config.getopt('charm_cache_ttl') or CHARM_CACHE_TTL
+        return cls(os.path.join(config.cfg_path, CACHE_FILENAME), ttl)
+
+    def get(self, kind, key):
+        """Returns the CacheEntry for kind and key, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, etag, last_modified, fetched FROM entries "
+                "WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        if row is None:
+            return None
+        value, etag, last_modified, fetched = row
+        return CacheEntry(json.loads(value), etag, last_modified, fetched)
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry.fetched < self.ttl
+
+    def put(self, kind, key, value, etag=None, last_modified=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(value), etag, last_modified,
+                 time.time()))
+
+    def touch(self, kind, key):
+        """Marks an entry as fresh again after it was revalidated."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE entries SET fetched = ? WHERE kind = ? AND key = ?",
+                (time.time(), kind, key))
+
+    def fetch(self, kind, key, url, as_json=True):
+        """Returns the value for kind and key, or None if it isn't cached
+        and can't be fetched from url.
+
+        A cached entry is returned straight away, and revalidated in the
+        background if it is stale. Otherwise url is fetched now.
+        """
+        entry = self.get(kind, key)
+        if entry is None:
+            return self.revalidate(kind, key, url, as_json)
+        if not self.is_fresh(entry):
+            self.refresh(kind, key, url, as_json)
+        return entry.value
+
+    def refresh(self, kind, key, url, as_json=True):
+        """Revalidates an entry in the background."""
+        submit(partial(self.revalidate, kind, key, url, as_json),
+               lambda _: None, priority=Priority.PREFETCH,
+               key=('charm-cache', self.path, kind, key))
+
+    def revalidate(self, kind, key, url, as_json=True):
+        """Fetches url, conditionally if kind and key are cached, and
+        stores the result.
+
+        :returns: the new or revalidated value, the cached value if the
+            request fails, or None if nothing is cached either
+        """
+        entry = self.get(kind, key)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        try:
+            r = charmstore_session().get(url, headers=headers)
+        except requests.RequestException as e:
+            log.debug("charm store request failed: {}".format(e))
+            return entry.value if entry is not None else None
+
+        if r.status_code == 304 and entry is not None:
+            self.touch(kind, key)
+            return entry.value
+        if not r.ok:
+            return entry.value if entry is not None else None
+
+        value = r.json() if as_json else r.text
+        self.put(kind, key, value, r.headers.get('ETag', None),
+                 r.headers.get('Last-Modified', None))
+        return value
+
+
+class TextLRU:
+
+    """ In-memory cache of strings, holding at most max_bytes of them
+
+    The least recently used strings are evicted first. Sizes are
+    measured with sys.getsizeof().
+    """
+
+    def __init__(self, max_bytes=TEXT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @classmethod
+    def for_config(cls, config):
+        """Returns a TextLRU sized by the 'text_cache_bytes' option if
+        set."""
+        return cls(config.getopt('text_cache_bytes') or TEXT_CACHE_BYTES)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def __setitem__(self, key, text):
+        size = sys.getsizeof(text)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= sys.getsizeof(self._entries.pop(key))
+            if size > self.max_bytes:
+                return
+            self._entries[key] = text
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= sys.getsizeof(evicted)
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -14,17 +14,21 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import logging
 from collections import defaultdict
 from concurrent.futures import Future
 from functools import partial
 from threading import RLock
 
-import requests
-
-from bundleplacer.async import submit
+from bundleplacer.async import (Priority, gather, map, recover, resolved,
+                                submit, then)
+from bundleplacer.charmcache import CharmCache, TextLRU
+from bundleplacer.charmstore_client import charmstore_session
 from bundleplacer.consts import DEFAULT_SERIES
 from bundleplacer.relationtype import RelationType
 
+log = logging.getLogger('bundleplacer')
+
 
 class CharmStoreID:
 
@@ -96,25 +100,83 @@ class CharmStoreID:
         return "\n".join(l)
 
 
+CHARMSTORE_URL = 'https://api.jujucharms.com/charmstore/v5'
+
+# bulk metadata requests are split so that no URL is longer than this,
+# or asks for more charms than METADATA_CHUNK_SIZE
+METADATA_URL_MAX = 2000
+METADATA_CHUNK_SIZE = 20
+
+# longest readme text kept, the UI only shows its opening
+README_MAX_CHARS = 1000
+
+
+def metadata_chunks(charm_ids, base_url):
+    """Splits charm_ids into lists that can each be appended to base_url
+    as id= parameters within METADATA_URL_MAX and METADATA_CHUNK_SIZE."""
+    chunk = []
+    length = len(base_url)
+    for charm_id in charm_ids:
+        id_length = len("&id=") + len(charm_id)
+        if chunk and (len(chunk) == METADATA_CHUNK_SIZE or
+                      length + id_length > METADATA_URL_MAX):
+            yield chunk
+            chunk = []
+            length = len(base_url)
+        chunk.append(charm_id)
+        length += id_length
+    if chunk:
+        yield chunk
+
+
+def trim_readme(text, max_chars=README_MAX_CHARS):
+    """Returns the first paragraph of a README that isn't a heading, cut
+    to max_chars."""
+    for p in text.strip().split("\n\n"):
+        lines = p.strip().splitlines()
+        # skip '# Heading' lines and 'Heading\n-------' paragraphs
+        if any(line.strip('=-') == '' for line in lines):
+            continue
+        lines = [line for line in lines if not line.startswith('#')]
+        if lines:
+            text = "\n".join(lines)
+            break
+    if len(text) > max_chars:
+        text = text[:max_chars - 1].rstrip() + "…"
+    return text
+
+
 class MetadataController:
 
-    def __init__(self, bundle, config, error_cb=None):
+    def __init__(self, bundle, config, error_cb=None, cache=None):
         self.bundle = bundle
         self.config = config
         self.error_cb = error_cb
+        # charm store responses kept between runs
+        if cache is None:
+            cache = CharmCache.for_config(config)
+        self.cache = cache
         self.series = bundle.series
         self.charm_ids = bundle.charm_ids
         # charm_name : charm_metadata full dict
         self.charm_info = {}
         # charm_name : requires/provides lists
         self.iface_info = {}
-        # charm_name : first paragraph of readme
-        self.readmes = {}
+        # short charm id : first paragraph of readme, least recently
+        # used dropped first
+        self.readmes = TextLRU.for_config(config)
+        # short charm id : pending readme Future
         self.readme_futures = {}
-        self.readme_callbacks = {}
+        self.readme_lock = RLock()
+        # short charm id : charm id to fetch its readme with
+        self._readme_ids = {}
         self.metadata_future = None
         self.metadata_future_lock = RLock()
+        # charms for a load() that waits on the one in progress
+        self._pending_batch = None
         self.info_callbacks = []
+        # called with the charm names in each chunk of metadata loaded
+        self.chunk_callbacks = []
         self.charms_providing_iface = defaultdict(list)
         self.charms_requiring_iface = defaultdict(list)
         self.get_recommended_charm_names()
@@ -141,92 +203,202 @@ class MetadataController:
         if len(charm_names_or_sources) == 0:
             return
 
-        if self.metadata_future:
-            # just wait for successive loads:
-            self.metadata_future.result()
-
         with self.metadata_future_lock:
-            self.metadata_future = submit(partial(self._do_load,
-                                                  charm_names_or_sources),
-                                          self.handle_search_error)
+            if self._pending_batch is not None:
+                # join the load already waiting for this one to finish
+                self._pending_batch.extend(charm_names_or_sources)
+                if done_cb:
+                    self.metadata_future.add_done_callback(done_cb)
+                return
+
+            batch = list(charm_names_or_sources)
+
+            def start(_=None):
+                with self.metadata_future_lock:
+                    if self._pending_batch is batch:
+                        self._pending_batch = None
+                return self._do_load(batch)
+
+            previous = self.metadata_future
+            if previous is None or previous.done():
+                self.metadata_future = start()
+            else:
+                # successive loads run one after another, without
+                # blocking the caller
+                self._pending_batch = batch
+                self.metadata_future = then(recover(previous,
+                                                    lambda e: None),
+                                            start)
+            if self.metadata_future.cancelled():
+                return
             if done_cb:
                 self.metadata_future.add_done_callback(done_cb)
             self.metadata_future.add_done_callback(self.handle_load_done)
 
     def _request_readme(self, charm_id, short_charm_id):
-        readme_url = ("https://api.jujucharms.com/charmstore"
-                      "/v5/{}/readme".format(charm_id))
-        r = requests.get(readme_url)
-        if r.ok:
-            t = r.text
-        else:
+        readme_url = "{}/{}/readme".format(CHARMSTORE_URL, charm_id)
+        key = CharmStoreID(charm_id).as_str_without_rev()
+        t = self.cache.fetch('readme', key, readme_url, as_json=False)
+        if t is None:
             t = "No README available"
+        else:
+            t = trim_readme(t)
         self.readmes[short_charm_id] = t
         return t
 
-    def request_readme(self, charm_id, short_charm_id):
-        rf = submit(
-            partial(self._request_readme, charm_id, short_charm_id),
-            lambda _: None)
-        self.readme_futures[short_charm_id] = rf
+    def request_readme(self, short_charm_id,
+                       priority=Priority.PREFETCH):
+        """Returns a Future for the readme of short_charm_id.
 
-        cb = self.readme_callbacks.get(short_charm_id, None)
-        if cb:
-            rf.add_done_callback(cb)
+        A pending request is shared, and moved up if priority is more
+        urgent than its own.
+        """
+        readme = self.readmes.get(short_charm_id, None)
+        if readme:
+            return resolved(readme)
+
+        with self.readme_lock:
+            charm_id = self._readme_ids.get(short_charm_id, short_charm_id)
+            rf = submit(
+                partial(self._request_readme, charm_id, short_charm_id),
+                lambda _: None, priority=priority,
+                key=('readme', short_charm_id))
+            if rf.cancelled():
+                # shutting down
+                return rf
+            if short_charm_id not in self.readme_futures:
+                self.readme_futures[short_charm_id] = rf
+                rf.add_done_callback(
+                    partial(self._readme_done, short_charm_id))
+        return rf
+
+    def _readme_done(self, short_charm_id, f):
+        with self.readme_lock:
+            if self.readme_futures.get(short_charm_id, None) is f:
+                del self.readme_futures[short_charm_id]
+
+    def prefetch_readmes(self, short_charm_ids):
+        for short_charm_id in short_charm_ids:
+            self.request_readme(short_charm_id)
 
     def _do_load(self, charm_names_or_sources):
+        """Returns a Future that is done once all of the charms are
+        loaded.
+
+        Charms are served from the cache when possible, and stale
+        entries are revalidated in the background. The rest are fetched
+        in chunks, concurrently, and each chunk is added as it arrives.
+        """
+        f = submit(partial(self._load_cached, charm_names_or_sources),
+                   self.handle_search_error)
+        if f.cancelled():
+            # shutting down
+            return f
+        return then(f, self._fetch_missing)
+
+    def _load_cached(self, charm_names_or_sources):
+        """Adds the cached charms, and returns the ids of the others."""
+        metas = {}
+        missing = []
+        for n in charm_names_or_sources:
+            key = CharmStoreID(n).as_str_without_rev()
+            entry = self.cache.get('meta', key)
+            if entry is None:
+                if key not in missing:
+                    missing.append(key)
+                continue
+            metas[key] = entry.value
+            if not self.cache.is_fresh(entry):
+                self.cache.refresh('meta', key, self._metadata_url(key))
+
+        if metas:
+            for charm_name, charm_dict in sorted(metas.items()):
+                self._add_metadata(charm_name, charm_dict)
+            self.handle_chunk_done(sorted(metas))
+        return missing
+
+    def _fetch_missing(self, missing):
+        return gather([submit(partial(self._load_chunk, chunk),
+                              self.handle_search_error)
+                       for chunk in self._metadata_chunks(missing)])
+
+    def _load_chunk(self, charm_ids):
+        metas = self._fetch_metadata(charm_ids)
+        for charm_name, charm_dict in sorted(metas.items()):
+            key = CharmStoreID(charm_name).as_str_without_rev()
+            self.cache.put('meta', key, charm_dict)
+            self._add_metadata(charm_name, charm_dict)
+        self.handle_chunk_done(sorted(metas))
+
+    def _metadata_url(self, id_no_rev):
+        return "{}/{}/meta/any?include=charm-metadata&" \
+            "include=charm-config".format(
+                CHARMSTORE_URL,
+                CharmStoreID(id_no_rev).as_str_without_rev(
+                    include_scheme=False))
+
+    def _bulk_metadata_url(self, charm_names_or_sources):
         ids = []
         for n in charm_names_or_sources:
             csid = CharmStoreID(n)
             ids.append("id={}".format(csid.as_str_without_rev()))
         ids_str = "&".join(ids)
-        url = 'https://api.jujucharms.com/charmstore/v5'
+        url = CHARMSTORE_URL
         url += '/meta/any?include=charm-metadata&'
         url += 'include=charm-config&'
         url += ids_str
-        r = requests.get(url)
+        return url
+
+    def _metadata_chunks(self, charm_ids):
+        return metadata_chunks(charm_ids, self._bulk_metadata_url([]))
+
+    def _fetch_metadata(self, charm_names_or_sources):
+        url = self._bulk_metadata_url(charm_names_or_sources)
+        r = charmstore_session().get(url)
         if not r.ok:
             raise Exception("metadata loading failed: charms={} url={}".format(
                 charm_names_or_sources, url))
-        metas = r.json()
+        return r.json()
 
-        for charm_name, charm_dict in sorted(metas.items()):
-            md = charm_dict["Meta"]["charm-metadata"]
-            csid = CharmStoreID(charm_name)
-            id_no_rev = csid.as_str_without_rev()
-            if id_no_rev in self.charm_info:
-                continue
+    def _add_metadata(self, charm_name, charm_dict):
+        md = charm_dict["Meta"]["charm-metadata"]
+        csid = CharmStoreID(charm_name)
+        id_no_rev = csid.as_str_without_rev()
+        if id_no_rev in self.charm_info:
+            return
 
-            self.charm_info[id_no_rev] = charm_dict
-
-            if csid.series == "":
-                csid.series = self.bundle.series
-                id_no_rev_with_default_series = csid.as_str_without_rev()
-                self.charm_info[id_no_rev_with_default_series] = charm_dict
-
-            self.request_readme(csid.as_str(include_scheme=False),
-                                csid.as_seriesname())
-
-            rd = md.get("Requires", {})
-            pd = md.get("Provides", {})
-            requires = []
-            provides = []
-            for relname, d in rd.items():
-                iface = d["Interface"]
-                requires.append((relname, iface))
-                self.charms_requiring_iface[iface].append((relname,
-                                                           id_no_rev))
-
-            for relname, d in pd.items():
-                iface = d["Interface"]
-                provides.append((relname, iface))
-                self.charms_providing_iface[iface].append((relname,
-                                                           id_no_rev))
-            provides.append(('juju-info', 'juju-info'))
-            self.charms_providing_iface['juju-info'].append(('juju-info',
-                                                             id_no_rev))
-            self.iface_info[id_no_rev] = dict(requires=requires,
-                                              provides=provides)
+        self.charm_info[id_no_rev] = charm_dict
+
+        if csid.series == "":
+            csid.series = self.bundle.series
+            id_no_rev_with_default_series = csid.as_str_without_rev()
+            self.charm_info[id_no_rev_with_default_series] = charm_dict
+
+        # readmes are fetched when they are asked for
+        with self.readme_lock:
+            self._readme_ids[csid.as_seriesname()] = csid.as_str(
+                include_scheme=False)
+
+        rd = md.get("Requires", {})
+        pd = md.get("Provides", {})
+        requires = []
+        provides = []
+        for relname, d in rd.items():
+            iface = d["Interface"]
+            requires.append((relname, iface))
+            self.charms_requiring_iface[iface].append((relname,
+                                                       id_no_rev))
+
+        for relname, d in pd.items():
+            iface = d["Interface"]
+            provides.append((relname, iface))
+            self.charms_providing_iface[iface].append((relname,
+                                                       id_no_rev))
+        provides.append(('juju-info', 'juju-info'))
+        self.charms_providing_iface['juju-info'].append(('juju-info',
+                                                         id_no_rev))
+        self.iface_info[id_no_rev] = dict(requires=requires,
+                                          provides=provides)
 
     def get_recommended_charms(self):
         if not self.loaded():
@@ -239,6 +411,34 @@ class MetadataController:
             return True
         return self.metadata_future.done()
 
+    def handle_chunk_done(self, charm_names):
+        """Runs the info callbacks waiting on any of the charms just
+        loaded, and then the chunk callbacks."""
+        with self.metadata_future_lock:
+            ready = [(n, cb) for n, cb in self.info_callbacks
+                     if n in self.charm_info]
+            self.info_callbacks = [(n, cb) for n, cb in self.info_callbacks
+                                   if n not in self.charm_info]
+        for charm_name, cb in ready:
+            try:
+                cb(self.charm_info[charm_name])
+            except Exception:
+                log.exception("charm info callback failed")
+        for cb in self.chunk_callbacks:
+            cb(charm_names)
+        # the bundle's own charms are shown first, so their readmes are
+        # worth fetching in the background
+        bundle_ids = set(CharmStoreID(i).as_str_without_rev()
+                         for i in self.charm_ids)
+        self.prefetch_readmes(self._short_charm_id(n) for n in charm_names
+                              if n in bundle_ids)
+
+    def _short_charm_id(self, charm_name):
+        csid = CharmStoreID(charm_name)
+        if csid.series == "":
+            csid.series = self.bundle.series
+        return csid.as_seriesname()
+
     def handle_load_done(self, future):
         for charm_name, cb in self.info_callbacks:
             try:
@@ -251,34 +451,28 @@ class MetadataController:
             self.load([charm_name])
 
     def get_provides(self, charm_name):
-        if not self.loaded():
+        if charm_name not in self.iface_info and not self.loaded():
             return []
         return self.iface_info[charm_name]['provides']
 
     def get_requires(self, charm_name):
-        if not self.loaded():
+        if charm_name not in self.iface_info and not self.loaded():
             return []
         return self.iface_info[charm_name]['requires']
 
     def get_charm_info(self, charm_name, cb):
-        if not self.loaded():
-            self.info_callbacks.append((charm_name, cb))
+        # a charm is available as soon as its chunk has loaded
+        if charm_name not in self.charm_info and not self.loaded():
+            with self.metadata_future_lock:
+                self.info_callbacks.append((charm_name, cb))
             return None
         cb(self.charm_info[charm_name])
         return self.charm_info[charm_name]
 
     def get_readme(self, short_charm_id, cb):
-        readme = self.readmes.get(short_charm_id, None)
-        if readme:
-            f = submit(lambda: readme, None)
-            f.add_done_callback(cb)
-            return
-
-        readme_f = self.readme_futures.get(short_charm_id, None)
-        if readme_f:
-            readme_f.add_done_callback(cb)
-        else:
-            self.readme_callbacks[short_charm_id] = cb
+        rf = self.request_readme(short_charm_id, Priority.VISIBLE)
+        if not rf.cancelled():
+            rf.add_done_callback(cb)
 
     def get_services_for_iface(self, iface, reltype):
         services = []
@@ -300,7 +494,7 @@ class MetadataController:
     def get_resources(self, charm):
         resource_url = ("https://api.jujucharms.com/charmstore/v5/meta/any"
                         "?include=resources&id={}".format(charm))
-        r = requests.get(resource_url)
+        r = charmstore_session().get(resource_url)
         if r.ok:
             resources = r.json()
             resources = resources[charm]['Meta']['resources']
@@ -324,61 +518,71 @@ class CharmStoreAPI:
     """
     _cache = {}
     _cachelock = RLock()
+    # series : [(charm_name, Future)] waiting for the next bulk lookup
+    _batches = {}
 
     def __init__(self, series):
         self.baseurl = 'https://api.jujucharms.com/charmstore/v5'
         self.series = series
 
-    def _do_remote_lookup(self, charm_name, metakey):
-        url = (self.baseurl + '/meta/' +
-               'any?include=charm-metadata&id={}/{}'.format(self.series,
-                                                            charm_name))
-        r = requests.get(url)
-        rj = r.json()
-        if len(rj.items()) != 1:
-            raise Exception("Got wrong number of results from charm store")
-        entity = list(rj.values())[0]
+    def _do_remote_lookups(self, batch):
+        """Looks up every charm in batch with as few meta/any requests as
+        possible, and sets their futures."""
         with CharmStoreAPI._cachelock:
-            CharmStoreAPI._cache[charm_name] = entity
-        return entity
-
-    def _wait_for_pending_lookup(self, f, charm_name, metakey):
-        try:
-            entity = f.result()
-        except:
-            return None
-
+            if CharmStoreAPI._batches.get(self.series) is batch:
+                del CharmStoreAPI._batches[self.series]
+            futures = dict(batch)
+
+        base_url = self.baseurl + '/meta/any?include=charm-metadata&'
+        ids = ["{}/{}".format(self.series, n) for n in futures]
+        error = None
+        for chunk in metadata_chunks(ids, base_url):
+            url = base_url + "&".join("id={}".format(i) for i in chunk)
+            try:
+                r = charmstore_session().get(url)
+                rj = r.json()
+            except Exception as e:
+                error = e
+                rj = {}
+            found = {CharmStoreID(k).name: v for k, v in rj.items()}
+            for charm_id in chunk:
+                charm_name = charm_id.split('/', 1)[1]
+                entity = found.get(charm_name, None)
+                if entity is None:
+                    futures[charm_name].set_exception(
+                        error or Exception("Charm {} not found in charm "
+                                           "store".format(charm_id)))
+                    continue
+                with CharmStoreAPI._cachelock:
+                    CharmStoreAPI._cache[charm_name] = entity
+                futures[charm_name].set_result(entity)
+        if error:
+            raise error
+
+    def _select(self, metakey, entity):
         if metakey is None:
             return entity
         return entity['Meta']['charm-metadata'][metakey]
 
     def _lookup(self, charm_name, metakey, exc_cb):
         with CharmStoreAPI._cachelock:
-            if charm_name in CharmStoreAPI._cache:
-                val = CharmStoreAPI._cache[charm_name]
-                if isinstance(val, Future):
-                    f = submit(partial(self._wait_for_pending_lookup,
-                                       val, charm_name, metakey),
-                               exc_cb)
-                else:
-                    if metakey is None:
-                        d = val
-                    else:
-                        d = val['Meta']['charm-metadata'][metakey]
-                    f = submit(lambda: d, exc_cb)
-            else:
-                whole_entity_f = submit(partial(self._do_remote_lookup,
-                                                charm_name,
-                                                metakey),
-                                        exc_cb)
-                CharmStoreAPI._cache[charm_name] = whole_entity_f
-
-                f = submit(partial(self._wait_for_pending_lookup,
-                                   whole_entity_f, charm_name,
-                                   metakey),
-                           exc_cb)
-
-        return f
+            val = CharmStoreAPI._cache.get(charm_name, None)
+            if val is None:
+                # lookups made before the batch starts share its request
+                val = Future()
+                CharmStoreAPI._cache[charm_name] = val
+                batch = CharmStoreAPI._batches.get(self.series, None)
+                if batch is None:
+                    batch = CharmStoreAPI._batches[self.series] = []
+                    submit(partial(self._do_remote_lookups, batch), exc_cb)
+                batch.append((charm_name, val))
+
+        if not isinstance(val, Future):
+            return resolved(self._select(metakey, val))
+        # a pending or failed lookup: exc_cb only hears about the
+        # failure from the first caller, the rest get None
+        return recover(map(val, partial(self._select, metakey)),
+                       lambda e: None)
 
     def get_summary(self, charm_name, exc_cb):
         return self._lookup(charm_name, 'Summary', exc_cb)
@@ -393,11 +597,11 @@ class CharmStoreAPI:
                    "&limit=20&include=charm-metadata&include=bundle-metadata")
             charm_url = url + "&type=charm&series={}".format(self.series)
             bundle_url = url + "&type=bundle"
-            cr = requests.get(charm_url)
+            cr = charmstore_session().get(charm_url)
             crj = cr.json()
-            br = requests.get(bundle_url)
+            br = charmstore_session().get(bundle_url)
             brj = br.json()
             return brj['Results'], crj['Results']
 
-        f = submit(_do_search, exc_cb)
+        f = submit(_do_search, exc_cb, priority=Priority.INTERACTIVE)
         return f
@@ -0,0 +1,96 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Shared HTTP session for charm store requests
+
+Keeps connections to the charm store alive between requests, so the
+requests made at startup share a few connections instead of each
+opening its own.
+"""
+
+import logging
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+log = logging.getLogger('bundleplacer')
+
+# seconds to wait to connect, and then for each read
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# connections kept open per host, enough for every async worker
+POOL_SIZE = 8
+
+RETRIES = 3
+# retries wait backoff_factor * (2 ** (retry - 1)) seconds
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class CharmStoreSession(requests.Session):
+
+    """ requests.Session with pooled keep-alive connections, a default
+    timeout, and GET retries with backoff on connection errors and 5xx
+    responses
+
+    Responses are gzip encoded when the server supports it.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, retries=RETRIES,
+                 backoff_factor=BACKOFF_FACTOR,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        super().__init__()
+        self.timeout = timeout
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUSES,
+                      raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=2,
+                                   pool_maxsize=pool_size,
+                                   max_retries=retry)
+        self.mount('https://', self.adapter)
+        self.mount('http://', self.adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+    def stats(self):
+        """Returns counts of requests sent, and of connections opened and
+        reused for them, over the hosts connected to."""
+        container = self.adapter.poolmanager.pools
+        pools = [p for p in (container.get(k) for k in container.keys())
+                 if p is not None]
+        n_requests = sum(p.num_requests for p in pools)
+        opened = sum(p.num_connections for p in pools)
+        return dict(requests=n_requests,
+                    connections_opened=opened,
+                    connections_reused=n_requests - opened)
+
+
+_session = None
+_session_lock = Lock()
+
+
+def charmstore_session():
+    """Returns the CharmStoreSession shared by all charm store requests."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = CharmStoreSession()
+        return _session
@@ -22,11 +22,13 @@ import sys
 import urwid
 
 from bundleplacer import async
+from bundleplacer.charmstore_client import charmstore_session
 from bundleplacer.config import Config
 from bundleplacer.controller import BundleWriter, PlacementController
 from bundleplacer.fixtures.maas import FakeMaasState
 from bundleplacer.log import setup_logger
-from bundleplacer.maas import connect_to_maas
+from bundleplacer.maas import (FederatedMaasState, connect_to_maas,
+                               connect_to_maas_regions)
 from bundleplacer.placerview import PlacerView
 from ubuntui.anchors import Footer, Header
 from ubuntui.ev import EventLoop
@@ -54,8 +56,18 @@ def parse_options(argv, test_args):
                             "on services in bundle")
         parser.add_argument("--fake-maas", dest="fake_maas",
                             action="store_true", default=False)
-    parser.add_argument("--maas-ip", dest="maas_ip", default=None)
-    parser.add_argument("--maas-cred", dest="maas_cred", default=None)
+        parser.add_argument("--fake-maas-nodes", dest="fake_maas_nodes",
+                            type=int, default=None,
+                            help="Generate this many fake MAAS nodes "
+                            "instead of reading share/maas-machines.json")
+        parser.add_argument("--fake-maas-seed", dest="fake_maas_seed",
+                            type=int, default=0)
+    parser.add_argument("--maas-ip", dest="maas_ip", default=None,
+                        help="MAAS API host, or a comma separated list "
+                        "of hosts to place across several MAAS regions")
+    parser.add_argument("--maas-cred", dest="maas_cred", default=None,
+                        help="MAAS API key, or a comma separated list "
+                        "with one key per --maas-ip host")
     parser.add_argument("-o", dest="out_filename", default=None)
     return parser.parse_args(argv)
 
@@ -72,20 +84,31 @@ def main():
     config.save()
 
     setup_logger(cfg_path=config.cfg_path)
+    async.set_workers(config.getopt('async_workers') or
+                      async.DEFAULT_WORKERS)
     log = logging.getLogger('bundleplacer')
     log.debug(opts.__dict__)
 
     log.info("Editing file: {}".format(opts.bundle_filename))
 
+    maas_clients = []
     if opts.maas_ip and opts.maas_cred:
-        creds = dict(api_host=opts.maas_ip,
-                     api_key=opts.maas_cred)
-        maas, maas_state = connect_to_maas(creds)
+        hosts = opts.maas_ip.split(',')
+        keys = opts.maas_cred.split(',')
+        if len(hosts) != len(keys):
+            print("Error: --maas-ip and --maas-cred need the same number "
+                  "of values")
+            return
+        creds = [dict(api_host=h, api_key=k) for h, k in zip(hosts, keys)]
+        if len(creds) == 1:
+            maas, maas_state = connect_to_maas(creds[0])
+            maas_clients = [maas]
+        else:
+            maas_clients, maas_state = connect_to_maas_regions(creds)
     elif 'fake_maas' in opts and opts.fake_maas:
-        maas = None
-        maas_state = FakeMaasState()
+        maas_state = FakeMaasState(count=opts.fake_maas_nodes,
+                                   seed=opts.fake_maas_seed)
     else:
-        maas = None
         maas_state = None
 
     try:
@@ -95,8 +118,13 @@ def main():
         print("Error: " + e.args[0])
         return
 
+    def shutdown():
+        async.shutdown()
+        if isinstance(maas_state, FederatedMaasState):
+            maas_state.shutdown()
+
     def cb():
-        if maas:
+        for maas in maas_clients:
             maas.tag_name(maas.nodes)
 
         bw = BundleWriter(placement_controller)
@@ -107,7 +135,7 @@ def main():
             if os.path.exists(outfn):
                 shutil.copy2(outfn, outfn + '~')
         bw.write_bundle(outfn)
-        async.shutdown()
+        shutdown()
         raise urwid.ExitMainLoop()
 
     has_maas = (maas_state is not None)
@@ -116,9 +144,11 @@ def main():
 
     def unhandled_input(key):
         if key in ['q', 'Q']:
-            async.shutdown()
+            shutdown()
             raise urwid.ExitMainLoop()
     EventLoop.build_loop(ui, STYLES, unhandled_input=unhandled_input)
     mainview.loop = EventLoop.loop
     mainview.update()
     EventLoop.run()
+    log.debug("charm store connections: {}".format(
+        charmstore_session().stats()))
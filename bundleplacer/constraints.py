@@ -0,0 +1,274 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Juju constraints, parsed once and matched against MAAS machines
+"""
+
+import logging
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+
+from bundleplacer.utils import human_to_mb, mb_to_human
+
+log = logging.getLogger('bundleplacer')
+
+# constraint key as written: normalized name
+ALIASES = {'mem': 'mem',
+           'cores': 'cpu_cores',
+           'cpu-cores': 'cpu_cores',
+           'cpu_cores': 'cpu_cores',
+           'root-disk': 'root-disk',
+           'storage': 'root-disk',
+           'arch': 'arch',
+           'tags': 'tags',
+           'zones': 'zones'}
+
+# normalized name: key of the matching value in MaasMachine.machine
+HARDWARE_KEYS = {'mem': 'memory',
+                 'cpu_cores': 'cpu_count',
+                 'root-disk': 'storage',
+                 'arch': 'architecture',
+                 'tags': 'tag_names',
+                 'zones': 'zone'}
+
+NUMERIC = ['mem', 'cpu_cores', 'root-disk']
+
+
+def size_value(v):
+    """Returns a size in megabytes, parsing human sizes like '10G'.
+
+    Raises ValueError for anything that isn't a size.
+    """
+    if isinstance(v, str):
+        if len(v) == 0:
+            raise ValueError("empty size")
+        try:
+            v = int(v) if v.isdecimal() else human_to_mb(v)
+        except KeyError:
+            raise ValueError("unknown size suffix in {!r}".format(v))
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        raise ValueError("not a size: {!r}".format(v))
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return v
+
+
+def base_arch(arch):
+    """'amd64/generic' -> 'amd64'"""
+    if isinstance(arch, str):
+        return arch.split('/')[0]
+    return arch
+
+
+def _name_list(v):
+    if isinstance(v, str):
+        v = v.split(',')
+    return [n.strip() for n in v if n.strip()]
+
+
+def _parse_tags(v):
+    """Returns (required tags, excluded '^tags')"""
+    names = _name_list(v)
+    return (frozenset(n for n in names if not n.startswith('^')),
+            frozenset(n[1:] for n in names if n.startswith('^')))
+
+
+_PARSERS = {'mem': size_value,
+            'cpu_cores': size_value,
+            'root-disk': size_value,
+            'arch': str,
+            'tags': _parse_tags,
+            'zones': lambda v: frozenset(_name_list(v))}
+
+
+def _check_numeric(have, want):
+    if have == '*':
+        return True
+    try:
+        return float(have) >= want
+    except (TypeError, ValueError):
+        return False
+
+
+def _check_arch(have, want):
+    return have == '*' or base_arch(have) == want
+
+
+def _check_tags(have, want):
+    required, excluded = want
+    have = set(have or [])
+    return required.issubset(have) and have.isdisjoint(excluded)
+
+
+def _check_zones(have, want):
+    if isinstance(have, dict):
+        have = have.get('name', None)
+    return have in want
+
+
+_CHECKS = {'mem': _check_numeric,
+           'cpu_cores': _check_numeric,
+           'root-disk': _check_numeric,
+           'arch': _check_arch,
+           'tags': _check_tags,
+           'zones': _check_zones}
+
+
+def _spec_items(spec):
+    if spec is None:
+        return []
+    if isinstance(spec, str):
+        items = []
+        for term in spec.split():
+            k, _, v = term.partition('=')
+            items.append((k, v))
+        return items
+    return list(spec.items())
+
+
+def _label(name, value):
+    if name in ['mem', 'root-disk']:
+        return "{}={}".format(name, mb_to_human(value))
+    if name == 'tags':
+        required, excluded = value
+        return "tags={}".format(",".join(sorted(required) +
+                                         ["^" + t for t in sorted(excluded)]))
+    if name == 'zones':
+        return "zones={}".format(",".join(sorted(value)))
+    return "{}={}".format(name, value)
+
+
+class Constraints(Mapping):
+
+    """Juju constraints from a bundle string like 'mem=4G cores=2' or a
+    dict, parsed once into normalized values.
+
+    As a mapping it has the normalized names (mem, cpu_cores, root-disk,
+    arch, tags, zones) as keys, with sizes in megabytes. Keys it doesn't
+    know, and values it can't parse, are kept in 'other' and ignored when
+    matching. Two Constraints
+    with the same normalized values are equal and hash the same.
+
+    raw is the value it was compiled from, for passing back to juju.
+    """
+
+    def __init__(self, spec=None):
+        self.raw = spec
+        self._values = OrderedDict()
+        self.other = OrderedDict()
+        checks = []
+        for key, value in _spec_items(spec):
+            name = ALIASES.get(key, None)
+            if name is None:
+                self.other[key] = value
+                continue
+            try:
+                parsed = _PARSERS[name](value)
+            except (TypeError, ValueError) as e:
+                log.warning("Ignoring constraint {}={}: {}".format(
+                    key, value, e))
+                self.other[key] = value
+                continue
+            self._values[name] = parsed
+            checks.append((key, name, parsed))
+        # (key as written, normalized name, parsed value)
+        self.checks = tuple(checks)
+        self._labels = {key: _label(name, value)
+                        for key, name, value in checks}
+        self._hash_key = tuple(sorted(self._values.items()))
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Constraints):
+            return self._hash_key == other._hash_key
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._hash_key)
+
+    @property
+    def mem(self):
+        return self._values.get('mem', None)
+
+    @property
+    def cpu_cores(self):
+        return self._values.get('cpu_cores', None)
+
+    @property
+    def root_disk(self):
+        return self._values.get('root-disk', None)
+
+    @property
+    def arch(self):
+        return self._values.get('arch', None)
+
+    def check(self, machine):
+        """Returns (bool, [keys of the constraints machine fails]), with
+        keys as they were written."""
+        hw = machine.machine
+        failed = [key for key, name, value in self.checks
+                  if not _CHECKS[name](hw.get(HARDWARE_KEYS[name], None),
+                                       value)]
+        return (len(failed) == 0, failed)
+
+    def matches(self, machine):
+        hw = machine.machine
+        for key, name, value in self.checks:
+            if not _CHECKS[name](hw.get(HARDWARE_KEYS[name], None), value):
+                return False
+        return True
+
+    def explain(self, machine):
+        """Returns human readable descriptions of the failed constraints."""
+        return [self._labels[key] for key in self.check(machine)[1]]
+
+    def __str__(self):
+        terms = []
+        for name, value in self._values.items():
+            if name == 'cpu_cores':
+                terms.append("cores={}".format(value))
+            elif name in ['mem', 'root-disk']:
+                terms.append("{}={}M".format(name, value))
+            else:
+                terms.append(_label(name, value))
+        terms += ["{}={}".format(k, v) for k, v in self.other.items()]
+        return " ".join(terms)
+
+    def __repr__(self):
+        return "<Constraints {}>".format(self)
+
+
+@lru_cache(maxsize=256)
+def _compile_string(spec):
+    return Constraints(spec)
+
+
+def compile_constraints(spec):
+    """Returns Constraints for a constraints string, dict, None or an
+    already compiled Constraints."""
+    if isinstance(spec, Constraints):
+        return spec
+    if isinstance(spec, str):
+        return _compile_string(spec)
+    return Constraints(spec)
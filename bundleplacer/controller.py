@@ -15,14 +15,22 @@
 
 import copy
 import logging
+import os
 from collections import Counter, defaultdict
+from contextlib import contextmanager
 from multiprocessing import cpu_count
 
 import yaml
 
+from bundleplacer.assignmentstore import AssignmentStore
 from bundleplacer.assignmenttype import AssignmentType, label_to_atype
 from bundleplacer.bundle import Bundle
-from bundleplacer.maas import MaasMachineStatus, satisfies
+from bundleplacer.constraints import compile_constraints
+from bundleplacer.fleet import FleetIndex
+from bundleplacer.machine import hardware_number
+from bundleplacer.maas import MaasMachineStatus
+from bundleplacer.servicegraph import ServiceGraph
+from bundleplacer.solver import get_solver
 from bundleplacer.state import ServiceState
 
 log = logging.getLogger('bundleplacer')
@@ -48,35 +56,36 @@ class PlaceholderMachine:
         self.system_id = instance_id
         self.machine_id = -1
         self.display_name = name
-        def_cons = {'arch': '?',
-                    'cpu_count': 0,
-                    'cpu_cores': 0,
-                    'memory': 0,
-                    'mem': 0,
-                    'storage': 0}
-        if constraints is None:
-            self.constraints = def_cons
-        else:
-            self.constraints = constraints
+        self.constraints = compile_constraints(constraints)
+        c = self.constraints
+        self._hardware = {'architecture': c.arch or '?',
+                          'cpu_count': c.cpu_cores or 0,
+                          'memory': c.mem or 0,
+                          'storage': c.root_disk or 0}
+        # hardware keys given directly, as MAAS would report them
+        self._hardware.update(c.other)
+        self.cpu_count = hardware_number(self._hardware['cpu_count'])
+        self.mem_mb = hardware_number(self._hardware['memory'])
+        self.storage_mb = hardware_number(self._hardware['storage'])
 
     @property
     def arch(self):
-        return self.constraints['arch']
+        return self._hardware['architecture']
 
     @property
     def cpu_cores(self):
-        return self.constraints['cpu_cores']
+        return self._hardware['cpu_count']
 
     def filter_label(self):
         return self.display_name
 
     @property
     def machine(self):
-        return self.constraints
+        return self._hardware
 
     @property
     def mem(self):
-        return self.constraints['mem']
+        return self._hardware['memory']
 
     @property
     def status(self):
@@ -84,7 +93,7 @@ class PlaceholderMachine:
 
     @property
     def storage(self):
-        return self.constraints['storage']
+        return self._hardware['storage']
 
     @property
     def hostname(self):
@@ -99,6 +108,12 @@ class PlacementError(Exception):
     "Generic exception class for placement related errors"
 
 
+class PlacementRollback(Exception):
+
+    """Raise inside PlacementController.batch() to discard the changes
+    made in the batch without propagating an error."""
+
+
 class PlacementController:
 
     """Keeps state of current machines and their assigned services.
@@ -119,13 +134,31 @@ class PlacementController:
             self.maasinfo['server_hostname'] = self.maas_state.server_hostname
         self._machines = []
         self._bundle_placeholders = []
+        # instance_id: machine, refreshed whenever machines() is read
+        self._machines_by_id = {}
+        # service_name: Service, refreshed when the bundle changes
+        self._services_by_name = {}
+        self._services_version = None
         self.sub_placeholder = PlaceholderMachine('_subordinates',
                                                   'Subordinate Charms')
         self.def_placeholder = PlaceholderMachine('_default',
                                                   'Juju Default')
-        # assignments is {id: {atype: [service]}}
-        self.assignments = defaultdict(lambda: defaultdict(list))
-        self.deployments = defaultdict(lambda: defaultdict(list))
+        # assignments is {id: {atype: [service]}}, with a reverse
+        # index of {service: {atype: [id]}}
+        self.assignments = AssignmentStore()
+        self.deployments = AssignmentStore()
+        # kept up to date by update() as placements change
+        self._assigned_services = set()
+        self._deployed_services = set()
+        # built from the bundle on demand, see _service_graph()
+        self._graph = None
+        self._graph_version = None
+        # PlacementReport from the last gen_defaults()
+        self.placement_report = None
+        # see begin_batch()
+        self._batch_depth = 0
+        self._batch_saved_states = []
+        self._batch_pending = set()
         mf = config.getopt('metadata_filename')
         self.bundle = Bundle(filename=config.getopt('bundle_filename'),
                              metadatafilename=mf)
@@ -142,41 +175,167 @@ class PlacementController:
 
         Pairs with update_from_controller() to 'commit' those temporary
         assignments to the 'main' controller.
+
+        The copy shares this controller's bundle and machines, and its
+        assignments are copy-on-write snapshots of ours, so taking it
+        does not depend on the number of placements.
         """
-        newpc = PlacementController(maas_state=self.maas_state,
-                                    config=self.config)
-        newpc.assignments = copy.copy(self.assignments)
-        newpc.deployments = copy.copy(self.deployments)
-        newpc._machines = self._machines
-        newpc.reset_assigned_deployed()
+        newpc = copy.copy(self)
+        newpc.assignments = self.assignments.copy()
+        newpc.deployments = self.deployments.copy()
+        newpc._assigned_services = set(self._assigned_services)
+        newpc._deployed_services = set(self._deployed_services)
+        newpc._graph = None
+        newpc._bundle_placeholders = list(self._bundle_placeholders)
+        newpc._machines_by_id = dict(self._machines_by_id)
+        newpc._batch_depth = 0
+        newpc._batch_saved_states = []
+        newpc._batch_pending = set()
         return newpc
 
     def update_from_controller(self, other):
         """Updates internal structures based on other's.
-        For integrating temporarily tracked updates."""
+        For integrating temporarily tracked updates.
 
-        self.assignments = other.assignments
-        self.deployments = other.deployments
-        self.reset_assigned_deployed()
+        Only the machines whose placements differ are touched, and only
+        the services placed on them are updated.
+        """
+        changed = self.assignments.update_from(other.assignments)
+        changed |= self.deployments.update_from(other.deployments)
+        self.update(changed)
 
     def set_assignments_from_deployments(self):
         """Reset deployment state of all services. Useful after reading a file
         from a previous install.
         """
         self.assignments = self.deployments
-        self.deployments = defaultdict(lambda: defaultdict(list))
+        self.deployments = AssignmentStore()
         self.reset_assigned_deployed()
 
     def __repr__(self):
         return "<PlacementController {}>".format(id(self))
 
-    def update(self):
-        self.reset_assigned_deployed()
+    def update(self, services=None):
+        """Refreshes the sets of assigned and deployed services.
+
+        services: the services whose placements changed. If None, both
+        sets are recomputed from scratch.
+
+        If PLACEMENT_CHECK_STATE is set in the environment, incremental
+        updates are checked against a full recompute.
+        """
+        if self._batch_depth > 0:
+            if services is None or self._batch_pending is None:
+                self._batch_pending = None
+            else:
+                self._batch_pending.update(services)
+            return
+
+        if services is None:
+            self.reset_assigned_deployed()
+            return
+
+        for service in services:
+            self._update_assigned_deployed(service)
+            if self._graph is not None:
+                self._update_graph(service)
+
+        if os.environ.get('PLACEMENT_CHECK_STATE', None) is not None:
+            self._check_assigned_deployed()
+
+    def begin_batch(self):
+        """Starts a batch of placement changes.
+
+        Until the matching commit_batch(), changes to assignments and
+        deployments are applied but the derived assigned/deployed state
+        is only recomputed once, at commit. rollback_batch() restores
+        the placement state from before begin_batch().
+
+        Nested batches are committed with the outermost one, but each
+        can be rolled back on its own. Changes to the bundle itself are
+        not rolled back.
+        """
+        if self._batch_depth == 0:
+            self._batch_pending = set()
+        self._batch_saved_states.append((self.assignments.copy(),
+                                         self.deployments.copy(),
+                                         set(self._assigned_services),
+                                         set(self._deployed_services)))
+        self._batch_depth += 1
+
+    def commit_batch(self):
+        if self._batch_depth == 0:
+            return
+        self._batch_depth -= 1
+        self._batch_saved_states.pop()
+        if self._batch_depth > 0:
+            return
+        pending = self._batch_pending
+        self._batch_pending = set()
+        self.update(pending)
+
+    def rollback_batch(self):
+        """Discards the changes made since the innermost begin_batch(),
+        and ends that batch. Any enclosing batch carries on.
+        Does nothing if no batch is in progress."""
+        if self._batch_depth == 0:
+            return
+        (self.assignments, self.deployments,
+         self._assigned_services,
+         self._deployed_services) = self._batch_saved_states.pop()
+        self._graph = None
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self._batch_pending = set()
+
+    @contextmanager
+    def batch(self):
+        """Context manager wrapping begin_batch() and commit_batch().
+
+        If the block raises, the batch is rolled back. PlacementRollback
+        is swallowed, any other exception is re-raised.
+        """
+        self.begin_batch()
+        try:
+            yield self
+        except PlacementRollback:
+            self.rollback_batch()
+        except BaseException:
+            self.rollback_batch()
+            raise
+        else:
+            self.commit_batch()
 
     def is_placeholder(self, mid):
         return mid in [self.sub_placeholder.instance_id,
                        self.def_placeholder.instance_id]
 
+    def fleet_index(self):
+        """Returns the maas_state's FleetIndex of its machine pool, or None
+        when there is no maas_state to index."""
+        fleet_index = getattr(self.maas_state, 'fleet_index', None)
+        if fleet_index is None:
+            return None
+        index = fleet_index()
+        return index if isinstance(index, FleetIndex) else None
+
+    def satisfying_ids(self, machines, constraints):
+        """Returns the set of instance ids of machines satisfying
+        constraints.
+
+        Machines in the maas_state's pool are looked up in its cached
+        FleetIndex, any others, such as placeholders, are checked one by
+        one.
+        """
+        constraints = compile_constraints(constraints)
+        index = self.fleet_index()
+        if index is None:
+            ids, others = set(), machines
+        else:
+            ids, others = index.matching_among(machines, constraints)
+        ids.update(m.instance_id for m in others if constraints.matches(m))
+        return ids
+
     def machines(self, include_placeholders=True):
         """Returns all machines known to the controller.
 
@@ -189,12 +348,35 @@ class PlacementController:
         else:
             ms = self._machines
 
+        all_machines = ms + [self.sub_placeholder, self.def_placeholder] + \
+            self._bundle_placeholders
+        self._machines_by_id = {m.instance_id: m for m in all_machines}
+
         if include_placeholders:
-            return ms + [self.sub_placeholder, self.def_placeholder] + \
-                self._bundle_placeholders
+            return all_machines
         else:
             return ms
 
+    def get_machine(self, instance_id):
+        """Returns the machine with the given instance_id, or None.
+
+        Uses the index built by the last call to machines(), refreshing
+        it once if instance_id is not found.
+        """
+        m = self._machines_by_id.get(instance_id, None)
+        if m is None:
+            self.machines()
+            m = self._machines_by_id.get(instance_id, None)
+        return m
+
+    def get_service(self, service_name):
+        """Returns the Service named service_name, or None."""
+        if self._services_version != self.bundle.version:
+            self._services_by_name = {s.service_name: s
+                                      for s in self.bundle.services}
+            self._services_version = self.bundle.version
+        return self._services_by_name.get(service_name, None)
+
     def machines_pending(self, include_placeholders=False):
         """Returns a list of machines that have services assigned to them
         which are not yet deployed.
@@ -205,11 +387,8 @@ class PlacementController:
         """
         ms = []
         for m in self.machines(include_placeholders=include_placeholders):
-            if m.instance_id in self.assignments:
-                n = sum(len(cl) for _, cl in
-                        self.assignments[m.instance_id].items())
-                if n > 0:
-                    ms.append(m)
+            if self.assignments.count_for_machine(m.instance_id) > 0:
+                ms.append(m)
         return ms
 
     def add_new_service(self, charm_name, charm_dict,
@@ -225,8 +404,9 @@ class PlacementController:
 
     def update_from_bundle(self):
         self.add_bundle_machines(self.bundle.machines)
-        self.add_bundle_assignments(self.bundle.assignments)
-        self.add_subordinates(self.bundle.services)
+        with self.batch():
+            self.add_bundle_assignments(self.bundle.assignments)
+            self.add_subordinates(self.bundle.services)
 
     def merge_bundle(self, bundle_dict):
         new_bundle = Bundle(bundle_data=bundle_dict)
@@ -236,8 +416,9 @@ class PlacementController:
         t = self.bundle.update(new_bundle)
         new_machines, new_services, new_assignments = t
         self.add_bundle_machines(new_machines)
-        self.add_bundle_assignments(new_assignments)
-        self.add_subordinates(new_services)
+        with self.batch():
+            self.add_bundle_assignments(new_assignments)
+            self.add_subordinates(new_services)
         return new_machines, new_services, new_assignments
 
     def add_bundle_machines(self, machines):
@@ -245,11 +426,15 @@ class PlacementController:
             pm = PlaceholderMachine(mid, "bundle-machine-" + mid,
                                     md.get('constraints', {}))
             self._bundle_placeholders.append(pm)
+            self._machines_by_id[pm.instance_id] = pm
 
     def add_bundle_assignments(self, new_as):
+        with self.batch():
+            self._add_bundle_assignments(new_as)
+
+    def _add_bundle_assignments(self, new_as):
         for sname, tostrs in new_as.items():
-            service = next((s for s in self.bundle.services
-                            if s.service_name == sname), None)
+            service = self.get_service(sname)
             if service is None:
                 continue
             for tostr in tostrs:
@@ -259,23 +444,31 @@ class PlacementController:
                     atype = label_to_atype([atype])[0]
                 else:
                     atype, mid = AssignmentType.DEFAULT, parts[0]
-                machine = next((m for m in self.machines() if
-                                m.instance_id == mid), None)
+                machine = self.get_machine(mid)
                 if machine:
                     self.assign(machine, service, atype)
 
     def add_subordinates(self, all_services):
         """looks through all_services and assigns any subordinates to the
         subordinate placeholder."""
-        d = self.assignments[self.sub_placeholder.instance_id]
-        al = d[AssignmentType.DEFAULT]
-        al += [s for s in all_services if s.subordinate]
+        with self.batch():
+            for s in all_services:
+                if s.subordinate:
+                    self._add_assignment(self.sub_placeholder.instance_id, s,
+                                         AssignmentType.DEFAULT)
 
     def remove_service(self, service_name):
+        service = self.get_service(service_name)
         self.bundle.remove_service(service_name)
+        if service is not None:
+            self.assignments.remove_service(service)
+            self.deployments.remove_service(service)
+            self.update([service])
 
     def scale_service(self, service_name, amount):
         self.bundle.scale_service(service_name, amount)
+        # the bundle now has a new Service object with the new num_units
+        self.update([self.get_service(service_name)])
 
     def toggle_relation(self, s1_name, s1_rel, s2_name, s2_rel):
         if self.bundle.is_related(s1_name, s1_rel, s2_name, s2_rel):
@@ -310,36 +503,31 @@ class PlacementController:
 
     def assign(self, machine, service, atype):
         if not service.allow_multi_units:
-            for m, d in self.assignments.items():
-                for at, l in d.items():
-                    if service in l:
-                        l.remove(service)
+            self.assignments.remove_service(service)
 
-        self.assignments[machine.instance_id][atype].append(service)
-        log.debug(self.assignments)
-        self.update()
+        self._add_assignment(machine.instance_id, service, atype)
+
+    def _add_assignment(self, machine_id, service, atype):
+        self.assignments.add(machine_id, service, atype)
+        log.debug("assigned {} to {} as {}".format(service.service_name,
+                                                   machine_id, atype))
+        self.update([service])
 
     def mark_deployed(self, machine, service, atype):
-        self.deployments[machine.instance_id][atype].append(service)
-        self.assignments[machine.instance_id][atype].remove(service)
-        self.update()
+        self.assignments.remove(machine.instance_id, service, atype)
+        self.deployments.add(machine.instance_id, service, atype)
+        self.update([service])
 
-    def _get_machines_by_atype(self, a_dict, service):
+    def _get_machines_by_atype(self, store, service):
         "Helper for get_assignments and get_deployments"
-        all_machines = self.machines()
-
         machines_by_atype = defaultdict(list)
-        for m_id, d in a_dict.items():
-            m = next((m for m in all_machines
-                      if m.instance_id == m_id), None)
-            if not m:
-                log.debug("can't find machine for m_id '{}'".format(m_id))
-                continue
-
-            for atype, assignment_list in d.items():
-                for c in assignment_list:
-                    if c == service:
-                        machines_by_atype[atype].append(m)
+        for atype, m_ids in store.machines_for_service(service).items():
+            for m_id in m_ids:
+                m = self.get_machine(m_id)
+                if not m:
+                    log.debug("can't find machine for m_id '{}'".format(m_id))
+                    continue
+                machines_by_atype[atype].append(m)
 
         return machines_by_atype
 
@@ -360,7 +548,7 @@ class PlacementController:
                                            service)
 
     def clear_all_assignments(self):
-        self.assignments = defaultdict(lambda: defaultdict(list))
+        self.assignments = AssignmentStore()
         self.update()
 
     def clear_assignments(self, m):
@@ -370,67 +558,96 @@ class PlacementController:
         if m.instance_id not in self.assignments:
             return
 
-        del self.assignments[m.instance_id]
-        self.update()
+        removed = self.assignments.clear_machine(m.instance_id)
+        self.update(set(service for service, _ in removed))
 
     def remove_one_assignment(self, m, cc):
-        ad = self.assignments[m.instance_id]
-        for atype, assignment_list in ad.items():
-            if cc in assignment_list:
-                assignment_list.remove(cc)
-                break
-        self.update()
+        self.assignments.remove_any(m.instance_id, cc)
+        self.update([cc])
 
     def assignments_for_machine(self, m):
         """Returns all assignments for given machine
 
         {assignment_type: [service]}
         """
-        return self.assignments[m.instance_id]
+        return self.assignments.services_for_machine(m.instance_id)
 
     def deployments_for_machine(self, m):
         """Returns deployments
         {atype: [service]}
         """
-        return self.deployments[m.instance_id]
+        return self.deployments.services_for_machine(m.instance_id)
 
     def is_assigned_to(self, service, machine):
-        assignment_dict = self.assignments[machine.instance_id]
-        for atype, services in assignment_dict.items():
-            if service in services:
-                return True
-        return False
+        return self.assignments.is_placed_on(service, machine.instance_id)
 
     def is_deployed_to(self, service, machine):
-        dd = self.deployments[machine.instance_id]
-        for atype, services in dd.items():
-            if service in services:
-                return True
-        return False
+        return self.deployments.is_placed_on(service, machine.instance_id)
 
     def set_all_assignments(self, assignments):
-        self.assignments = assignments
+        """Replaces all assignments.
+
+        assignments is either an AssignmentStore or a dict like
+        {id: {atype: [service]}}, as returned by gen_defaults().
+        """
+        if isinstance(assignments, AssignmentStore):
+            self.assignments = assignments
+        else:
+            self.assignments = AssignmentStore(assignments)
         self.update()
 
     def reset_assigned_deployed(self):
-        self._assigned_services = set()
-        self._deployed_services = set()
-        for cc in self.services():
-            ad = self.get_assignments(cc)
-            is_assigned = False
-            for atype, al in ad.items():
-                if len(al) > 0:
-                    is_assigned = True
-            if is_assigned:
-                self._assigned_services.add(cc)
-
-            dd = self.get_deployments(cc)
-            is_deployed = False
-            for atype, dl in dd.items():
-                if len(dl) > 0:
-                    is_deployed = True
-            if is_deployed:
-                self._deployed_services.add(cc)
+        (self._assigned_services,
+         self._deployed_services) = self._compute_assigned_deployed()
+        self._graph = None
+
+    def _compute_assigned_deployed(self):
+        # keep the bundle's Service objects, not the equal ones the
+        # stores were given
+        assigned = set(self.assignments.services())
+        deployed = set(self.deployments.services())
+        services = self.services()
+        return (set(s for s in services if s in assigned),
+                set(s for s in services if s in deployed))
+
+    def _update_assigned_deployed(self, service):
+        """Updates the assigned and deployed sets for a single service."""
+        current = self.get_service(service.service_name)
+        if current is None or current != service:
+            self._assigned_services.discard(service)
+            self._deployed_services.discard(service)
+            return
+
+        for store, placed in [(self.assignments, self._assigned_services),
+                              (self.deployments, self._deployed_services)]:
+            # an equal Service may be an older copy, e.g. from before
+            # scale_service(), so replace it rather than add to it
+            placed.discard(current)
+            if store.count_for_service(current) > 0:
+                placed.add(current)
+
+    def _check_assigned_deployed(self):
+        """Compares the incrementally maintained sets with a full recompute,
+        logging any differences. Keeps the recomputed sets."""
+        assigned, deployed = self._compute_assigned_deployed()
+        if assigned != self._assigned_services:
+            log.error("assigned services out of sync: have {}, "
+                      "expected {}".format(self._assigned_services,
+                                           assigned))
+        if deployed != self._deployed_services:
+            log.error("deployed services out of sync: have {}, "
+                      "expected {}".format(self._deployed_services,
+                                           deployed))
+        self._assigned_services = assigned
+        self._deployed_services = deployed
+
+        if self._graph is not None:
+            blocking = set(self._graph.blocking())
+            self._graph = None
+            if blocking != set(self._service_graph().blocking()):
+                log.error("service graph out of sync: blocking {}, "
+                          "expected {}".format(blocking,
+                                               self._graph.blocking()))
 
     def is_assigned(self, service):
         return service in self._assigned_services
@@ -458,36 +675,6 @@ class PlacementController:
         - OPTIONAL means that it is ok either way. deps and cons are unused
 
         """
-        state = ServiceState.OPTIONAL
-        conflicting = set()
-        depending = set()
-
-        def conflicts_with(other_service):
-            return (service.service_name in other_service.conflicts or
-                    other_service.service_name in service.conflicts)
-
-        def depends(a_service, b_service):
-            return b_service.service_name in a_service.depends
-
-        required_services = [c for c in self.services()
-                             if c.is_core]
-
-        planned_or_deployed = (self.assigned_services +
-                               required_services +
-                               self.deployed_services)
-
-        for other_service in planned_or_deployed:
-            if conflicts_with(other_service):
-                state = ServiceState.CONFLICTED
-                conflicting.add(other_service)
-            if depends(other_service, service):
-                if state != ServiceState.CONFLICTED:
-                    state = ServiceState.REQUIRED
-                depending.add(other_service)
-
-        if service.service_name in [c.service_name for c in required_services]:
-            state = ServiceState.REQUIRED
-
         n_required = service.required_num_units()
         # sanity check:
         if n_required > 1 and not service.allow_multi_units:
@@ -495,17 +682,24 @@ class PlacementController:
                       " - requires {} units but does not allow "
                       "multi units.".format(service.service_name, n_required))
 
-        n_units = (self.assignment_machine_count_for_service(service) +
-                   self.deployment_machine_count_for_service(service))
-
-        if state == ServiceState.OPTIONAL and \
-           n_units > 0 and n_units < n_required:
-            state = ServiceState.REQUIRED
-        elif state == ServiceState.REQUIRED and n_units >= n_required:
-            if n_units > 0:
-                state = ServiceState.OPTIONAL
-
-        return (state, list(conflicting), list(depending))
+        return self._service_graph().state(service)
+
+    def _service_graph(self):
+        """Returns the ServiceGraph for the current bundle, building it if
+        the bundle has changed since it was last built."""
+        if self._graph is None or self._graph_version != self.bundle.version:
+            self._graph = ServiceGraph(self.services())
+            self._graph_version = self.bundle.version
+            for service in self.services():
+                self._update_graph(service)
+        return self._graph
+
+    def _update_graph(self, service):
+        self._graph.update(service,
+                           service in self._assigned_services,
+                           service in self._deployed_services,
+                           (self.assignments.count_for_service(service) +
+                            self.deployments.count_for_service(service)))
 
     def unassigned_undeployed_services(self):
         all_services = set(self.services())
@@ -513,26 +707,17 @@ class PlacementController:
                 (self._assigned_services.union(self._deployed_services)))
 
     def can_deploy(self):
-        unassigned_requireds = [cc for cc in
-                                self.unassigned_undeployed_services()
-                                if self.get_service_state(cc)[0] ==
-                                ServiceState.REQUIRED]
-
-        underassigned = [cc for cc in self._assigned_services if
-                         (self.assignment_machine_count_for_service(cc) +
-                          self.deployment_machine_count_for_service(cc)) <
-                         cc.required_num_units()]
-        return len(unassigned_requireds) + len(underassigned) == 0
+        return self._service_graph().can_deploy()
 
     def assignment_machine_count_for_service(self, cc):
         """Returns the total number of assignments of any type for a given
         service."""
-        return sum([len(al) for al in self.get_assignments(cc).values()])
+        return self.assignments.count_for_service(cc)
 
     def deployment_machine_count_for_service(self, cc):
         """Returns the total number of deployments of any type for a given
         service."""
-        return sum([len(al) for al in self.get_deployments(cc).values()])
+        return self.deployments.count_for_service(cc)
 
     def autoassign_unassigned_services(self):
         """Attempt to find machines for all required unassigned services using
@@ -544,16 +729,17 @@ class PlacementController:
         """
 
         empty_machines = [m for m in self.machines(include_placeholders=False)
-                          if len(self.assignments[m.instance_id]) == 0]
+                          if m.instance_id not in self.assignments]
 
         unassigned_services = list(self.unassigned_undeployed_services())
         unassigned_defaults = self.gen_defaults(unassigned_services,
                                                 empty_machines)
 
-        for mid, services in unassigned_defaults.items():
-            self.assignments[mid] = services
-
-        self.update()
+        with self.batch():
+            for mid, ad in unassigned_defaults.items():
+                for atype, services in ad.items():
+                    for service in services:
+                        self._add_assignment(mid, service, atype)
 
         unassigned_services = list(self.unassigned_undeployed_services())
         unassigned_reqs = [c for c in unassigned_services if
@@ -572,23 +758,26 @@ class PlacementController:
         """Assigns all unassigned *non-subordinate* services to juju default
         placeholder.
         """
-        for s in self.unassigned_undeployed_services():
-            d = self.assignments[self.def_placeholder.instance_id]
-            al = d[DEFAULT_SHARED_ASSIGNMENT_TYPE]
-            for i in range(s.num_units):
-                al.append(s)
-        self.update()
+        with self.batch():
+            for s in self.unassigned_undeployed_services():
+                for i in range(s.num_units):
+                    self._add_assignment(self.def_placeholder.instance_id, s,
+                                         DEFAULT_SHARED_ASSIGNMENT_TYPE)
 
-    def gen_defaults(self, services=None, maas_machines=None):
+    def gen_defaults(self, services=None, maas_machines=None, solver=None):
         """Generates an assignments dictionary for the given service classes and
         machines, based on constraints.
 
-        Does not alter controller state.
+        Does not alter assignments; stores the solver's PlacementReport
+        in self.placement_report.
 
         Use set_all_assignments(gen_defaults()) to clear and reset the
         controller's state to these defaults.
 
         Should not be used for single installs, see gen_single.
+
+        solver is a solver.PlacementSolver; by default the one named by
+        the 'placement_solver' config option, or best-fit.
         """
         if self.maas_state is None:
             raise PlacementError("Can't call gen_defaults with no maas_state")
@@ -596,21 +785,12 @@ class PlacementController:
         if services is None:
             services = self.services()
         log.debug("in gen_defaults, services is {}".format(services))
-        assignments = defaultdict(lambda: defaultdict(list))
 
         if maas_machines is None:
             maas_machines = self.maas_state.machines(
                 MaasMachineStatus.READY,
                 constraints=self.config.getopt('constraints'))
 
-        def satisfying_machine(constraints):
-            for machine in maas_machines:
-                if satisfies(machine, constraints)[0]:
-                    maas_machines.remove(machine)
-                    return machine
-
-            return None
-
         isolated_services, controller_services = [], []
         subordinate_services = []
 
@@ -627,19 +807,19 @@ class PlacementController:
             else:
                 controller_services.append(service)
 
-        for service in isolated_services:
-            for n in range(service.required_num_units()):
-                m = satisfying_machine(service.constraints)
-                if m:
-                    l = assignments[m.instance_id][AssignmentType.BareMetal]
-                    l.append(service)
-
-        controller_machine = satisfying_machine({})
-        if controller_machine:
-            for service in controller_services:
-                ad = assignments[controller_machine.instance_id]
-                l = ad[DEFAULT_SHARED_ASSIGNMENT_TYPE]
-                l.append(service)
+        if solver is None:
+            solver = get_solver(self.config.getopt('placement_solver'))
+        assignments, report = solver.solve(isolated_services,
+                                           controller_services,
+                                           maas_machines,
+                                           DEFAULT_SHARED_ASSIGNMENT_TYPE,
+                                           index=self.fleet_index())
+        self.placement_report = report
+        log.info("{} placed {} units on {} machines, {} unplaced, "
+                 "utilization {}".format(report.solver, report.placed,
+                                         report.machines_used,
+                                         len(report.unplaced),
+                                         report.utilization))
 
         for service in subordinate_services:
             ad = assignments[self.sub_placeholder.instance_id]
@@ -663,6 +843,7 @@ class PlacementController:
                                          'root-disk': 20480,
                                          'cpu-cores': max_cpus})
         self._machines.append(controller)
+        self._machines_by_id[controller.instance_id] = controller
 
         service_name_counter = Counter()
 
@@ -687,6 +868,7 @@ class PlacementController:
                 for n in range(service.required_num_units()):
                     pm = placeholder_for_service(service)
                     self._machines.append(pm)
+                    self._machines_by_id[pm.instance_id] = pm
                     ad = assignments[pm.instance_id]
                     ad[AssignmentType.DEFAULT].append(service)
             elif service.subordinate:
@@ -13,41 +13,65 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
 import logging
 import os
 
-from bundleplacer.maas import MaasMachine
+from bundleplacer.fixtures.nodes import generate_nodes
+from bundleplacer.maas import (NODES_CHUNK_SIZE, MaasState, iter_nodes,
+                               trim_node)
 
 log = logging.getLogger('bundleplacer')
 
 
-class FakeMaasState:
-    """ A fake MAAS fixture for quickly testing bundle placement
-    against a set of machines
-    """
+def default_nodes_file():
+    fakepath = '/usr/share/bundle-placer/share'
+    fn = os.path.join(fakepath, "maas-machines.json")
+    if not os.path.exists(fn):
+        fn = os.path.join("share", "maas-machines.json")
+    return fn
 
-    server_hostname = "fake.maas"
 
-    def machines(self, state=None, constraints=None):
-        fakepath = '/usr/share/bundle-placer/share'
-        fn = os.path.join(fakepath, "maas-machines.json")
-        if not os.path.exists(fn):
-            fn = os.path.join("share", "maas-machines.json")
+def load_nodes(fn):
+    """ Returns the trimmed nodes in a JSON MAAS node listing, or [] if
+    it can't be read
+
+    The file is parsed as it is read, so large listings are never held
+    in memory whole.
+    """
+    try:
         with open(fn) as f:
-            try:
-                nodes = json.load(f)
-            except:
-                log.exception("Error loading JSON")
-                return []
-        return [MaasMachine(-1, m) for m in nodes
-                if m['hostname'] != 'juju-bootstrap.maas']
+            return list(iter_nodes(iter(lambda: f.read(NODES_CHUNK_SIZE),
+                                        '')))
+    except (OSError, ValueError):
+        log.exception("Error loading JSON")
+        return []
+
+
+class _FakeMaasClient:
 
-    def invalidate_nodes_cache(self):
-        "no op"
+    server_hostname = "fake.maas"
 
-    def machines_summary(self):
-        return "no summary for fake state"
+    def __init__(self, nodes):
+        self.nodes = nodes
 
     def get_server_config(self, param):
         return dict(maas_name='fake maas')
+
+
+class FakeMaasState(MaasState):
+    """ A fake MAAS fixture for quickly testing bundle placement
+    against a set of machines
+
+    The nodes are read once, from nodes_file (share/maas-machines.json
+    by default), or generated: count nodes made reproducibly from seed.
+    Machines are then filtered by state and constraints as MaasState
+    does, and never refreshed.
+    """
+
+    def __init__(self, nodes_file=None, count=None, seed=0):
+        if count is not None:
+            nodes = [trim_node(n) for n in generate_nodes(count, seed)]
+        else:
+            nodes = load_nodes(nodes_file or default_nodes_file())
+        super().__init__(_FakeMaasClient(nodes), ttl=float('inf'))
+        self._set_nodes(nodes)
@@ -0,0 +1,174 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" A local stand-in for the parts of the MAAS 1.0 API the placer uses
+
+Serves 'GET nodes/?op=list' and 'GET maas/?op=get_config' over HTTP so
+that MaasClient and MaasState can be run against thousands of
+synthetic nodes, with injected latency and churn, without a real MAAS.
+"""
+
+import json
+import logging
+import random
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+
+from bundleplacer.fixtures.nodes import STATUSES, generate_nodes, make_node
+
+log = logging.getLogger('bundleplacer')
+
+API_PATH = '/MAAS/api/1.0'
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, fmt, *args):
+        log.debug("fake maas: " + fmt % args)
+
+    def do_GET(self):
+        fake = self.server.fake_maas
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        status, body = fake.handle(url.path, params)
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeMaasServer:
+
+    """ Emulated MAAS API endpoint on localhost
+
+    :param int count: number of nodes to synthesize
+    :param int seed: seed for the nodes and their churn
+    :param float latency: seconds added to every request
+    :param float jitter: up to this many more random seconds per request
+    :param float churn: fraction of nodes changed before each listing,
+        half of them changing status and half replaced by new nodes
+    :param str api_key: 'consumer:token:secret' that requests must be
+        signed with, or None to accept any request
+    :param dict config: server config values for get_config
+    :param dict node_options: passed on to generate_nodes()
+
+    Use as a context manager, or call start() and stop().
+    """
+
+    def __init__(self, count=100, seed=0, latency=0.0, jitter=0.0,
+                 churn=0.0, api_key=None, config=None, port=0,
+                 node_options=None):
+        self.node_options = node_options or {}
+        self.nodes = generate_nodes(count, seed, **self.node_options)
+        self.latency = latency
+        self.jitter = jitter
+        self.churn = churn
+        self.api_key = api_key
+        self.config = dict(maas_name='fake maas')
+        self.config.update(config or {})
+        self.stats = Counter()
+        self._rng = random.Random(seed)
+        self._next_index = count
+        self._lock = Lock()
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.fake_maas = self
+        self._thread = None
+
+    @property
+    def api_host(self):
+        """host:port, as passed to connect_to_maas() in creds"""
+        host, port = self._server.server_address[:2]
+        return '{}:{}'.format(host, port)
+
+    @property
+    def api_url(self):
+        return 'http://{}{}'.format(self.api_host, API_PATH)
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever,
+                              name='fake-maas', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, path, params):
+        """Returns (HTTP status, JSON body) for a GET of path."""
+        self.stats['requests'] += 1
+        delay = self.latency + self._rng.random() * self.jitter
+        if delay > 0:
+            time.sleep(delay)
+        if not self._authorized(params):
+            self.stats['unauthorized'] += 1
+            return 401, "Authorization required"
+        if path.startswith(API_PATH):
+            path = path[len(API_PATH):]
+        path = path.rstrip('/')
+        op = params.get('op', None)
+        if path == '/nodes' and op == 'list':
+            self.stats['nodes'] += 1
+            with self._lock:
+                self._apply_churn()
+                return 200, list(self.nodes)
+        if path == '/maas' and op == 'get_config':
+            self.stats['get_config'] += 1
+            return 200, self.config.get(params.get('name', None), None)
+        self.stats['not_found'] += 1
+        return 404, "Not found"
+
+    def _authorized(self, params):
+        """Checks a PLAINTEXT, query-signed OAuth request as made by
+        MaasClient, with an empty consumer secret."""
+        if self.api_key is None:
+            return True
+        consumer, token, secret = self.api_key.split(':')
+        return (params.get('oauth_consumer_key', None) == consumer and
+                params.get('oauth_token', None) == token and
+                params.get('oauth_signature', None) == '&' + secret)
+
+    def _apply_churn(self):
+        n = int(len(self.nodes) * self.churn)
+        if n == 0:
+            return
+        statuses = self.node_options.get('statuses', STATUSES)
+        for k in range(n):
+            i = self._rng.randrange(len(self.nodes))
+            if k % 2 == 0:
+                self.nodes[i] = dict(self.nodes[i],
+                                     status=self._rng.choice(statuses))
+            else:
+                self.nodes[i] = make_node(self._next_index, self._rng,
+                                          **self.node_options)
+                self._next_index += 1
+        self.stats['churned'] += n
@@ -0,0 +1,73 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Synthetic MAAS 1.0 node listings
+
+The same count and seed always give the same nodes.
+"""
+
+import random
+import uuid
+
+ARCHS = ['amd64/generic']
+TAGS = ['ssd', 'compute', 'storage', 'gpu', 'use-fastpath-installer']
+ZONES = ['default']
+# status numbers as in maas.MaasMachineStatus, weighted towards READY
+STATUSES = [4, 4, 4, 4, 6, 0, 8]
+
+CPU_COUNTS = [2, 4, 8, 16, 32]
+MEMORY_MB = [2048, 4096, 8192, 16384, 32768, 65536]
+STORAGE_MB = [20480, 102400, 512000, 1024000]
+
+
+def make_node(i, rng, archs=ARCHS, tags=TAGS, zones=ZONES,
+              statuses=STATUSES):
+    """Returns one node dict, as listed by the MAAS nodes API, drawing
+    its hardware from the random.Random rng."""
+    system_id = 'node-{}'.format(uuid.UUID(int=rng.getrandbits(128)))
+    mac = ':'.join('{:02x}'.format(rng.randrange(256)) for _ in range(6))
+    resource_uri = '/MAAS/api/1.0/nodes/{}/'.format(system_id)
+    zone = rng.choice(zones)
+    n_tags = rng.randrange(min(3, len(tags)) + 1)
+    return {'system_id': system_id,
+            'hostname': 'node-{}.maas'.format(i),
+            'resource_uri': resource_uri,
+            'status': rng.choice(statuses),
+            'architecture': rng.choice(archs),
+            'cpu_count': rng.choice(CPU_COUNTS),
+            'memory': rng.choice(MEMORY_MB),
+            'storage': rng.choice(STORAGE_MB),
+            'tag_names': sorted(rng.sample(tags, n_tags)),
+            'zone': {'resource_uri': '/MAAS/api/1.0/zones/{}/'.format(zone),
+                     'name': zone,
+                     'description': ''},
+            'power_type': 'virsh',
+            'owner': 'root',
+            'netboot': True,
+            'routers': [],
+            'ip_addresses': ['10.{}.{}.{}'.format(i >> 16 & 255,
+                                                  i >> 8 & 255,
+                                                  i & 255)],
+            'macaddress_set': [{'mac_address': mac,
+                                'resource_uri': '{}macs/{}/'.format(
+                                    resource_uri, mac.replace(':', '%3A'))}]}
+
+
+def generate_nodes(count, seed=0, archs=ARCHS, tags=TAGS, zones=ZONES,
+                   statuses=STATUSES):
+    """Returns a list of count synthetic node dicts."""
+    rng = random.Random(seed)
+    return [make_node(i, rng, archs, tags, zones, statuses)
+            for i in range(count)]
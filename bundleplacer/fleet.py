@@ -0,0 +1,228 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Batch constraint matching over a list of machines
+
+Sets of machines are Python ints used as bitsets, with bit i standing
+for machines[i], so intersecting the machines that pass each constraint
+is a single integer AND regardless of the size of the fleet.
+"""
+
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+
+from bundleplacer.constraints import (HARDWARE_KEYS, NUMERIC, base_arch,
+                                      compile_constraints)
+
+log = logging.getLogger('bundleplacer')
+
+
+def _hardware_number(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class _NumericColumn:
+
+    """One hardware value for every machine, as bitsets of the machines
+    having at least each distinct value."""
+
+    def __init__(self, values):
+        self.wildcard = 0
+        by_value = defaultdict(int)
+        for i, v in enumerate(values):
+            if v == '*':
+                self.wildcard |= 1 << i
+                continue
+            n = _hardware_number(v)
+            # machines with no usable value never match
+            if n is not None:
+                by_value[n] |= 1 << i
+        self.values = sorted(by_value)
+        # at_least[k] is every machine with a value >= values[k]
+        self.at_least = [0] * len(self.values)
+        acc = 0
+        for k in range(len(self.values) - 1, -1, -1):
+            acc |= by_value[self.values[k]]
+            self.at_least[k] = acc
+
+    def mask(self, minimum):
+        k = bisect_left(self.values, minimum)
+        if k == len(self.values):
+            return self.wildcard
+        return self.at_least[k] | self.wildcard
+
+
+class _ExactColumn:
+
+    def __init__(self, values):
+        self.wildcard = 0
+        self.by_value = defaultdict(int)
+        for i, v in enumerate(values):
+            if v == '*':
+                self.wildcard |= 1 << i
+            else:
+                self.by_value[v] |= 1 << i
+
+    def mask(self, value):
+        return self.by_value.get(value, 0) | self.wildcard
+
+
+class _TagColumn:
+
+    def __init__(self, values, all_machines):
+        self.all = all_machines
+        self.by_tag = defaultdict(int)
+        for i, tags in enumerate(values):
+            for tag in tags or []:
+                self.by_tag[tag] |= 1 << i
+
+    def mask(self, value):
+        required, excluded = value
+        m = self.all
+        for tag in required:
+            m &= self.by_tag.get(tag, 0)
+        for tag in excluded:
+            m &= ~self.by_tag.get(tag, 0)
+        return m
+
+
+class _ZoneColumn(_ExactColumn):
+
+    def mask(self, value):
+        m = 0
+        for zone in value:
+            m |= self.by_value.get(zone, 0)
+        return m
+
+
+def _zone_name(zone):
+    if isinstance(zone, dict):
+        return zone.get('name', None)
+    return zone
+
+
+class FleetIndex:
+
+    """Hardware columns for a list of machines, built once and then used
+    to match any number of constraint sets.
+
+    Matches exactly what maas.satisfies() would decide for each machine.
+    """
+
+    def __init__(self, machines):
+        self.machines = list(machines)
+        self.all = (1 << len(self.machines)) - 1
+        hw = [m.machine for m in self.machines]
+        self._columns = {}
+        for name in NUMERIC:
+            key = HARDWARE_KEYS[name]
+            self._columns[name] = _NumericColumn([h.get(key, None)
+                                                  for h in hw])
+        self._columns['arch'] = _ExactColumn(
+            [base_arch(h.get('architecture', None)) for h in hw])
+        self._columns['tags'] = _TagColumn(
+            [h.get('tag_names', None) for h in hw], self.all)
+        self._columns['zones'] = _ZoneColumn(
+            [_zone_name(h.get('zone', None)) for h in hw])
+        # id() of each machine: its bit, the machines themselves being
+        # kept alive by self.machines
+        self._bits = {id(m): i for i, m in enumerate(self.machines)}
+        self._cache = {}
+        self._matched = {}
+
+    def __len__(self):
+        return len(self.machines)
+
+    def key_masks(self, constraints):
+        """Returns [(key, mask)] for each constraint, in order, where mask
+        is the set of machines passing that constraint."""
+        constraints = compile_constraints(constraints)
+        masks = self._cache.get(constraints, None)
+        if masks is None:
+            masks = [(key, self._columns[name].mask(value))
+                     for key, name, value in constraints.checks]
+            self._cache[constraints] = masks
+        return masks
+
+    def mask(self, constraints):
+        """Returns the set of machines satisfying all of constraints."""
+        m = self.all
+        for _, key_mask in self.key_masks(constraints):
+            m &= key_mask
+        return m
+
+    def matching(self, constraints):
+        return self.machines_in(self.mask(constraints))
+
+    def machines_in(self, mask):
+        return [m for i, m in enumerate(self.machines) if mask >> i & 1]
+
+    def bit(self, machine):
+        """Returns the bit of machine itself, not just of one equal to it,
+        or None if it isn't indexed."""
+        return self._bits.get(id(machine), None)
+
+    def covers(self, machines):
+        return all(self.bit(m) is not None for m in machines)
+
+    def matching_among(self, machines, constraints):
+        """Returns (ids, others): the instance ids of those of machines
+        that are indexed and satisfy constraints, and the machines that
+        aren't indexed, to be checked some other way."""
+        constraints = compile_constraints(constraints)
+        matched = self._matched.get(constraints, None)
+        if matched is None:
+            matched = frozenset(id(m) for m in self.matching(constraints))
+            self._matched[constraints] = matched
+        ids, others = set(), []
+        for m in machines:
+            if id(m) in matched:
+                ids.add(m.instance_id)
+            elif id(m) not in self._bits:
+                others.append(m)
+        return ids, others
+
+    def satisfaction_matrix(self, constraint_sets):
+        return SatisfactionMatrix(self, constraint_sets)
+
+
+class SatisfactionMatrix:
+
+    """Which machines satisfy each of a list of constraint sets.
+
+    rows[i] is the bitset of machines satisfying constraint_sets[i].
+    """
+
+    def __init__(self, index, constraint_sets):
+        self.index = index
+        self._key_masks = [index.key_masks(c) for c in constraint_sets]
+        self.rows = [index.mask(c) for c in constraint_sets]
+
+    def row(self, i):
+        """Returns [bool] for each machine."""
+        return [bool(self.rows[i] >> j & 1) for j in range(len(self.index))]
+
+    def machines_for(self, i):
+        return self.index.machines_in(self.rows[i])
+
+    def satisfies(self, i, j):
+        """Returns (bool, [failed constraint keys]) for constraint set i and
+        machine j, like maas.satisfies()."""
+        failed = [k for k, mask in self._key_masks[i] if not mask >> j & 1]
+        return (len(failed) == 0, failed)
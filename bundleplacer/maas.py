@@ -18,22 +18,59 @@
 
 import logging
 import time
-from collections import Counter
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from enum import Enum
 from threading import RLock
 
+import requests
+
 from bundleplacer.async import submit
-from bundleplacer.machine import Machine
-from bundleplacer.utils import human_to_mb
+from bundleplacer.constraints import base_arch, compile_constraints
+from bundleplacer.fleet import FleetIndex
+from bundleplacer.machine import Machine, hardware_number
+from bundleplacer.utils import decode_chunks, iter_json_array
 from maasclient import MaasClient
 from maasclient.auth import MaasAuth
 
 log = logging.getLogger('bundleplacer')
 
+# seconds a MAAS node listing is served before it is refreshed
+NODES_CACHE_TTL = 20
+
+# the only node fields the placer reads, see trim_node()
+NODE_FIELDS = ('hostname', 'system_id', 'resource_uri', 'status',
+               'architecture', 'cpu_count', 'memory', 'storage',
+               'tag_names', 'zone')
+
+# bytes read at a time when streaming a node listing
+NODES_CHUNK_SIZE = 64 * 1024
+
+
+def trim_node(node):
+    """Returns a copy of a MAAS node dict with only NODE_FIELDS, and only
+    the name of its zone."""
+    trimmed = {k: node[k] for k in NODE_FIELDS if k in node}
+    zone = trimmed.get('zone', None)
+    if isinstance(zone, dict):
+        trimmed['zone'] = {'name': zone.get('name', None)}
+    return trimmed
+
+
+def iter_nodes(chunks):
+    """Yields trimmed nodes as they are parsed from the str chunks of a
+    JSON node listing."""
+    for node in iter_json_array(chunks):
+        yield trim_node(node)
+
 
 def satisfies(machine, constraints):
     """Evaluates whether a MAAS machine's hardware matches constraints.
 
+    constraints may be a juju constraints string, a dict or a compiled
+    constraints.Constraints.
+
     If constraints is None or an empty dict, then any machine will be
     evaluated as satisfying the constraints.
 
@@ -48,37 +85,9 @@ def satisfies(machine, constraints):
     :returns: (bool, [list-of-failed constraint keys])
 
     """
-    kmap = dict(mem='memory',
-                arch='architecture',
-                storage='storage',
-                cpu_cores='cpu_count')
-    kmap['root-disk'] = 'storage'
-
-    cons_checks = []
-
     if constraints is None:
         return (True, [])
-
-    for k, v in constraints.items():
-        if k == 'arch':
-            mval = machine.machine[kmap[k]]
-            if mval != '*' and mval != v:
-                cons_checks.append(k)
-        else:
-            mval = machine.machine[kmap[k]]
-
-            if mval == '*':
-                # '*' always satisfies.
-                continue
-
-            if not str(v).isdecimal():
-                v = human_to_mb(v)
-
-            if mval < v:
-                cons_checks.append(k)
-
-    rval = (len(cons_checks) == 0), cons_checks
-    return rval
+    return compile_constraints(constraints).check(machine)
 
 
 class MaasMachineStatus(Enum):
@@ -115,14 +124,52 @@ class MaasMachineStatus(Enum):
         return self.name.lower()
 
 
+# node keys that MaasMachine.parse_hardware() reads
+HARDWARE_FIELDS = frozenset(['architecture', 'cpu_count', 'memory',
+                             'storage'])
+
+
 class MaasMachine(Machine):
     """ Single maas machine """
 
+    __slots__ = ('_source', '_hash', 'region')
+
+    def __init__(self, machine_id, machine):
+        super().__init__(machine_id, machine)
+        # name of the MAAS region this came from, see FederatedMaasState
+        self.region = None
+        # the node dict this machine was last updated from
+        self._source = machine
+        self._hash = hash(self.hostname)
+
     def __eq__(self, other):
         return self.hostname == other.hostname
 
     def __hash__(self):
-        return hash(self.hostname)
+        return self._hash
+
+    def update(self, machine):
+        """Patches this machine's MAAS data to match the node dict
+        'machine', changing only the fields that differ.
+
+        :returns: set of the keys that changed
+        """
+        if machine is self._source:
+            return set()
+        self._source = machine
+        changed = set()
+        for k, v in machine.items():
+            if k not in self.machine or self.machine[k] != v:
+                self.machine[k] = v
+                changed.add(k)
+        for k in set(self.machine) - set(machine):
+            del self.machine[k]
+            changed.add(k)
+        if 'hostname' in changed:
+            self._hash = hash(self.hostname)
+        if not changed.isdisjoint(HARDWARE_FIELDS):
+            self.parse_hardware()
+        return changed
 
     @property
     def hostname(self):
@@ -152,6 +199,32 @@ class MaasMachine(Machine):
         """
         return self.machine.get('zone', {})
 
+    def parse_hardware(self):
+        """ (Re)computes the numeric hardware fields and display strings
+        from the MAAS node data
+        """
+        hw = self.machine
+        self._arch = hw.get('architecture')
+        self._cpu_cores = hw.get('cpu_count', '0')
+        self.cpu_count = hardware_number(self._cpu_cores)
+        self.mem_mb = hardware_number(hw.get('memory'))
+        self.storage_mb = hardware_number(hw.get('storage'))
+
+        try:
+            _storage_in_gb = int(hw.get('storage')) / 1024
+            self._storage = "{size:.2f}G".format(size=_storage_in_gb)
+        except (TypeError, ValueError):
+            self._storage = "N/A"
+
+        try:
+            _mem = int(hw.get('memory'))
+            if _mem > 1024:
+                self._mem = "{size}G".format(size=str(_mem / 1024))
+            else:
+                self._mem = "{size}M".format(size=str(_mem))
+        except (TypeError, ValueError):
+            self._mem = "N/A"
+
     @property
     def cpu_cores(self):
         """ Returns number of cpu-cores
@@ -159,7 +232,7 @@ class MaasMachine(Machine):
         :returns: number of cpus
         :rtype: str
         """
-        return self.machine.get('cpu_count', '0')
+        return self._cpu_cores
 
     @property
     def storage(self):
@@ -168,11 +241,7 @@ class MaasMachine(Machine):
         :returns: storage size
         :rtype: str
         """
-        try:
-            _storage_in_gb = int(self.machine.get('storage')) / 1024
-        except ValueError:
-            return "N/A"
-        return "{size:.2f}G".format(size=_storage_in_gb)
+        return self._storage
 
     @property
     def arch(self):
@@ -181,7 +250,7 @@ class MaasMachine(Machine):
         :returns: architecture type
         :rtype: str
         """
-        return self.machine.get('architecture')
+        return self._arch
 
     @property
     def mem(self):
@@ -190,15 +259,7 @@ class MaasMachine(Machine):
         :returns: memory size
         :rtype: str
         """
-        try:
-            _mem = int(self.machine.get('memory'))
-        except ValueError:
-            return "N/A"
-        if _mem > 1024:
-            _mem = _mem / 1024
-            return "{size}G".format(size=str(_mem))
-        else:
-            return "{size}M".format(size=str(_mem))
+        return self._mem
 
     @property
     def power_type(self):
@@ -294,80 +355,214 @@ class MaasMachine(Machine):
                 "storage:{storage} cores:{cpus}").format(**d)
 
 
+class NodeIndex:
+
+    """MAAS nodes by system_id, with inverted indexes from architecture,
+    tag and zone name to sets of system_ids.
+
+    update() only touches the index entries of nodes that were added,
+    removed or changed since the last listing.
+    """
+
+    def __init__(self):
+        self.nodes = OrderedDict()
+        self.by_arch = defaultdict(set)
+        self.by_tag = defaultdict(set)
+        self.by_zone = defaultdict(set)
+        self._position = {}
+
+    def _entries(self, node):
+        yield self.by_arch, base_arch(node.get('architecture', None))
+        for tag in node.get('tag_names', None) or []:
+            yield self.by_tag, tag
+        zone = node.get('zone', None)
+        if isinstance(zone, dict):
+            zone = zone.get('name', None)
+        yield self.by_zone, zone
+
+    def _add(self, node_id, node):
+        for index, key in self._entries(node):
+            index[key].add(node_id)
+
+    def _remove(self, node_id, node):
+        for index, key in self._entries(node):
+            ids = index[key]
+            ids.discard(node_id)
+            if len(ids) == 0:
+                del index[key]
+
+    def update(self, nodes):
+        """Replaces the indexed nodes with a complete listing.
+
+        :returns: True if any node was added, removed or changed
+        """
+        new = OrderedDict((_node_id(n), n) for n in nodes)
+        changed = False
+        for node_id, old in self.nodes.items():
+            if new.get(node_id, None) != old:
+                self._remove(node_id, old)
+                changed = True
+        for node_id, node in new.items():
+            if self.nodes.get(node_id, None) != node:
+                self._add(node_id, node)
+                changed = True
+        if changed or list(new) != list(self.nodes):
+            self._position = {node_id: i for i, node_id in enumerate(new)}
+            changed = True
+        self.nodes = new
+        return changed
+
+    def select(self, constraints):
+        """Returns the nodes matching the arch, tags and zones of
+        constraints, in listing order."""
+        c = compile_constraints(constraints)
+        ids = None
+
+        def narrow(ids, matching):
+            return set(matching) if ids is None else ids & matching
+
+        if c.arch:
+            ids = narrow(ids, self.by_arch.get(c.arch, set()))
+        required, excluded = c.get('tags', (frozenset(), frozenset()))
+        for tag in sorted(required,
+                          key=lambda t: len(self.by_tag.get(t, ()))):
+            ids = narrow(ids, self.by_tag.get(tag, set()))
+        if 'zones' in c:
+            in_zones = set()
+            for zone in c['zones']:
+                in_zones |= self.by_zone.get(zone, set())
+            ids = narrow(ids, in_zones)
+        if ids is None:
+            ids = set(self.nodes)
+        for tag in excluded:
+            ids = ids - self.by_tag.get(tag, set())
+        return [self.nodes[i] for i in sorted(ids, key=self._position.get)]
+
+
 class MaasState:
-    """ Represents global MaaS state """
+    """ Represents global MaaS state
 
-    def __init__(self, maas_client):
+    The node listing is cached for ttl seconds. Once it is stale, nodes()
+    keeps returning the cached listing while a fresh one is fetched in
+    the background, so callers on the UI thread never wait on MAAS.
+    """
+
+    def __init__(self, maas_client, ttl=NODES_CACHE_TTL, region=None,
+                 executor=None):
         self.maas_client = maas_client
+        self.ttl = ttl
+        # name given to the machines of this MAAS in a federation
+        self.region = region
+        # runs refreshes instead of the shared async pool when given
+        self._executor = executor
         self._maas_client_nodes = []
-        self._filtered_nodes = []
         self._nodes_lock = RLock()
         self._nodes_future = None
-        self._start_time = 0
+        self._fetched_at = 0
+        # constraints string: filtered nodes, for the current listing
+        self._filter_cache = {}
+        self._node_index = NodeIndex()
+        self._stats = Counter()
         self.server_hostname = maas_client.server_hostname
+        # system_id: MaasMachine, kept for the life of the node
+        self._machine_pool = OrderedDict()
+        # bumped on every change to the machine pool
+        self.pool_version = 0
+        self._fleet_index = None
+        self._listeners = []
 
     def get_server_config(self, param):
         return self.maas_client.get_server_config(param)
 
     def nodes(self, constraints=None):
-        """ Cache MAAS nodes
-        """
-        elapsed_time = time.time() - self._start_time
-        if elapsed_time <= 20:
-            return self._filtered_nodes
+        """ Cached MAAS nodes, filtered by constraints
 
+        Never blocks: returns the last listing fetched, starting a
+        background refresh if it is older than ttl.
+        """
+        self._collect_refresh()
+        if self._nodes_future is None and \
+           time.time() - self._fetched_at > self.ttl:
+            self._start_refresh()
+
+        with self._nodes_lock:
+            if not constraints:
+                return self._maas_client_nodes
+            filtered = self._filter_cache.get(constraints, None)
+            if filtered is not None:
+                self._stats['hits'] += 1
+                return filtered
+            self._stats['misses'] += 1
+            filtered = self._node_index.select(constraints)
+            self._filter_cache[constraints] = filtered
+            return filtered
+
+    def _start_refresh(self):
         def _do_update():
+            start = time.time()
             nodes = self.maas_client.nodes
-            self.invalidate_nodes_cache()
-            return nodes
-
-        if self._nodes_future:
-            if self._nodes_future.done():
-                with self._nodes_lock:
-                    self._maas_client_nodes = self._nodes_future.result()
-                self._nodes_future = None
-        else:
-            self._nodes_future = submit(_do_update, lambda _: None)
+            return nodes, time.time() - start
 
-        if constraints:
-            self._filtered_nodes = self._filter_nodes(self._maas_client_nodes,
-                                                      constraints)
+        if self._executor is None:
+            self._nodes_future = submit(_do_update, lambda _: None)
         else:
-            self._filtered_nodes = self._maas_client_nodes
+            self._nodes_future = self._executor.submit(_do_update)
 
-        self._start_time = time.time()
-        return self._filtered_nodes
+    def _collect_refresh(self):
+        """Swaps in the result of a finished background refresh."""
+        f = self._nodes_future
+        if f is None or not f.done():
+            return
+        self._nodes_future = None
+        self._fetched_at = time.time()
+        if f.cancelled():
+            return
+        if f.exception() is not None:
+            # keep serving the old listing, try again after ttl
+            log.warning("Error refreshing MAAS nodes from {}: {}".format(
+                self.server_hostname, f.exception()))
+            self._stats['refresh_errors'] += 1
+            return
+        nodes, latency = f.result()
+        self._stats['refreshes'] += 1
+        self._stats['refresh_seconds'] += latency
+        self._stats['last_refresh_seconds'] = latency
+        self._set_nodes(nodes)
+
+    def _set_nodes(self, nodes):
+        with self._nodes_lock:
+            if self._node_index.update(nodes):
+                self._filter_cache = {}
+            self._maas_client_nodes = nodes
+        self.update_machines(nodes)
+
+    def cache_stats(self):
+        """Returns a dict of node cache counters: hits and misses of the
+        filtered listings, refreshes, refresh_errors and refresh_seconds
+        (total and last)."""
+        stats = dict(hits=0, misses=0, refreshes=0, refresh_errors=0,
+                     refresh_seconds=0.0, last_refresh_seconds=0.0)
+        stats.update(self._stats)
+        return stats
 
     def nodes_uncached(self, constraints=None):
         if constraints:
-            return self._filter_nodes(self.maas_client.nodes)
+            return self._filter_nodes(self.maas_client.nodes, constraints)
         else:
             return self.maas_client.nodes
 
     def _filter_nodes(self, nodes, constraints):
+        """Returns the nodes matching the arch, tags and zones of a
+        constraints string."""
         assert constraints is not None
 
-        cd = dict(x.split('=') for x in constraints.split(' '))
-        arch = cd.get('arch', None)
-        tagstr = cd.get('tags', None)
-        satisfying_nodes = []
-        for n in self._maas_client_nodes:
-            if arch:
-                n_arch = n['architecture'].split('/')[0]
-                if n_arch != arch:
-                    continue
-            if tagstr:
-                c_tags = set(cd['tags'].split(','))
-                n_tags = set(n['tag_names'])
-                if not c_tags.issubset(n_tags):
-                    continue
-            satisfying_nodes.append(n)
-
-        return satisfying_nodes
+        index = NodeIndex()
+        index.update(nodes)
+        return index.select(constraints)
 
     def invalidate_nodes_cache(self):
-        """Force reload on next access"""
-        self._start_time = 0
+        """Refresh on next access"""
+        self._fetched_at = 0
 
     def machine(self, instance_id):
         """ Return single machine state
@@ -397,12 +592,71 @@ class MaasState:
         """
         nodes = [n for n in self.nodes(constraints)
                  if n['hostname'] != 'juju-bootstrap.maas']
-        all_machines = [MaasMachine(-1, m) for m in nodes]
+        all_machines = self._pooled_machines(nodes, complete=False)
         if state:
             return [m for m in all_machines if m.status == state]
         else:
             return all_machines
 
+    def pooled_machines(self):
+        """Returns every MaasMachine in the pool, including those not
+        matching the last constraints asked for."""
+        return list(self._machine_pool.values())
+
+    def fleet_index(self):
+        """Returns a FleetIndex of the machine pool, built again only
+        after the pool changes."""
+        index = self._fleet_index
+        if index is None:
+            index = FleetIndex(self._machine_pool.values())
+            self._fleet_index = index
+        return index
+
+    def add_listener(self, callback):
+        """Registers callback(added, removed, changed) to be called with
+        lists of MaasMachines whenever the machine pool changes."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def update_machines(self, nodes):
+        """Brings the machine pool in line with a complete node listing,
+        dropping machines for nodes that are gone.
+
+        :returns: list of MaasMachine, in the order of nodes
+        """
+        return self._pooled_machines(nodes, complete=True)
+
+    def _pooled_machines(self, nodes, complete):
+        added, removed, changed = [], [], []
+        machines = []
+        seen = set()
+        for node in nodes:
+            node_id = _node_id(node)
+            seen.add(node_id)
+            m = self._machine_pool.get(node_id, None)
+            if m is None:
+                m = MaasMachine(-1, node)
+                m.region = self.region
+                self._machine_pool[node_id] = m
+                added.append(m)
+            elif m.update(node):
+                changed.append(m)
+            machines.append(m)
+
+        if complete:
+            for node_id in list(self._machine_pool):
+                if node_id not in seen:
+                    removed.append(self._machine_pool.pop(node_id))
+
+        if added or removed or changed:
+            self.pool_version += 1
+            self._fleet_index = None
+            for callback in list(self._listeners):
+                callback(added, removed, changed)
+        return machines
+
     def machines_summary(self):
         """ Returns summary of known machines and their states.
         """
@@ -411,7 +665,121 @@ class MaasState:
                         for m in self.nodes()])
 
 
-def connect_to_maas(creds=None):
+def _node_id(node):
+    return node.get('system_id', None) or node.get('resource_uri', None) or \
+        node.get('hostname', None)
+
+
+class FederatedMaasState:
+
+    """ MaaS state merged from several MAAS regions
+
+    Each region is a MaasState with its own node cache. Their refreshes
+    run concurrently on a pool with one worker per region, so a slow
+    region keeps serving its last listing without holding up the
+    others. Machines are tagged with the name of their region.
+
+    :param regions: list of (region name, MaasClient)
+    """
+
+    def __init__(self, regions, ttl=NODES_CACHE_TTL):
+        self._executor = ThreadPoolExecutor(max(1, len(regions)))
+        self.regions = OrderedDict(
+            (name, MaasState(client, ttl, region=name,
+                             executor=self._executor))
+            for name, client in regions)
+        self.server_hostname = ", ".join(
+            state.server_hostname for state in self.regions.values())
+        self._fleet_index = None
+        self._fleet_versions = None
+
+    def get_server_config(self, param):
+        values = [state.get_server_config(param)
+                  for state in self.regions.values()]
+        if all(isinstance(v, str) for v in values):
+            return ", ".join(values)
+        return values[0] if len(values) == 1 else values
+
+    def nodes(self, constraints=None):
+        return [n for state in self.regions.values()
+                for n in state.nodes(constraints)]
+
+    def invalidate_nodes_cache(self):
+        for state in self.regions.values():
+            state.invalidate_nodes_cache()
+
+    def machine(self, instance_id):
+        for state in self.regions.values():
+            m = state.machine(instance_id)
+            if m is not None:
+                return m
+        return None
+
+    def machines(self, state=None, constraints=None):
+        """ Machines of all regions, see MaasState.machines() """
+        return [m for region in self.regions.values()
+                for m in region.machines(state, constraints)]
+
+    def fleet_index(self):
+        """Returns a FleetIndex of the machine pools of all regions, built
+        again only after one of them changes."""
+        versions = tuple(state.pool_version
+                         for state in self.regions.values())
+        if self._fleet_index is None or self._fleet_versions != versions:
+            self._fleet_index = FleetIndex(
+                m for state in self.regions.values()
+                for m in state.pooled_machines())
+            self._fleet_versions = versions
+        return self._fleet_index
+
+    def add_listener(self, callback):
+        for state in self.regions.values():
+            state.add_listener(callback)
+
+    def remove_listener(self, callback):
+        for state in self.regions.values():
+            state.remove_listener(callback)
+
+    def cache_stats(self):
+        """Returns {region name: MaasState.cache_stats()}"""
+        return OrderedDict((name, state.cache_stats())
+                           for name, state in self.regions.items())
+
+    def machines_summary(self):
+        summary = Counter()
+        for state in self.regions.values():
+            summary.update(state.machines_summary())
+        return summary
+
+    def shutdown(self):
+        """Stops the refresh pool, without waiting for refreshes in
+        progress."""
+        self._executor.shutdown(wait=False)
+
+
+class StreamingMaasClient(MaasClient):
+
+    """ MaasClient whose node listing is parsed as it downloads
+
+    Each node is trimmed to NODE_FIELDS as soon as it is parsed, so
+    neither the whole response body nor the full node dicts are ever
+    held in memory together.
+    """
+
+    @property
+    def nodes(self):
+        res = requests.get(url=self.auth.api_url + '/nodes/',
+                           auth=self._oauth(),
+                           params=dict(op='list'),
+                           stream=True)
+        with closing(res):
+            if not res.ok:
+                return []
+            chunks = res.iter_content(chunk_size=NODES_CHUNK_SIZE)
+            return list(iter_nodes(decode_chunks(chunks)))
+
+
+def _maas_client(creds=None):
     if creds:
         api_host = creds['api_host']
         api_url = 'http://{}/MAAS/api/1.0'.format(api_host)
@@ -421,6 +789,20 @@ def connect_to_maas(creds=None):
     else:
         auth = MaasAuth()
         auth.get_api_key('root')
-    maas = MaasClient(auth)
-    maas_state = MaasState(maas)
+    return StreamingMaasClient(auth)
+
+
+def connect_to_maas(creds=None, ttl=NODES_CACHE_TTL):
+    maas = _maas_client(creds)
+    maas_state = MaasState(maas, ttl)
     return maas, maas_state
+
+
+def connect_to_maas_regions(creds_list, ttl=NODES_CACHE_TTL):
+    """ Connects to several MAAS regions, named by their api_host
+
+    :returns: ([MaasClient], FederatedMaasState)
+    """
+    clients = [(creds['api_host'], _maas_client(creds))
+               for creds in creds_list]
+    return ([c for _, c in clients], FederatedMaasState(clients, ttl))
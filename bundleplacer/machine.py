@@ -18,19 +18,44 @@
 
 import logging
 
+from bundleplacer.utils import human_to_mb
+
 log = logging.getLogger('bundleplacer')
 
 
+def hardware_number(v):
+    """Returns a hardware value as a number of cores or megabytes.
+
+    '*' (any) is infinite, and values that can't be parsed are 0.
+    """
+    if v == '*':
+        return float('inf')
+    try:
+        if isinstance(v, str):
+            return int(v) if v.isdecimal() else human_to_mb(v)
+        return 0 if v is None else v + 0
+    except Exception:
+        return 0
+
+
 class Machine:
 
-    """ Base machine class """
+    """ Base machine class
+
+    Hardware is parsed once, into numeric fields (cpu_count, mem_mb,
+    storage_mb) for sorting and filtering, and display strings returned
+    by the arch, cpu_cores, mem and storage properties.
+    """
+
+    __slots__ = ('machine_id', 'machine', 'agent', 'agent_state',
+                 'agent_state_info', 'agent_version', 'dns_name', 'err',
+                 'has_vote', 'wants_vote',
+                 'cpu_count', 'mem_mb', 'storage_mb',
+                 '_arch', '_cpu_cores', '_mem', '_storage')
 
     def __init__(self, machine_id, machine):
         self.machine_id = machine_id
         self.machine = machine
-        self._cpu_cores = self.hardware('cpu-cores')
-        self._storage = self.hardware('root-disk')
-        self._mem = self.hardware('memory')
         self.agent = self.machine.get('Agent', None)
         self.agent_state = self.machine.get('AgentState', None)
         self.agent_state_info = self.machine.get('AgentStateInfo', None)
@@ -39,6 +64,23 @@ class Machine:
         self.err = self.machine.get('Err', None)
         self.has_vote = self.machine.get('HasVote')
         self.wants_vote = self.machine.get('WantsVote')
+        self.parse_hardware()
+
+    def parse_hardware(self):
+        """ (Re)computes the numeric hardware fields and display strings
+        from self.machine
+        """
+        hw = self._hardware_dict()
+        self._arch = hw.get('arch', "N/A")
+        self.cpu_cores = hw.get('cpu-cores', "N/A")
+        self.mem = hw.get('mem', "N/A")
+        self.storage = hw.get('root-disk', "N/A")
+
+    def _hardware_dict(self):
+        _machine = self.machine.get('Hardware', None)
+        if not _machine:
+            return {}
+        return dict(item.split('=', 1) for item in _machine.split(' '))
 
     @property
     def instance_id(self):
@@ -61,6 +103,7 @@ class Machine:
     @cpu_cores.setter
     def cpu_cores(self, val):
         self._cpu_cores = val
+        self.cpu_count = hardware_number(val)
 
     @property
     def arch(self):
@@ -69,7 +112,7 @@ class Machine:
         :returns: architecture type
         :rtype: str
         """
-        return self.hardware('arch')
+        return self._arch
 
     @property
     def storage(self):
@@ -78,15 +121,15 @@ class Machine:
         :returns: storage size
         :rtype: str
         """
-        try:
-            self._storage = int(self._storage[:-1]) / 1024
-            return "{size}G".format(size=str(self._storage))
-        except:
-            return "N/A"
+        return self._storage
 
     @storage.setter
     def storage(self, val):
-        self._storage = val
+        self.storage_mb = hardware_number(val)
+        try:
+            self._storage = "{size}G".format(size=str(int(val[:-1]) / 1024))
+        except Exception:
+            self._storage = "N/A"
 
     @property
     def mem(self):
@@ -95,11 +138,12 @@ class Machine:
         :returns: memory size
         :rtype: str
         """
-        return "{size}".format(size=str(self._mem))
+        return self._mem
 
     @mem.setter
     def mem(self, val):
-        self._mem = val
+        self._mem = "{size}".format(size=str(val))
+        self.mem_mb = hardware_number(val)
 
     def hardware(self, spec):
         """ Get hardware information
@@ -109,13 +153,9 @@ class Machine:
         :returns: hardware of spec
         :rtype: str
         """
-        _machine = self.machine.get('Hardware', None)
-        if _machine:
-            _hardware_list = _machine.split(' ')
-            for item in _hardware_list:
-                k, v = item.split('=')
-                if k in spec:
-                    return v
+        for k, v in self._hardware_dict().items():
+            if k in spec:
+                return v
         return "N/A"
 
     @property
@@ -18,6 +18,7 @@ import logging
 import yaml
 
 from bundleplacer.charmstore_api import CharmStoreID
+from bundleplacer.constraints import compile_constraints
 
 log = logging.getLogger('bundleplacer')
 
@@ -35,7 +36,7 @@ class Service:
         self.charm_name = self.csid.name
         self.summary_future = summary_future
         self._summary = "Loading summary…"
-        self.constraints = constraints
+        self.constraints = compile_constraints(constraints)
         self.depends = depends
         self.conflicts = conflicts
         self.allowed_assignment_types = allowed_assignment_types
@@ -90,7 +91,7 @@ class Service:
         rd = {"charm-url": self.csid.as_str(),
               "application": self.service_name,
               "num-units": self.num_units,
-              "constraints": self.constraints}
+              "constraints": self.constraints.raw}
 
         if self.resources:
             rd['resources'] = self.resources
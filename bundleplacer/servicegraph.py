@@ -0,0 +1,154 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from collections import Counter, defaultdict
+
+from bundleplacer.state import ServiceState
+
+log = logging.getLogger('bundleplacer')
+
+
+class ServiceGraph:
+
+    """Depends/conflicts graph over a set of services, keeping each
+    service's ServiceState current as placements change.
+
+    A service is 'active' if it is assigned, deployed or required
+    (is_core). For each service the graph counts the active services it
+    conflicts with and the active services that depend on it, so a
+    placement change only touches the changed service and its
+    neighbours.
+
+    It also keeps the set of services that block deploying: required
+    services that are neither assigned nor deployed, and assigned
+    services with fewer units than they need.
+    """
+
+    def __init__(self, services):
+        self._services = {s.service_name: s for s in services}
+        # name: names of services it conflicts with, in either direction
+        self._conflicts = defaultdict(set)
+        # name: names of services that depend on it
+        self._dependents = defaultdict(set)
+        for s in services:
+            for other in s.conflicts:
+                if other in self._services:
+                    self._conflicts[s.service_name].add(other)
+                    self._conflicts[other].add(s.service_name)
+            for other in s.depends:
+                if other in self._services:
+                    self._dependents[other].add(s.service_name)
+
+        self._active = set()
+        self._assigned = set()
+        self._deployed = set()
+        self._units = Counter()
+        self._n_conflicts = Counter()
+        self._n_dependents = Counter()
+        self._blocking = set()
+        for s in services:
+            self.update(s, False, False, 0)
+
+    def update(self, service, assigned, deployed, units):
+        """Records the placement of service.
+
+        assigned, deployed: whether it has any assignments or deployments
+        units: total number of assigned and deployed units
+        """
+        name = service.service_name
+        if name not in self._services:
+            return
+        affected = set([name])
+
+        for placed, flag in [(self._assigned, assigned),
+                             (self._deployed, deployed)]:
+            if flag:
+                placed.add(name)
+            else:
+                placed.discard(name)
+        self._units[name] = units
+
+        active = assigned or deployed or service.is_core
+        if active != (name in self._active):
+            delta = 1 if active else -1
+            if active:
+                self._active.add(name)
+            else:
+                self._active.discard(name)
+            for other in self._conflicts[name]:
+                self._n_conflicts[other] += delta
+                affected.add(other)
+            for other in self._services[name].depends:
+                if other in self._services:
+                    self._n_dependents[other] += delta
+                    affected.add(other)
+
+        for other in affected:
+            if self._is_blocking(other):
+                self._blocking.add(other)
+            else:
+                self._blocking.discard(other)
+
+    def _state(self, name):
+        service = self._services.get(name, None)
+        if service is None:
+            # e.g. removed from the bundle, but still shown somewhere
+            return ServiceState.OPTIONAL
+        if service.is_core:
+            state = ServiceState.REQUIRED
+        elif self._n_conflicts[name] > 0:
+            state = ServiceState.CONFLICTED
+        elif self._n_dependents[name] > 0:
+            state = ServiceState.REQUIRED
+        else:
+            state = ServiceState.OPTIONAL
+
+        n_required = service.required_num_units()
+        n_units = self._units[name]
+        if state == ServiceState.OPTIONAL and \
+           n_units > 0 and n_units < n_required:
+            state = ServiceState.REQUIRED
+        elif state == ServiceState.REQUIRED and n_units >= n_required:
+            if n_units > 0:
+                state = ServiceState.OPTIONAL
+        return state
+
+    def _is_blocking(self, name):
+        if name in self._assigned:
+            return (self._units[name] <
+                    self._services[name].required_num_units())
+        if name in self._deployed:
+            return False
+        return self._state(name) == ServiceState.REQUIRED
+
+    def state(self, service):
+        """Returns (state, conflicting, depending) for service, as described
+        in PlacementController.get_service_state()."""
+        name = service.service_name
+        if name not in self._services:
+            return (ServiceState.OPTIONAL, [], [])
+        conflicting = [self._services[o] for o in self._conflicts[name]
+                       if o in self._active]
+        depending = [self._services[o] for o in self._dependents[name]
+                     if o in self._active]
+        return (self._state(name), conflicting, depending)
+
+    def blocking(self):
+        """Returns the services that currently prevent deploying."""
+        return [self._services[name] for name in self._blocking]
+
+    def can_deploy(self):
+        return len(self._blocking) == 0
@@ -0,0 +1,293 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Placement strategies used by PlacementController.gen_defaults()
+"""
+
+import heapq
+import logging
+from collections import defaultdict, namedtuple
+
+from bundleplacer.assignmenttype import AssignmentType
+from bundleplacer.constraints import compile_constraints
+from bundleplacer.fleet import FleetIndex
+
+log = logging.getLogger('bundleplacer')
+
+RESOURCES = ['cpu_cores', 'mem', 'storage']
+
+Resources = namedtuple('Resources', RESOURCES)
+
+PlacementReport = namedtuple('PlacementReport', ['solver', 'placed',
+                                                 'unplaced', 'machines_used',
+                                                 'utilization'])
+
+
+def machine_capacity(machine):
+    """Returns the Resources of a machine from its parsed hardware
+    fields. '*' is treated as unlimited."""
+    return Resources(machine.cpu_count, machine.mem_mb, machine.storage_mb)
+
+
+def service_demand(constraints):
+    """Returns the Resources a unit with these constraints needs."""
+    c = compile_constraints(constraints)
+    return Resources(c.cpu_cores or 0, c.mem or 0, c.root_disk or 0)
+
+
+def _size_key(r):
+    return (r.mem, r.cpu_cores, r.storage)
+
+
+class _MachinePool:
+
+    """Free machines in search order, as a bitset over a FleetIndex.
+
+    take() returns the first free machine, in search order, that
+    satisfies the constraints.
+
+    index, when given and covering machines, is searched instead of
+    building one just for this pool.
+    """
+
+    def __init__(self, machines, index=None):
+        machines = list(machines)
+        if index is not None and index.covers(machines):
+            # bits of the machines, in search order
+            self._order = [index.bit(m) for m in machines]
+        else:
+            index = FleetIndex(machines)
+            self._order = list(range(len(machines)))
+        self._index = index
+        self._ascending = all(a < b for a, b in zip(self._order,
+                                                    self._order[1:]))
+        self._free = 0
+        for i in self._order:
+            self._free |= 1 << i
+
+    def _first(self, bits):
+        if self._ascending:
+            return (bits & -bits).bit_length() - 1
+        # bits as '0'/'1' characters, bit i at position i
+        flags = bin(bits)[:1:-1]
+        return next(i for i in self._order
+                    if i < len(flags) and flags[i] == '1')
+
+    def take(self, constraints):
+        fits = self._index.mask(constraints) & self._free
+        if fits == 0:
+            return None
+        i = self._first(fits)
+        self._free &= ~(1 << i)
+        return self._index.machines[i]
+
+    def take_largest(self, n):
+        free = [i for i in self._order if self._free >> i & 1]
+        taken = sorted(free, key=lambda i: _size_key(
+            machine_capacity(self._index.machines[i])), reverse=True)[:n]
+        for i in taken:
+            self._free &= ~(1 << i)
+        return [self._index.machines[i] for i in taken]
+
+
+def _size_order(machines):
+    """Sorts machines by (mem, cores, storage), so that the first machine
+    that fits is also the tightest fit."""
+    return sorted(machines, key=lambda m: _size_key(machine_capacity(m)))
+
+
+class PlacementSolver:
+
+    """Places units of services onto free machines.
+
+    Isolated services get one whole machine per unit. Services that can
+    share a machine are spread as LXD containers over up to lxd_hosts
+    machines, each unit going to the least loaded host that doesn't
+    already have a unit of that service.
+
+    Subclasses choose how the free machines are searched (make_pool), in
+    what order units are placed (order_units) and how shared services
+    are laid out (place_shared).
+    """
+
+    name = None
+
+    def __init__(self, lxd_hosts=3):
+        self.lxd_hosts = lxd_hosts
+
+    def make_pool(self, machines, index=None):
+        return _MachinePool(_size_order(machines), index)
+
+    def order_units(self, services):
+        """Returns the isolated services to place, one entry per unit."""
+        units = [s for s in services for n in range(s.required_num_units())]
+        return sorted(units,
+                      key=lambda s: _size_key(service_demand(s.constraints)),
+                      reverse=True)
+
+    def solve(self, isolated_services, shared_services, machines,
+              shared_atype=AssignmentType.LXD, index=None):
+        """Returns (assignments, report).
+
+        assignments is {instance_id: {atype: [service]}}
+        report is a PlacementReport
+
+        index is an optional FleetIndex covering machines, such as
+        MaasState.fleet_index(), to match constraints against.
+        """
+        assignments = defaultdict(lambda: defaultdict(list))
+        used = {}
+        demand = defaultdict(lambda: Resources(0, 0, 0))
+        placed, unplaced = 0, []
+
+        def record(machine, service):
+            iid = machine.instance_id
+            used[iid] = machine
+            demand[iid] = Resources(*[a + b for a, b in zip(
+                demand[iid], service_demand(service.constraints))])
+
+        pool = self.make_pool(machines, index)
+        for service in self.order_units(isolated_services):
+            m = pool.take(service.constraints)
+            if m is None:
+                unplaced.append(service)
+                continue
+            assignments[m.instance_id][AssignmentType.BareMetal].append(
+                service)
+            record(m, service)
+            placed += 1
+
+        for host, service in self.place_shared(pool, shared_services):
+            if host is None:
+                unplaced.append(service)
+                continue
+            assignments[host.instance_id][shared_atype].append(service)
+            record(host, service)
+            placed += 1
+
+        report = PlacementReport(self.name, placed, unplaced, len(used),
+                                 self._utilization(used, demand))
+        return assignments, report
+
+    def place_shared(self, pool, shared_services):
+        """Yields (host, service) for each unit of shared_services, taking
+        hosts from pool. host is None for a unit that can't be placed."""
+        shared_units = sum(s.required_num_units() for s in shared_services)
+        hosts = []
+        if shared_units > 0:
+            hosts = pool.take_largest(min(self.lxd_hosts, shared_units))
+        if len(hosts) == 0:
+            for s in shared_services:
+                for n in range(s.required_num_units()):
+                    yield None, s
+            return
+
+        # (load, index) so ties go to the earlier host
+        heap = [(0, i) for i in range(len(hosts))]
+        for service in sorted(shared_services,
+                              key=lambda s: _size_key(
+                                  service_demand(s.constraints)),
+                              reverse=True):
+            taken = []
+            for n in range(service.required_num_units()):
+                if len(heap) == 0:
+                    heap, taken = taken, []
+                    heapq.heapify(heap)
+                load, i = heapq.heappop(heap)
+                yield hosts[i], service
+                mem = service_demand(service.constraints).mem
+                taken.append((load + max(mem, 1), i))
+            for entry in taken:
+                heapq.heappush(heap, entry)
+
+    def _utilization(self, used, demand):
+        """Returns {resource: demanded / available} over the used machines,
+        ignoring machines with unlimited ('*') hardware."""
+        utilization = {}
+        for idx, resource in enumerate(RESOURCES):
+            have = need = 0
+            for iid, machine in used.items():
+                cap = machine_capacity(machine)[idx]
+                if cap in (0, float('inf')):
+                    continue
+                have += cap
+                need += demand[iid][idx]
+            utilization[resource] = need / have if have else 0.0
+        return utilization
+
+
+class FirstFitSolver(PlacementSolver):
+
+    """Places units in the order given on the first machine that fits,
+    searching machines in fleet order.
+
+    Shared services are placed as the placer always did: one assignment
+    per service, whatever its number of units, all on the first free
+    machine in fleet order.
+    """
+
+    name = 'first-fit'
+
+    def __init__(self, lxd_hosts=1):
+        super().__init__(lxd_hosts)
+
+    def make_pool(self, machines, index=None):
+        return _MachinePool(machines, index)
+
+    def order_units(self, services):
+        return [s for s in services for n in range(s.required_num_units())]
+
+    def place_shared(self, pool, shared_services):
+        if len(shared_services) == 0:
+            return
+        host = pool.take({})
+        for service in shared_services:
+            yield host, service
+
+
+class FirstFitDecreasingSolver(PlacementSolver):
+
+    """Places the largest units first, each on the first machine in fleet
+    order that fits."""
+
+    name = 'first-fit-decreasing'
+
+    def make_pool(self, machines, index=None):
+        return _MachinePool(machines, index)
+
+
+class BestFitSolver(PlacementSolver):
+
+    """Places the largest units first, each on the smallest machine that
+    fits."""
+
+    name = 'best-fit'
+
+
+SOLVERS = {cls.name: cls for cls in [FirstFitSolver,
+                                     FirstFitDecreasingSolver,
+                                     BestFitSolver]}
+
+DEFAULT_SOLVER = BestFitSolver.name
+
+
+def get_solver(name=None, **kwargs):
+    """Returns a solver instance by name, defaulting to best-fit."""
+    if not name:
+        name = DEFAULT_SOLVER
+    if name not in SOLVERS:
+        raise ValueError("Unknown placement solver '{}', expected one "
+                         "of {}".format(name, ", ".join(sorted(SOLVERS))))
+    return SOLVERS[name](**kwargs)
@@ -17,7 +17,8 @@ import logging
 
 from urwid import Divider, Pile, Text, WidgetWrap
 
-from bundleplacer.maas import MaasMachineStatus, satisfies
+from bundleplacer.constraints import compile_constraints
+from bundleplacer.maas import MaasMachineStatus
 from bundleplacer.ui.filter_box import FilterBox
 from bundleplacer.ui.simple_machine_widget import SimpleMachineWidget
 
@@ -31,7 +32,8 @@ class MachinesList(WidgetWrap):
 
     action - a function to call when the machine's button is pressed
 
-    constraints - a dict of constraints to filter the machines list.
+    constraints - juju constraints to filter the machines list, as a
+    string, dict or constraints.Constraints.
     only machines matching all the constraints will be shown.
 
     show_hardware - bool, whether or not to show the hardware details
@@ -55,10 +57,9 @@ class MachinesList(WidgetWrap):
         self.controller = controller
         self.display_controller = display_controller
         self.machine_widgets = []
-        if constraints is None:
-            self.constraints = {}
-        else:
-            self.constraints = constraints
+        # instance_id: SimpleMachineWidget
+        self.machine_widgets_by_id = {}
+        self.constraints = compile_constraints(constraints)
         self.show_hardware = show_hardware
         self.show_assignments = show_assignments
         self.show_placeholders = show_placeholders
@@ -100,8 +101,7 @@ class MachinesList(WidgetWrap):
         self.update()
 
     def find_machine_widget(self, m):
-        return next((mw for mw in self.machine_widgets if
-                     mw.machine.instance_id == m.instance_id), None)
+        return self.machine_widgets_by_id.get(m.instance_id, None)
 
     def update(self):
         machines = self.controller.machines(
@@ -109,10 +109,9 @@ class MachinesList(WidgetWrap):
         if self.show_only_ready:
             machines = [m for m in machines
                         if m.status == MaasMachineStatus.READY]
-        for mw in self.machine_widgets:
-            machine = next((m for m in machines if
-                            mw.machine.instance_id == m.instance_id), None)
-            if machine is None:
+        machine_ids = set(m.instance_id for m in machines)
+        for mw in list(self.machine_widgets):
+            if mw.machine.instance_id not in machine_ids:
                 self.remove_machine(mw.machine)
 
         n_satisfying_machines = len(machines)
@@ -125,8 +124,10 @@ class MachinesList(WidgetWrap):
                                for cc in al])
             return s
 
+        satisfying = self.controller.satisfying_ids(machines,
+                                                    self.constraints)
         for m in machines:
-            if not satisfies(m, self.constraints)[0]:
+            if m.instance_id not in satisfying:
                 self.remove_machine(m)
                 n_satisfying_machines -= 1
                 continue
@@ -157,6 +158,7 @@ class MachinesList(WidgetWrap):
                                  self.display_controller,
                                  self.show_assignments)
         self.machine_widgets.append(mw)
+        self.machine_widgets_by_id[machine.instance_id] = mw
         options = self.machine_pile.options()
         self.machine_pile.contents.append((mw, options))
 
@@ -174,6 +176,7 @@ class MachinesList(WidgetWrap):
             return
 
         self.machine_widgets.remove(mw)
+        del self.machine_widgets_by_id[machine.instance_id]
         mw_idx = 0
         for w, opts in self.machine_pile.contents:
             if w == mw:
@@ -187,19 +190,18 @@ class MachinesList(WidgetWrap):
     def sort_machine_widgets(self):
         def keyfunc(mw):
             m = mw.machine
-            hwinfo = " ".join(map(str, [m.arch, m.cpu_cores, m.mem,
-                                        m.storage]))
-            if str(mw.machine.status) == 'ready':
+            if str(m.status) == 'ready':
                 skey = 'A'
             else:
-                skey = str(mw.machine.status)
-            return skey + mw.machine.hostname + hwinfo
+                skey = str(m.status)
+            return (skey, m.hostname, str(m.arch), m.cpu_count, m.mem_mb,
+                    m.storage_mb)
         self.machine_widgets.sort(key=keyfunc)
 
         def wrappedkeyfunc(t):
             mw, options = t
             if not isinstance(mw, SimpleMachineWidget):
-                return 'A'
+                return ('A',)
             return keyfunc(mw)
 
         self.machine_pile.contents.sort(key=wrappedkeyfunc)
@@ -142,10 +142,10 @@ class SimpleServiceWidget(WidgetWrap):
                               (Divider(), self.pile.options())]
 
     def update(self):
-        self.service = next((s for s in
-                             self.placement_controller.bundle.services
-                             if s.service_name == self.service.service_name),
-                            self.service)
+        service = self.placement_controller.get_service(
+            self.service.service_name)
+        if service is not None:
+            self.service = service
         self.update_action_buttons()
 
         if self.state == ServiceWidgetState.CHOOSING:
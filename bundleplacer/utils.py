@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import codecs
 import configparser
 import errno
 import fnmatch
@@ -606,6 +607,61 @@ def slurp(path):
         raise IOError
 
 
+def decode_chunks(chunks, encoding='utf-8'):
+    """ Decodes an iterable of bytes into str chunks, handling characters
+    split across chunks
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def iter_json_array(chunks):
+    """ Yields the elements of a JSON array as they are parsed from an
+    iterable of str chunks, so the whole document is never held in
+    memory at once
+
+    :raises ValueError: if the text is not a JSON array
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    opened = False
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or
+                                  (opened and buf[pos] == ',')):
+            pos += 1
+        if pos < len(buf):
+            if not opened:
+                if buf[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                opened = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                end = None
+            # an element is only complete once something follows it
+            if end is not None and end < len(buf):
+                yield obj
+                pos = end
+                continue
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("Unexpected end of JSON array")
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
 def human_to_mb(s):
     """Translates human-readable strings like '10G' to numeric
     megabytes"""
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# tests assignmentstore.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import pickle
+import time
+import unittest
+
+from bundleplacer.assignmentstore import AssignmentStore
+from bundleplacer.assignmenttype import AssignmentType
+
+log = logging.getLogger('bundleplacer.test_assignmentstore')
+
+LXD = AssignmentType.LXD
+KVM = AssignmentType.KVM
+
+
+class AssignmentStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.store = AssignmentStore()
+        self.store.add('m1', 'keystone', LXD)
+        self.store.add('m1', 'mysql', KVM)
+        self.store.add('m2', 'keystone', LXD)
+
+    def test_both_directions(self):
+        self.assertEqual(self.store['m1'], {LXD: ['keystone'],
+                                            KVM: ['mysql']})
+        self.assertEqual(self.store.machines_for_service('keystone'),
+                         {LXD: ['m1', 'm2']})
+        self.assertEqual(self.store.count_for_service('keystone'), 2)
+        self.assertEqual(self.store.count_for_machine('m1'), 2)
+
+    def test_remove_prunes_empty_entries(self):
+        self.store.remove('m2', 'keystone', LXD)
+        self.assertNotIn('m2', self.store)
+        self.assertEqual(self.store.machines_for_service('keystone'),
+                         {LXD: ['m1']})
+        with self.assertRaises(ValueError):
+            self.store.remove('m2', 'keystone', LXD)
+
+    def test_remove_service(self):
+        removed = self.store.remove_service('keystone')
+        self.assertEqual(sorted(removed), [('m1', LXD), ('m2', LXD)])
+        self.assertEqual(self.store, {'m1': {KVM: ['mysql']}})
+
+    def test_clear_machine(self):
+        self.store.clear_machine('m1')
+        self.assertEqual(self.store.count_for_service('mysql'), 0)
+        self.assertEqual(self.store.machines_for_service('keystone'),
+                         {LXD: ['m2']})
+
+    def test_copy_is_independent(self):
+        c = self.store.copy()
+        c.remove_any('m1', 'keystone')
+        self.assertEqual(self.store.count_for_service('keystone'), 2)
+        self.assertEqual(c.count_for_service('keystone'), 1)
+
+    def test_copy_shares_until_written(self):
+        c = self.store.copy()
+        self.assertEqual(self.store.diff(c), [])
+        self.store.add('m3', 'ntp', LXD)
+        c.add('m1', 'ntp', LXD)
+        self.assertNotIn('m3', c)
+        self.assertNotIn('ntp', self.store['m1'][LXD])
+        self.assertEqual(sorted(self.store.diff(c)), ['m1', 'm3'])
+
+    def test_update_from(self):
+        c = self.store.copy()
+        c.remove('m2', 'keystone', LXD)
+        c.add('m3', 'ntp', KVM)
+        changed = self.store.update_from(c)
+        self.assertEqual(changed, {'keystone', 'ntp'})
+        self.assertEqual(self.store, c)
+        self.assertEqual(self.store.machines_for_service('keystone'),
+                         {LXD: ['m1']})
+
+    def test_reading_does_not_mutate(self):
+        self.store['m3'][LXD].append('ntp')
+        self.assertNotIn('m3', self.store)
+        self.assertEqual(self.store.count_for_service('ntp'), 0)
+
+    def test_pickle(self):
+        self.store.remove('m1', 'keystone', LXD)
+        restored = pickle.loads(pickle.dumps(self.store))
+        self.assertEqual(restored, self.store)
+        self.assertEqual(restored.service_counts(),
+                         {'keystone': 1, 'mysql': 1})
+        restored.add('m1', 'ntp', LXD)
+        self.assertEqual(restored['m1'], {KVM: ['mysql'], LXD: ['ntp']})
+
+    def test_many_units_per_service(self):
+        def add_units(n):
+            store = AssignmentStore()
+            start = time.perf_counter()
+            for i in range(n):
+                store.add('m{}'.format(i % 10), 'ceph', LXD)
+            return store, time.perf_counter() - start
+
+        store, small = add_units(4000)
+        _, large = add_units(16000)
+        # linear would be about 4 times slower, quadratic about 16
+        self.assertLess(large, small * 10)
+
+        c = store.copy()
+        c.add('m0', 'ceph', KVM)
+        store.remove('m1', 'ceph', LXD)
+        self.assertEqual(store.count_for_service('ceph'), 3999)
+        self.assertEqual(c.count_for_service('ceph'), 4001)
+        self.assertEqual(c.count_for_machine('m1'), 400)
+        self.assertEqual(store.count_for_machine('m0'), 400)
+        self.assertEqual(len(c.machines_for_service('ceph')[LXD]), 4000)
+        store.remove_service('ceph')
+        self.assertEqual(len(store), 0)
+        self.assertEqual(c.count_for_service('ceph'), 4001)
+
+    def test_readding_refreshes_key_object(self):
+        class Key(str):
+            pass
+        old, new = Key('ntp'), Key('ntp')
+        self.store.add('m1', old, LXD)
+        c = self.store.copy()
+        c.add('m2', new, LXD)
+        self.assertIs([k for k in c.services() if k == 'ntp'][0], new)
+        self.assertIs([k for k in self.store.services() if k == 'ntp'][0],
+                      new)
+        # a new store doesn't share keys with the old ones
+        self.assertIsNot(AssignmentStore()._keys, self.store._keys)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# tests async.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+from concurrent.futures import Future
+from threading import Event
+from unittest.mock import patch
+
+from bundleplacer.async import (Priority, Scheduler, gather, map, recover,
+                                resolved, submit, then)
+
+log = logging.getLogger('bundleplacer.test_async')
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.release = Event()
+        self.scheduler = Scheduler(workers=1)
+        self.addCleanup(self.scheduler.shutdown)
+        self.addCleanup(self.release.set)
+        # keep the only worker busy until released
+        self.blocker = self.scheduler.submit(lambda: self.release.wait(5))
+
+    def test_priority_order(self):
+        ran = []
+        futures = [self.scheduler.submit(lambda p=p: ran.append(p), p)
+                   for p in [Priority.PREFETCH, Priority.VISIBLE,
+                             Priority.INTERACTIVE, Priority.VISIBLE]]
+        self.release.set()
+        for f in futures:
+            f.result(5)
+        self.assertEqual(ran, [Priority.INTERACTIVE, Priority.VISIBLE,
+                               Priority.VISIBLE, Priority.PREFETCH])
+
+    def test_dedup_and_promote(self):
+        ran = []
+        first = self.scheduler.submit(lambda: ran.append('readme') or 1,
+                                      Priority.PREFETCH, key='readme')
+        other = self.scheduler.submit(lambda: ran.append('other'),
+                                      Priority.VISIBLE)
+        again = self.scheduler.submit(lambda: ran.append('dup'),
+                                      Priority.INTERACTIVE, key='readme')
+        self.assertIs(first, again)
+        self.release.set()
+        other.result(5)
+        self.assertEqual(first.result(5), 1)
+        self.assertEqual(ran, ['readme', 'other'])
+
+        m = self.scheduler.metrics()
+        self.assertEqual((m['submitted'], m['deduplicated'], m['promoted']),
+                         (3, 1, 1))
+        self.assertEqual(m['queue_depth'], 0)
+        # the blocker may not have started yet either
+        self.assertIn(m['max_queue_depth'], (2, 3))
+        self.assertEqual(m['interactive']['started'], 1)
+
+        # a finished job no longer deduplicates
+        self.assertIsNot(self.scheduler.submit(lambda: 2, key='readme'),
+                         first)
+
+    def test_failure_and_workers(self):
+        scheduler = Scheduler(workers=3)
+        self.addCleanup(scheduler.shutdown)
+        started = [Event() for _ in range(3)]
+
+        def job(i):
+            started[i].set()
+            self.release.wait(5)
+            raise ValueError(i)
+        futures = [scheduler.submit(lambda i=i: job(i)) for i in range(3)]
+        for e in started:
+            self.assertTrue(e.wait(5))
+        self.release.set()
+        with self.assertRaises(ValueError):
+            futures[0].result(5)
+        self.assertEqual(scheduler.metrics()['workers'], 3)
+
+    def test_burst_uses_every_worker(self):
+        scheduler = Scheduler(workers=4)
+        self.addCleanup(scheduler.shutdown)
+        # leave one worker idle before the burst
+        scheduler.submit(lambda: None).result(5)
+        started = [Event() for _ in range(4)]
+
+        def job(i):
+            started[i].set()
+            self.release.wait(5)
+        for i in range(4):
+            scheduler.submit(lambda i=i: job(i))
+        for e in started:
+            self.assertTrue(e.wait(5))
+        self.assertEqual(scheduler.metrics()['workers'], 4)
+
+
+class FutureCompositionTestCase(unittest.TestCase):
+
+    def test_map_and_recover(self):
+        f = Future()
+        doubled = map(f, lambda x: x * 2)
+        self.assertFalse(doubled.done())
+        f.set_result(21)
+        self.assertEqual(doubled.result(0), 42)
+
+        failed = Future()
+        mapped = map(failed, lambda x: x * 2)
+        recovered = recover(mapped, lambda e: str(e))
+        failed.set_exception(ValueError('nope'))
+        self.assertIsInstance(mapped.exception(0), ValueError)
+        self.assertEqual(recovered.result(0), 'nope')
+
+    def test_then_flattens(self):
+        f = Future()
+        inner = Future()
+        chained = then(f, lambda x: inner)
+        f.set_result(1)
+        self.assertFalse(chained.done())
+        inner.set_result(2)
+        self.assertEqual(chained.result(0), 2)
+        self.assertEqual(then(resolved(1), lambda x: resolved(x + 1))
+                         .result(0), 2)
+
+    def test_gather(self):
+        futures = [Future() for _ in range(3)]
+        all_f = gather(futures)
+        for i, f in reversed(list(enumerate(futures))):
+            f.set_result(i)
+        self.assertEqual(all_f.result(0), [0, 1, 2])
+        self.assertEqual(gather([]).result(0), [])
+
+        futures = [Future(), Future()]
+        all_f = gather(futures)
+        futures[1].set_exception(KeyError())
+        self.assertIsInstance(all_f.exception(0), KeyError)
+
+    def test_submit_after_shutdown(self):
+        with patch('bundleplacer.async.ShutdownEvent') as mock_event:
+            mock_event.is_set.return_value = True
+            f = submit(lambda: 1, None)
+        self.assertTrue(f.cancelled())
+        self.assertTrue(map(f, lambda x: x).cancelled())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# tests bundle.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+
+from bundleplacer.bundle import Bundle
+
+log = logging.getLogger('bundleplacer.test_bundle')
+
+
+def make_bundle_data():
+    return {'series': 'xenial',
+            'services': {
+                'keystone': {'charm': 'cs:xenial/keystone-100',
+                             'num_units': 1},
+                'mysql': {'charm': 'cs:xenial/mysql-10',
+                          'num_units': 1},
+                'ntp': {'charm': 'cs:xenial/ntp-5'}},
+            'machines': {},
+            'relations': [['keystone:shared-db', 'mysql:shared-db'],
+                          ['ntp:juju-info', 'mysql:juju-info']]}
+
+
+class BundleServicesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bundle = Bundle(bundle_data=make_bundle_data())
+
+    def _by_name(self):
+        return {s.service_name: s for s in self.bundle.services}
+
+    def test_services_are_cached(self):
+        first = self._by_name()
+        second = self._by_name()
+        for name, service in first.items():
+            self.assertIs(service, second[name])
+
+    def test_scale_rebuilds_only_scaled_service(self):
+        before = self._by_name()
+        version = self.bundle.version
+        self.bundle.scale_service('keystone', 2)
+        after = self._by_name()
+        self.assertGreater(self.bundle.version, version)
+        self.assertEqual(after['keystone'].num_units, 3)
+        self.assertIsNot(before['keystone'], after['keystone'])
+        self.assertIs(before['mysql'], after['mysql'])
+        self.assertIs(before['ntp'], after['ntp'])
+
+    def test_set_option(self):
+        self.bundle.set_option('mysql', 'max-connections', 100)
+        self.assertEqual(self.bundle.get_service('mysql').options,
+                         {'max-connections': 100})
+
+    def test_relation_change_rebuilds_both_ends(self):
+        before = self._by_name()
+        self.bundle.add_relation('keystone', 'juju-info', 'ntp', 'juju-info')
+        after = self._by_name()
+        self.assertIsNot(before['keystone'], after['keystone'])
+        self.assertIsNot(before['ntp'], after['ntp'])
+        self.assertIs(before['mysql'], after['mysql'])
+        self.assertIn(('keystone:juju-info', 'ntp:juju-info'),
+                      after['ntp'].relations)
+
+    def test_remove_service(self):
+        self.bundle.services
+        self.bundle.remove_service('ntp')
+        services = self._by_name()
+        self.assertNotIn('ntp', services)
+        self.assertIsNone(self.bundle.get_service('ntp'))
+        self.assertEqual(services['mysql'].relations,
+                         [('keystone:shared-db', 'mysql:shared-db')])
+
+    def test_add_new_service(self):
+        self.bundle.services
+        name = self.bundle.add_new_service('mysql',
+                                           {'Id': 'cs:xenial/mysql-10'})
+        self.assertEqual(name, 'mysql-1')
+        self.assertIsNotNone(self.bundle.get_service('mysql-1'))
+        self.assertEqual(len(self.bundle.services), 4)
+
+    def test_update_adds_merged_services(self):
+        self.bundle.services
+        other = Bundle(bundle_data=make_bundle_data())
+        _, new_services, _ = self.bundle.update(other)
+        self.assertEqual(sorted(s.service_name for s in new_services),
+                         ['keystone-1', 'mysql-1', 'ntp-1'])
+        self.assertEqual(len(self.bundle.services), 6)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# tests charmcache.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from bundleplacer.async import cancelled, resolved
+from bundleplacer.charmcache import CharmCache, TextLRU
+from bundleplacer.charmstore_client import CharmStoreSession
+from bundleplacer.charmstore_api import (METADATA_CHUNK_SIZE,
+                                         METADATA_URL_MAX, CharmStoreAPI,
+                                         MetadataController, trim_readme)
+
+log = logging.getLogger('bundleplacer.test_charmcache')
+
+URL = 'https://api.jujucharms.com/charmstore/v5/xenial/mysql/readme'
+
+
+def response(status, text='', headers=None):
+    r = MagicMock()
+    r.status_code = status
+    r.ok = status < 400
+    r.text = text
+    r.headers = headers or {}
+    return r
+
+
+def run_now(func, exc_callback, **kwargs):
+    return resolved(func())
+
+
+class CharmCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'cfg', 'cache.sqlite')
+        self.cache = CharmCache(self.path, ttl=60)
+
+    def test_persists(self):
+        self.cache.put('meta', 'cs:xenial/mysql', {'Meta': {}}, etag='"1"')
+        entry = CharmCache(self.path).get('meta', 'cs:xenial/mysql')
+        self.assertEqual(entry.value, {'Meta': {}})
+        self.assertEqual(entry.etag, '"1"')
+        self.assertTrue(self.cache.is_fresh(entry))
+        self.assertIsNone(self.cache.get('readme', 'cs:xenial/mysql'))
+
+    @patch.object(CharmStoreSession, 'get')
+    def test_fetch_caches(self, mock_get):
+        mock_get.return_value = response(200, 'readme', {'ETag': '"a"'})
+        self.assertEqual(self.cache.fetch('readme', 'k', URL, False),
+                         'readme')
+        self.assertEqual(self.cache.fetch('readme', 'k', URL, False),
+                         'readme')
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('bundleplacer.charmcache.submit', new=run_now)
+    @patch.object(CharmStoreSession, 'get')
+    def test_stale_entry_served_and_revalidated(self, mock_get):
+        self.cache.put('readme', 'k', 'old', etag='"a"')
+        self.cache.ttl = 0
+        mock_get.return_value = response(304)
+        self.assertEqual(self.cache.fetch('readme', 'k', URL, False), 'old')
+        mock_get.assert_called_once_with(URL,
+                                         headers={'If-None-Match': '"a"'})
+
+        mock_get.return_value = response(200, 'new', {'ETag': '"b"'})
+        self.assertEqual(self.cache.fetch('readme', 'k', URL, False), 'old')
+        self.assertEqual(self.cache.get('readme', 'k').value, 'new')
+
+        mock_get.side_effect = requests.ConnectionError()
+        self.assertEqual(self.cache.revalidate('readme', 'k', URL, False),
+                         'new')
+        self.assertIsNone(self.cache.revalidate('readme', 'x', URL, False))
+
+    @patch.object(CharmStoreSession, 'get')
+    def test_metadata_served_offline(self, mock_get):
+        mock_get.side_effect = requests.ConnectionError()
+        charm = {'Meta': {'charm-metadata': {
+            'Provides': {'db': {'Interface': 'mysql'}}}}}
+        self.cache.put('meta', 'cs:xenial/mysql', charm)
+        self.cache.put('readme', 'cs:xenial/mysql', 'mysql readme')
+        bundle = MagicMock(series='xenial', charm_ids=[])
+        config = MagicMock()
+        config.getopt.return_value = False
+        mc = MetadataController(bundle, config, cache=self.cache)
+        readmes = []
+        with patch('bundleplacer.charmstore_api.submit', new=run_now):
+            mc._do_load(['cs:xenial/mysql-55'])
+            mc.get_readme('xenial/mysql', readmes.append)
+        self.assertEqual(mc.charm_info['cs:xenial/mysql'], charm)
+        self.assertEqual(mc.iface_info['cs:xenial/mysql']['provides'],
+                         [('db', 'mysql'), ('juju-info', 'juju-info')])
+        self.assertEqual(readmes[0].result(0), 'mysql readme')
+        self.assertEqual(mc.readmes['xenial/mysql'], 'mysql readme')
+
+    def test_successive_loads_coalesce(self):
+        submitted = []
+
+        def fake_submit(func, exc_callback, **kwargs):
+            f = Future()
+            submitted.append((func, f))
+            return f
+        bundle = MagicMock(series='xenial', charm_ids=[])
+        config = MagicMock()
+        config.getopt.return_value = False
+        mc = MetadataController(bundle, config, cache=self.cache)
+        done = []
+        with patch('bundleplacer.charmstore_api.submit', new=fake_submit):
+            mc.load(['a'])
+            mc.load(['b'], done_cb=done.append)
+            mc.load(['c'], done_cb=done.append)
+            self.assertEqual(len(submitted), 1)
+            submitted[0][1].set_result([])
+            self.assertEqual(len(submitted), 2)
+        self.assertEqual(submitted[1][0].args, (['b', 'c'],))
+        self.assertEqual(done, [])
+        submitted[1][1].set_result([])
+        self.assertEqual(len(done), 2)
+
+    def test_metadata_loaded_in_chunks(self):
+        def fetch(charm_ids):
+            fetched.append(charm_ids)
+            return {i: {'Meta': {'charm-metadata': {}}} for i in charm_ids}
+        fetched = []
+        chunks = []
+        bundle = MagicMock(series='xenial', charm_ids=[])
+        config = MagicMock()
+        config.getopt.return_value = False
+        mc = MetadataController(bundle, config, cache=self.cache)
+        mc.chunk_callbacks.append(chunks.append)
+        self.cache.put('meta', 'cs:xenial/cached', {'Meta': {
+            'charm-metadata': {}}})
+        names = ['cs:xenial/c{}x-1'.format(i) for i in range(45)]
+        with patch('bundleplacer.charmstore_api.submit', new=run_now), \
+                patch.object(mc, '_fetch_metadata', side_effect=fetch), \
+                patch.object(mc, 'request_readme'):
+            mc.load(['cs:xenial/cached'] + names)
+        self.assertTrue(mc.loaded())
+        self.assertEqual([len(c) for c in fetched],
+                         [METADATA_CHUNK_SIZE, METADATA_CHUNK_SIZE, 5])
+        self.assertEqual(chunks[0], ['cs:xenial/cached'])
+        self.assertEqual(sorted(sum(chunks[1:], [])),
+                         sorted(n[:-2] for n in names))
+        self.assertEqual(len(mc.iface_info), 46)
+
+    def test_metadata_chunks_bound_url(self):
+        bundle = MagicMock(series='xenial', charm_ids=[])
+        config = MagicMock()
+        config.getopt.return_value = False
+        mc = MetadataController(bundle, config, cache=self.cache)
+        ids = ['cs:~owner/xenial/{}-charm'.format('x' * 200 + str(i))
+               for i in range(12)]
+        chunks = list(mc._metadata_chunks(ids))
+        self.assertEqual(sum(chunks, []), ids)
+        self.assertGreater(len(chunks), 1)
+        for c in chunks:
+            self.assertLessEqual(len(mc._bulk_metadata_url(c)),
+                                 METADATA_URL_MAX)
+
+    def test_readmes_trimmed(self):
+        readme = ("# MySQL\n\nOverview\n--------\n\nMySQL is a "
+                  "database.\nIt is fast.\n\n## Usage\n\nDeploy it.")
+        self.assertEqual(trim_readme(readme),
+                         "MySQL is a database.\nIt is fast.")
+        self.assertEqual(trim_readme("x" * 50, max_chars=10),
+                         "x" * 9 + "…")
+
+    def test_requests_after_shutdown(self):
+        bundle = MagicMock(series='xenial', charm_ids=[])
+        config = MagicMock()
+        config.getopt.return_value = False
+        mc = MetadataController(bundle, config, cache=self.cache)
+        cb = MagicMock()
+        with patch('bundleplacer.charmstore_api.submit',
+                   new=lambda *args, **kwargs: cancelled()):
+            mc.load(['cs:xenial/mysql'], done_cb=cb)
+            mc.get_readme('xenial/mysql', cb)
+        self.assertTrue(mc.metadata_future.cancelled())
+        self.assertEqual(mc.readme_futures, {})
+        self.assertFalse(cb.called)
+
+
+class TextLRUTestCase(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        texts = {k: k * 100 for k in 'abcd'}
+        lru = TextLRU(3 * sys.getsizeof(texts['a']))
+        for k in 'abc':
+            lru[k] = texts[k]
+        self.assertEqual(lru.get('a'), texts['a'])
+        lru['d'] = texts['d']
+        self.assertNotIn('b', lru)
+        self.assertIn('a', lru)
+        self.assertEqual(len(lru), 3)
+        self.assertLessEqual(lru.nbytes, lru.max_bytes)
+        with self.assertRaises(KeyError):
+            lru['b']
+        lru['big'] = 'x' * lru.max_bytes
+        self.assertNotIn('big', lru)
+
+
+class CharmStoreAPITestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(CharmStoreAPI._cache.clear)
+        self.jobs = []
+
+        def fake_submit(func, exc_callback, **kwargs):
+            self.jobs.append(func)
+            return Future()
+        p = patch('bundleplacer.charmstore_api.submit', new=fake_submit)
+        p.start()
+        self.addCleanup(p.stop)
+
+    @patch.object(CharmStoreSession, 'get')
+    def test_summaries_batched(self, mock_get):
+        mock_get.return_value = MagicMock(json=lambda: {
+            'xenial/{}'.format(n): {'Meta': {'charm-metadata': {
+                'Summary': n + ' summary'}}} for n in ['mysql', 'nova']})
+        api = CharmStoreAPI('xenial')
+        summaries = [api.get_summary(n, None)
+                     for n in ['mysql', 'nova', 'absent']]
+        self.assertEqual(len(self.jobs), 1)
+        self.jobs[0]()
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual([f.result(0) for f in summaries],
+                         ['mysql summary', 'nova summary', None])
+        self.assertEqual(api.get_summary('nova', None).result(0),
+                         'nova summary')
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# tests charmstore_client.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import json
+import logging
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+from bundleplacer.charmstore_client import CharmStoreSession
+
+log = logging.getLogger('bundleplacer.test_charmstore_client')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if self.path == '/flaky' and self.server.paths.count('/flaky') < 2:
+            status, body = 503, b''
+        else:
+            status = 200
+            body = json.dumps(dict(path=self.path)).encode('utf-8')
+        headers = [('Content-Type', 'application/json')]
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers.append(('Content-Encoding', 'gzip'))
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class CharmStoreSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.paths = []
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://{}:{}'.format(*self.server.server_address[:2])
+        self.session = CharmStoreSession(backoff_factor=0)
+        self.addCleanup(self.session.close)
+
+    def test_connections_reused(self):
+        for i in range(5):
+            r = self.session.get('{}/meta/{}'.format(self.url, i))
+            self.assertEqual(r.json(), dict(path='/meta/{}'.format(i)))
+            self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(self.session.stats(),
+                         dict(requests=5, connections_opened=1,
+                              connections_reused=4))
+
+    def test_retries_server_errors(self):
+        r = self.session.get(self.url + '/flaky')
+        self.assertTrue(r.ok)
+        self.assertEqual(self.server.paths, ['/flaky', '/flaky'])
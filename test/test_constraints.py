@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#
+# tests constraints.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+
+from bundleplacer.constraints import Constraints, compile_constraints
+from bundleplacer.controller import PlaceholderMachine
+from bundleplacer.fleet import FleetIndex
+from bundleplacer.maas import MaasMachine, satisfies
+
+log = logging.getLogger('bundleplacer.test_constraints')
+
+
+class ConstraintsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.machine = MaasMachine('m1', {'hostname': 'm1',
+                                          'cpu_count': 4,
+                                          'memory': 8192,
+                                          'storage': 100000,
+                                          'architecture': 'amd64/generic',
+                                          'tag_names': ['ssd', 'compute'],
+                                          'zone': {'name': 'zone1'}})
+
+    def test_string_and_dict_compile_equal(self):
+        s = compile_constraints('mem=8G cpu-cores=4 root-disk=20G arch=amd64')
+        d = compile_constraints({'mem': 8192, 'cores': '4',
+                                 'storage': '20G', 'arch': 'amd64'})
+        self.assertEqual(s, d)
+        self.assertEqual(hash(s), hash(d))
+        self.assertEqual(s.mem, 8192)
+        self.assertEqual(s.cpu_cores, 4)
+        self.assertEqual(s.root_disk, 20480)
+        self.assertIs(compile_constraints(s), s)
+        self.assertIs(compile_constraints('mem=8G'),
+                      compile_constraints('mem=8G'))
+
+    def test_empty(self):
+        for spec in [None, {}, '']:
+            c = compile_constraints(spec)
+            self.assertEqual(len(c), 0)
+            self.assertTrue(c.matches(self.machine))
+
+    def test_matches(self):
+        self.assertTrue(compile_constraints(
+            'arch=amd64 tags=ssd zones=zone1,zone2').matches(self.machine))
+        self.assertFalse(compile_constraints(
+            'tags=ssd,^compute').matches(self.machine))
+        self.assertFalse(compile_constraints(
+            'zones=zone2').matches(self.machine))
+
+    def test_explain(self):
+        c = compile_constraints('mem=16G cores=2 tags=gpu')
+        self.assertEqual(satisfies(self.machine, c), (False, ['mem', 'tags']))
+        self.assertEqual(c.explain(self.machine),
+                         ['mem=16.00 G', 'tags=gpu'])
+
+    def test_unknown_keys_are_kept(self):
+        c = Constraints('mem=4G cpu-power=100')
+        self.assertEqual(dict(c.other), {'cpu-power': '100'})
+        self.assertEqual(str(c), 'mem=4096M cpu-power=100')
+        self.assertEqual(c.raw, 'mem=4G cpu-power=100')
+
+    def test_malformed_values_are_kept(self):
+        spec = 'cores= mem=foo root-disk=x storage=10X arch=amd64'
+        with self.assertLogs('bundleplacer', 'WARNING') as logs:
+            c = Constraints(spec)
+        self.assertEqual(len(logs.output), 4)
+        self.assertEqual(dict(c), {'arch': 'amd64'})
+        self.assertEqual(dict(c.other), {'cores': '', 'mem': 'foo',
+                                         'root-disk': 'x',
+                                         'storage': '10X'})
+        self.assertEqual(c.raw, spec)
+        self.assertTrue(c.matches(self.machine))
+
+        c = compile_constraints({'mem': None, 'tags': 5})
+        self.assertEqual(len(c), 0)
+        self.assertEqual(dict(c.other), {'mem': None, 'tags': 5})
+
+    def test_fleet_index_agrees(self):
+        other = MaasMachine('m2', {'hostname': 'm2',
+                                   'cpu_count': 2,
+                                   'memory': 2048,
+                                   'architecture': 'arm64',
+                                   'tag_names': ['ssd']})
+        machines = [self.machine, other]
+        index = FleetIndex(machines)
+        for spec in ['tags=ssd', 'tags=^compute', 'zones=zone1',
+                     'arch=arm64', 'root-disk=1G', 'mem=1G cores=4']:
+            for i, m in enumerate(machines):
+                self.assertEqual(bool(index.mask(spec) >> i & 1),
+                                 compile_constraints(spec).matches(m), spec)
+
+    def test_placeholder_from_constraints(self):
+        pm = PlaceholderMachine('p1', 'p1', 'mem=6G root-disk=20G cores=2')
+        self.assertEqual(pm.mem, 6144)
+        self.assertEqual(pm.storage, 20480)
+        self.assertEqual(pm.cpu_cores, 2)
+        self.assertEqual(pm.arch, '?')
+        self.assertTrue(satisfies(pm, 'mem=4G cores=2')[0])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# tests fixtures/maas.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import unittest
+from unittest.mock import patch
+
+from bundleplacer.fixtures.maas import FakeMaasState
+from bundleplacer.maas import MaasMachineStatus, iter_nodes
+
+log = logging.getLogger('bundleplacer.test_fake_maas')
+
+NODES_FILE = os.path.join(os.path.dirname(__file__), '..', 'share',
+                          'maas-machines.json')
+
+
+class FakeMaasStateTestCase(unittest.TestCase):
+
+    def test_loads_once(self):
+        with patch('bundleplacer.fixtures.maas.iter_nodes',
+                   wraps=iter_nodes) as mock_load:
+            state = FakeMaasState(NODES_FILE)
+            first = state.machines()
+            self.assertEqual(len(first), 13)
+            self.assertEqual(state.machines(), first)
+            self.assertIs(state.machines()[0], first[0])
+        self.assertEqual(mock_load.call_count, 1)
+
+    def test_filters(self):
+        state = FakeMaasState(NODES_FILE)
+        ready = state.machines(state=MaasMachineStatus.READY)
+        self.assertEqual(len(ready), 12)
+        tagged = state.machines(constraints='tags=node-two')
+        self.assertEqual([m.hostname for m in tagged], ['two.maas'])
+
+    def test_generated_fleet_is_reproducible(self):
+        a = FakeMaasState(count=500, seed=3)
+        b = FakeMaasState(count=500, seed=3)
+        self.assertEqual(len(a.machines()), 500)
+        self.assertEqual([m.machine for m in a.machines()],
+                         [m.machine for m in b.machines()])
+        self.assertNotEqual(a.nodes(),
+                            FakeMaasState(count=500, seed=4).nodes())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# tests fleet.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+
+from bundleplacer.fleet import FleetIndex
+from bundleplacer.maas import MaasMachine, satisfies
+
+log = logging.getLogger('bundleplacer.test_fleet')
+
+
+def make_machine(i, cpus, mem, storage, arch):
+    return MaasMachine('m{}'.format(i), {'hostname': 'm{}'.format(i),
+                                         'cpu_count': cpus,
+                                         'memory': mem,
+                                         'storage': storage,
+                                         'architecture': arch})
+
+
+class FleetIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.machines = [make_machine(0, 2, 2048, 20, 'amd64'),
+                         make_machine(1, 8, 16384, 500000, 'amd64'),
+                         make_machine(2, '*', '*', '*', '*'),
+                         make_machine(3, 4, 8192, 100000, 'arm64'),
+                         make_machine(4, 8, 8192, 100000, 'amd64')]
+        self.index = FleetIndex(self.machines)
+        self.constraint_sets = [None,
+                                {},
+                                dict(storage=15, arch='amd64'),
+                                dict(arch='ENIAC'),
+                                dict(mem='8G'),
+                                dict(mem='64G', cpu_cores=4),
+                                {'cpu_cores': '8', 'root-disk': '100G'},
+                                dict(mem=8192, arch='arm64')]
+
+    def test_matches_satisfies(self):
+        matrix = self.index.satisfaction_matrix(self.constraint_sets)
+        for i, cons in enumerate(self.constraint_sets):
+            for j, m in enumerate(self.machines):
+                self.assertEqual(matrix.satisfies(i, j), satisfies(m, cons),
+                                 "{} on {}".format(cons, m))
+            self.assertEqual(matrix.row(i),
+                             [satisfies(m, cons)[0] for m in self.machines])
+
+    def test_matching(self):
+        self.assertEqual(self.index.matching(dict(mem='8G')),
+                         self.machines[1:])
+        self.assertEqual(self.index.matching(dict(arch='ENIAC')),
+                         [self.machines[2]])
@@ -19,10 +19,13 @@
 
 import os
 import unittest
+from concurrent.futures import Future
+from threading import Event
 from unittest.mock import MagicMock, PropertyMock, patch
 import json
 
-from bundleplacer.maas import (MaasMachine, MaasMachineStatus, MaasState,
+from bundleplacer.maas import (FederatedMaasState, MaasMachine,
+                               MaasMachineStatus, MaasState, NodeIndex,
                                satisfies)
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'maas-output')
@@ -97,6 +100,21 @@ class MaasMachineTestCase(unittest.TestCase):
     def test_ready_state(self):
         self.assertEqual(self.m_ready.status, MaasMachineStatus.READY)
 
+    def test_hardware_parsed(self):
+        m = MaasMachine(-1, {'hostname': 'm', 'cpu_count': 4,
+                             'memory': 2048, 'storage': '*'})
+        self.assertEqual((m.cpu_count, m.mem_mb, m.storage_mb),
+                         (4, 2048, float('inf')))
+        self.assertEqual((m.cpu_cores, m.mem, m.storage),
+                         (4, '2.0G', 'N/A'))
+        self.assertEqual(self.empty_machine.mem, 'N/A')
+        self.assertFalse(hasattr(m, '__dict__'))
+
+        m.update({'hostname': 'm', 'cpu_count': 4, 'memory': 512,
+                  'storage': 10240})
+        self.assertEqual((m.mem_mb, m.mem, m.storage), (512, '512M',
+                                                        '10.00G'))
+
 
 class MaasMachineStatusTestCase(unittest.TestCase):
     """MaasMachine should use the same labels as MAAS 1.7"""
@@ -162,3 +180,230 @@ class MaasStateTestCase(unittest.TestCase):
         s = MaasState(self.mock_client_oneready)
         ready_machines = s.machines(MaasMachineStatus.READY)
         self.assertEqual(len(ready_machines), 1)
+
+    def test_machines_keep_identity(self):
+        s = MaasState(self.mock_client_oneready)
+        m1 = s.machines()
+        m2 = s.machines()
+        self.assertEqual(len(m1), 1)
+        self.assertIs(m1[0], m2[0])
+
+
+class MaasMachinePoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state = MaasState(MagicMock())
+        self.events = []
+        self.state.add_listener(
+            lambda *args: self.events.append(args))
+        self.nodes = [{'system_id': 'a', 'hostname': 'a.maas',
+                       'status': 4, 'memory': 1024},
+                      {'system_id': 'b', 'hostname': 'b.maas',
+                       'status': 4, 'memory': 2048}]
+
+    def test_update_patches_changed_fields(self):
+        a, b = self.state.update_machines(self.nodes)
+        self.assertEqual(self.events, [([a, b], [], [])])
+
+        data = a.machine
+        new_nodes = [dict(self.nodes[0], status=6), dict(self.nodes[1])]
+        self.assertEqual(self.state.update_machines(new_nodes), [a, b])
+        self.assertIs(a.machine, data)
+        self.assertEqual(a.status, MaasMachineStatus.ALLOCATED)
+        self.assertEqual(self.events[-1], ([], [], [a]))
+
+    def test_removed_and_added(self):
+        a, b = self.state.update_machines(self.nodes)
+        c_node = {'system_id': 'c', 'hostname': 'c.maas', 'status': 4}
+        machines = self.state.update_machines([self.nodes[1], c_node])
+        self.assertIs(machines[0], b)
+        self.assertEqual(self.events[-1], ([machines[1]], [a], []))
+
+    def test_hostname_change_rehashes(self):
+        a, b = self.state.update_machines(self.nodes)
+        a.update(dict(self.nodes[0], hostname='renamed.maas'))
+        self.assertEqual(hash(a), hash('renamed.maas'))
+
+    def test_fleet_index_cached_until_pool_changes(self):
+        for node in self.nodes:
+            node['resource_uri'] = '/nodes/{}/'.format(node['system_id'])
+        a, b = self.state.update_machines(self.nodes)
+        index = self.state.fleet_index()
+        self.assertEqual(index.matching_among([a, b], 'mem=2G'),
+                         ({b.instance_id}, []))
+
+        self.state.update_machines(self.nodes)
+        self.assertIs(self.state.fleet_index(), index)
+
+        self.state.update_machines([dict(self.nodes[0], memory=4096),
+                                    self.nodes[1]])
+        index = self.state.fleet_index()
+        self.assertEqual(index.matching_among([a, b], 'mem=2G'),
+                         ({a.instance_id, b.instance_id}, []))
+        self.assertTrue(index.covers([a, b]))
+
+
+def finished(func, exc_callback):
+    f = Future()
+    f.set_result(func())
+    return f
+
+
+class MaasNodeCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.listing = [{'system_id': 'a', 'hostname': 'a.maas',
+                         'architecture': 'amd64/generic',
+                         'tag_names': ['ssd'], 'status': 4},
+                        {'system_id': 'b', 'hostname': 'b.maas',
+                         'architecture': 'arm64/generic',
+                         'tag_names': [], 'status': 4}]
+        self.fetches = PropertyMock(side_effect=lambda: self.listing)
+        type(self.client).nodes = self.fetches
+        self.state = MaasState(self.client, ttl=60)
+
+    def test_stale_listing_served_while_refreshing(self):
+        pending = Future()
+        with patch('bundleplacer.maas.submit',
+                   return_value=pending) as mock_submit:
+            self.assertEqual(self.state.nodes(), [])
+            self.assertEqual(self.state.nodes(), [])
+            self.assertEqual(mock_submit.call_count, 1)
+            pending.set_result((self.listing, 0.5))
+            self.assertEqual(self.state.nodes(), self.listing)
+            self.assertEqual(mock_submit.call_count, 1)
+        stats = self.state.cache_stats()
+        self.assertEqual(stats['refreshes'], 1)
+        self.assertEqual(stats['last_refresh_seconds'], 0.5)
+
+    def test_refresh_error_keeps_listing(self):
+        failed = Future()
+        failed.set_exception(IOError("MAAS is down"))
+        with patch('bundleplacer.maas.submit', new=finished):
+            self.state.nodes()
+            self.state.nodes()
+        self.state.invalidate_nodes_cache()
+        with patch('bundleplacer.maas.submit', return_value=failed):
+            self.state.nodes()
+            self.assertEqual(self.state.nodes(), self.listing)
+        self.assertEqual(self.state.cache_stats()['refresh_errors'], 1)
+
+    def test_filters_memoized_until_listing_changes(self):
+        with patch('bundleplacer.maas.submit', new=finished):
+            self.state.nodes()
+            amd64 = self.state.nodes('arch=amd64')
+            self.assertEqual([n['system_id'] for n in amd64], ['a'])
+            self.assertIs(self.state.nodes('arch=amd64'), amd64)
+            self.assertEqual(self.state.nodes('tags=^ssd'), [self.listing[1]])
+            stats = self.state.cache_stats()
+            self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+            # same listing again keeps the memo
+            self.state.invalidate_nodes_cache()
+            self.state.nodes()
+            self.state.nodes()
+            self.assertIs(self.state.nodes('arch=amd64'), amd64)
+
+            self.listing = self.listing[1:]
+            self.state.invalidate_nodes_cache()
+            self.state.nodes()
+            self.state.nodes()
+            self.assertEqual(self.state.nodes('arch=amd64'), [])
+
+    def test_nodes_uncached_filters(self):
+        self.assertEqual(self.state.nodes_uncached('tags=ssd'),
+                         [self.listing[0]])
+        self.assertEqual(self.fetches.call_count, 1)
+
+
+class NodeIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = [
+            {'system_id': 'a', 'architecture': 'amd64/generic',
+             'tag_names': ['ssd', 'compute'], 'zone': {'name': 'z1'}},
+            {'system_id': 'b', 'architecture': 'amd64/generic',
+             'tag_names': ['compute'], 'zone': {'name': 'z2'}},
+            {'system_id': 'c', 'architecture': 'arm64/generic',
+             'tag_names': ['ssd'], 'zone': {'name': 'z1'}}]
+        self.index = NodeIndex()
+        self.index.update(self.nodes)
+
+    def ids(self, constraints):
+        return [n['system_id'] for n in self.index.select(constraints)]
+
+    def test_select(self):
+        self.assertEqual(self.ids('arch=amd64'), ['a', 'b'])
+        self.assertEqual(self.ids('tags=ssd,compute'), ['a'])
+        self.assertEqual(self.ids('tags=^ssd'), ['b'])
+        self.assertEqual(self.ids('arch=amd64 zones=z1'), ['a'])
+        self.assertEqual(self.ids('zones=z1,z2 tags=gpu'), [])
+        self.assertEqual(self.ids('mem=4G'), ['a', 'b', 'c'])
+
+    def test_update_is_incremental(self):
+        self.assertFalse(self.index.update([dict(n) for n in self.nodes]))
+        retagged = dict(self.nodes[1], tag_names=['ssd'])
+        self.assertTrue(self.index.update([self.nodes[0], retagged]))
+        self.assertEqual(self.ids('tags=ssd'), ['a', 'b'])
+        self.assertEqual(self.ids('tags=compute'), ['a'])
+        self.assertEqual(self.ids('arch=arm64'), [])
+        self.assertNotIn('arm64', self.index.by_arch)
+
+
+class FederatedMaasStateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.release = Event()
+        fast, slow = MagicMock(), MagicMock()
+        fast.server_hostname = 'east.maas'
+        slow.server_hostname = 'west.maas'
+        type(fast).nodes = PropertyMock(return_value=[
+            {'system_id': 'e1', 'hostname': 'e1.maas', 'status': 4}])
+
+        def slow_nodes():
+            self.release.wait(5)
+            return [{'system_id': 'w1', 'hostname': 'w1.maas', 'status': 4}]
+        type(slow).nodes = PropertyMock(side_effect=slow_nodes)
+        self.state = FederatedMaasState([('east', fast), ('west', slow)])
+
+    def tearDown(self):
+        self.release.set()
+        self.state.shutdown()
+
+    def wait_for(self, region):
+        future = self.state.regions[region]._nodes_future
+        if future is not None:
+            future.result(5)
+
+    def test_shutdown(self):
+        self.state.shutdown()
+        with self.assertRaises(RuntimeError):
+            self.state._executor.submit(lambda: None)
+
+    def test_fleet_index_spans_regions(self):
+        east, west = self.state.regions.values()
+        e1, = east.update_machines([{'system_id': 'e1', 'status': 4,
+                                     'resource_uri': '/nodes/e1/'}])
+        index = self.state.fleet_index()
+        self.assertIs(self.state.fleet_index(), index)
+
+        w1, = west.update_machines([{'system_id': 'w1', 'status': 4,
+                                     'resource_uri': '/nodes/w1/'}])
+        index = self.state.fleet_index()
+        self.assertTrue(index.covers([e1, w1]))
+
+    def test_slow_region_does_not_block(self):
+        self.assertEqual(self.state.machines(), [])
+        self.wait_for('east')
+        machines = self.state.machines()
+        self.assertEqual([(m.hostname, m.region) for m in machines],
+                         [('e1.maas', 'east')])
+
+        self.release.set()
+        self.wait_for('west')
+        machines = self.state.machines()
+        self.assertEqual([(m.hostname, m.region) for m in machines],
+                         [('e1.maas', 'east'), ('w1.maas', 'west')])
+        self.assertEqual(self.state.server_hostname, 'east.maas, west.maas')
+        self.assertEqual(self.state.cache_stats()['west']['refreshes'], 1)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# tests fixtures/maas_server.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+
+from bundleplacer.fixtures.maas_server import FakeMaasServer
+from bundleplacer.fixtures.nodes import generate_nodes
+from bundleplacer.maas import connect_to_maas, trim_node
+
+log = logging.getLogger('bundleplacer.test_maas_server')
+
+API_KEY = 'consumer:token:secret'
+
+
+class FakeMaasServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeMaasServer(count=50, seed=7, api_key=API_KEY,
+                                     config=dict(maas_name='test maas'))
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def connect(self, api_key=API_KEY):
+        return connect_to_maas(dict(api_host=self.server.api_host,
+                                    api_key=api_key))
+
+    def test_nodes_and_config(self):
+        client, state = self.connect()
+        self.assertEqual(client.nodes, [trim_node(n) for n in
+                                        generate_nodes(50, seed=7)])
+        self.assertEqual(state.get_server_config('maas_name'), 'test maas')
+        self.assertEqual(len(state.nodes_uncached('arch=amd64')), 50)
+
+    def test_requires_api_key(self):
+        client, state = self.connect(api_key='consumer:token:wrong')
+        self.assertEqual(client.nodes, [])
+        self.assertEqual(self.server.stats['unauthorized'], 1)
+
+    def test_churn(self):
+        self.server.churn = 0.2
+        client, state = self.connect()
+        first = client.nodes
+        second = client.nodes
+        self.assertEqual(len(second), 50)
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.server.stats['churned'], 20)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+# tests machine.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+
+from bundleplacer.machine import Machine
+
+log = logging.getLogger('bundleplacer.test_machine')
+
+
+class MachineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.machine = Machine('1', {'Hardware': 'arch=amd64 cpu-cores=2 '
+                                                 'mem=3840M root-disk=8192M',
+                                     'DNSName': 'm1.maas'})
+
+    def test_hardware_parsed(self):
+        m = self.machine
+        self.assertEqual((m.arch, m.cpu_cores, m.mem, m.storage),
+                         ('amd64', '2', '3840M', '8.0G'))
+        self.assertEqual((m.cpu_count, m.mem_mb, m.storage_mb),
+                         (2, 3840, 8192))
+        # repeated reads used to re-parse the already converted value
+        self.assertEqual(m.storage, '8.0G')
+        self.assertEqual(m.hardware('memory'), '3840M')
+
+    def test_no_hardware(self):
+        m = Machine('2', {})
+        self.assertEqual((m.arch, m.mem, m.storage), ('N/A', 'N/A', 'N/A'))
+        self.assertEqual(m.mem_mb, 0)
+
+    def test_setters_update_numbers(self):
+        self.machine.mem = '1G'
+        self.assertEqual((self.machine.mem, self.machine.mem_mb),
+                         ('1G', 1024))
@@ -29,7 +29,9 @@ from bundleplacer.config import Config
 
 import bundleplacer.utils as utils
 
-from bundleplacer.controller import AssignmentType, PlacementController
+from bundleplacer.controller import (AssignmentType, PlacementController,
+                                     PlacementRollback)
+from bundleplacer.state import ServiceState
 
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'maas-output')
@@ -297,3 +299,136 @@ class PlacementControllerTestCase(unittest.TestCase):
         self.pc.clear_assignments(self.mock_machine)
         self.pc.clear_assignments(self.mock_machine)
         self.pc.clear_assignments(self.mock_machine_2)
+
+    def test_get_machine(self):
+        self.assertIs(self.pc.get_machine('fake-instance-id-2'),
+                      self.mock_machine_2)
+        self.assertIs(self.pc.get_machine('_default'),
+                      self.pc.def_placeholder)
+        self.assertIsNone(self.pc.get_machine('no-such-machine'))
+
+    def test_get_service(self):
+        self.assertIs(self.pc.get_service('keystone'), self.service_2)
+        self.assertIsNone(self.pc.get_service('no-such-service'))
+
+    def test_add_bundle_assignments(self):
+        self.pc.add_bundle_assignments(
+            {'keystone': ['lxd:fake-instance-id-1', 'fake-instance-id-2'],
+             'no-such-service': ['fake-instance-id-1']})
+        self.assertEqual(self.pc.get_assignments(self.service_2),
+                         {AssignmentType.LXD: [self.mock_machine],
+                          AssignmentType.DEFAULT: [self.mock_machine_2]})
+        self.assertEqual(self.pc.get_assignments(self.service_1), {})
+
+    @patch.dict('os.environ', {'PLACEMENT_CHECK_STATE': '1'})
+    def test_incremental_state_matches_recompute(self):
+        with patch('bundleplacer.controller.log') as mock_log:
+            self.pc.assign(self.mock_machine, self.service_1,
+                           AssignmentType.LXD)
+            self.pc.assign(self.mock_machine_2, self.service_2,
+                           AssignmentType.KVM)
+            self.pc.mark_deployed(self.mock_machine_2, self.service_2,
+                                  AssignmentType.KVM)
+            self.pc.remove_one_assignment(self.mock_machine, self.service_1)
+            self.pc.assign(self.mock_machine, self.service_1,
+                           AssignmentType.LXD)
+            self.pc.clear_assignments(self.mock_machine)
+            self.assertFalse(mock_log.error.called)
+        self.assertEqual(self.pc.assigned_services, [])
+        self.assertEqual(self.pc.deployed_services, [self.service_2])
+
+    def test_batch_defers_update(self):
+        with patch.object(self.pc, 'reset_assigned_deployed') as mock_reset:
+            with self.pc.batch():
+                self.pc.assign(self.mock_machine, self.service_1,
+                               AssignmentType.LXD)
+                self.pc.assign(self.mock_machine_2, self.service_2,
+                               AssignmentType.LXD)
+                self.assertEqual(self.pc.assigned_services, [])
+            self.assertFalse(mock_reset.called)
+        self.assertEqual(set(self.pc.assigned_services),
+                         set([self.service_1, self.service_2]))
+
+    def test_batch_rolls_back_on_error(self):
+        self.pc.assign(self.mock_machine, self.service_1, AssignmentType.LXD)
+        with self.assertRaises(KeyError):
+            with self.pc.batch():
+                self.pc.clear_assignments(self.mock_machine)
+                self.pc.assign(self.mock_machine_2, self.service_2,
+                               AssignmentType.KVM)
+                raise KeyError()
+        self.assertEqual(self.pc.get_assignments(self.service_1),
+                         {AssignmentType.LXD: [self.mock_machine]})
+        self.assertEqual(self.pc.get_assignments(self.service_2), {})
+        self.assertEqual(self.pc.assigned_services, [self.service_1])
+
+    def test_batch_rollback_is_silent(self):
+        with self.pc.batch():
+            self.pc.assign(self.mock_machine, self.service_1,
+                           AssignmentType.LXD)
+            raise PlacementRollback()
+        self.assertEqual(self.pc.assignments, {})
+        self.assertEqual(self.pc.assigned_services, [])
+
+    def test_nested_batch_rollback(self):
+        with self.pc.batch():
+            self.pc.assign(self.mock_machine, self.service_1,
+                           AssignmentType.LXD)
+            with self.pc.batch():
+                self.pc.assign(self.mock_machine_2, self.service_2,
+                               AssignmentType.KVM)
+                raise PlacementRollback()
+            self.assertEqual(self.pc._batch_depth, 1)
+            self.assertEqual(self.pc.get_assignments(self.service_1),
+                             {AssignmentType.LXD: [self.mock_machine]})
+            self.assertEqual(self.pc.get_assignments(self.service_2), {})
+            self.assertEqual(self.pc.assigned_services, [])
+        self.assertEqual(self.pc._batch_depth, 0)
+        self.assertEqual(self.pc.assigned_services, [self.service_1])
+
+    def test_scale_service_refreshes_placed_services(self):
+        self.pc.assign(self.mock_machine, self.service_1, AssignmentType.LXD)
+        scaled = create_service("nova-compute", {
+            "num_units": 3,
+            "charm": "cs:trusty/nova-compute-100"}, {}, [])
+        type(self.mock_bundle_i).services = PropertyMock(
+            return_value=[scaled, self.service_2])
+        self.mock_bundle_i.version = 'scaled'
+        self.pc.scale_service("nova-compute", 2)
+        self.assertIs(self.pc.assigned_services[0], scaled)
+        self.assertEqual(self.pc.assigned_services[0].num_units, 3)
+
+    def test_temp_copy(self):
+        self.pc.assign(self.mock_machine, self.service_1, AssignmentType.LXD)
+        tmp = self.pc.get_temp_copy()
+        tmp.assign(self.mock_machine_2, self.service_2, AssignmentType.KVM)
+        tmp.clear_assignments(self.mock_machine)
+        self.assertEqual(self.pc.assigned_services, [self.service_1])
+        self.assertEqual(tmp.assigned_services, [self.service_2])
+
+        self.pc.update_from_controller(tmp)
+        self.assertEqual(self.pc.assignments, tmp.assignments)
+        self.assertEqual(self.pc.assigned_services, [self.service_2])
+        self.assertEqual(self.pc.unassigned_undeployed_services(),
+                         set([self.service_1]))
+
+    def test_can_deploy(self):
+        self.assertFalse(self.pc.can_deploy())
+        self.assertEqual(self.pc.get_service_state(self.service_1)[0],
+                         ServiceState.REQUIRED)
+        self.pc.assign(self.mock_machine, self.service_1, AssignmentType.LXD)
+        self.assertEqual(self.pc.get_service_state(self.service_1)[0],
+                         ServiceState.OPTIONAL)
+        self.assertFalse(self.pc.can_deploy())
+        self.pc.assign(self.mock_machine, self.service_2, AssignmentType.LXD)
+        self.assertTrue(self.pc.can_deploy())
+        self.pc.clear_assignments(self.mock_machine)
+        self.assertFalse(self.pc.can_deploy())
+
+    def test_begin_rollback_batch(self):
+        self.pc.begin_batch()
+        self.pc.assign(self.mock_machine, self.service_1, AssignmentType.LXD)
+        self.pc.rollback_batch()
+        self.assertEqual(self.pc.assignments, {})
+        self.pc.assign(self.mock_machine, self.service_1, AssignmentType.LXD)
+        self.assertEqual(self.pc.assigned_services, [self.service_1])
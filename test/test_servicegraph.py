@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# tests servicegraph.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+
+from bundleplacer.bundle import create_service
+from bundleplacer.servicegraph import ServiceGraph
+from bundleplacer.state import ServiceState
+
+log = logging.getLogger('bundleplacer.test_servicegraph')
+
+
+def make_service(name, num_units=1, **meta):
+    meta.setdefault('required', False)
+    return create_service(name, {'num_units': num_units,
+                                 'charm': 'cs:trusty/{}-1'.format(name)},
+                          meta, [])
+
+
+class ServiceGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.mysql = make_service('mysql')
+        self.keystone = make_service('keystone', depends=['mysql'])
+        self.pgsql = make_service('pgsql', conflicts=['mysql'])
+        self.ntp = make_service('ntp', num_units=2)
+        self.graph = ServiceGraph([self.mysql, self.keystone,
+                                   self.pgsql, self.ntp])
+
+    def test_initial_state(self):
+        for s in [self.mysql, self.keystone, self.pgsql, self.ntp]:
+            self.assertEqual(self.graph.state(s),
+                             (ServiceState.OPTIONAL, [], []))
+        self.assertTrue(self.graph.can_deploy())
+
+    def test_dependency_requires(self):
+        self.graph.update(self.keystone, True, False, 1)
+        self.assertEqual(self.graph.state(self.mysql),
+                         (ServiceState.REQUIRED, [], [self.keystone]))
+        self.assertEqual(self.graph.blocking(), [self.mysql])
+        self.assertFalse(self.graph.can_deploy())
+
+        self.graph.update(self.mysql, False, True, 1)
+        self.assertEqual(self.graph.state(self.mysql)[0],
+                         ServiceState.OPTIONAL)
+        self.assertTrue(self.graph.can_deploy())
+
+        self.graph.update(self.mysql, False, False, 0)
+        self.graph.update(self.keystone, False, False, 0)
+        self.assertEqual(self.graph.state(self.mysql)[0],
+                         ServiceState.OPTIONAL)
+        self.assertTrue(self.graph.can_deploy())
+
+    def test_conflicts_both_ways(self):
+        self.graph.update(self.mysql, True, False, 1)
+        self.assertEqual(self.graph.state(self.pgsql),
+                         (ServiceState.CONFLICTED, [self.mysql], []))
+        self.graph.update(self.mysql, False, False, 0)
+        self.graph.update(self.pgsql, True, False, 1)
+        self.assertEqual(self.graph.state(self.mysql)[0],
+                         ServiceState.CONFLICTED)
+
+    def test_underassigned(self):
+        self.graph.update(self.ntp, True, False, 1)
+        self.assertEqual(self.graph.state(self.ntp)[0],
+                         ServiceState.REQUIRED)
+        self.assertEqual(self.graph.blocking(), [self.ntp])
+        self.graph.update(self.ntp, True, False, 2)
+        self.assertTrue(self.graph.can_deploy())
+
+    def test_core_services_are_required(self):
+        core = make_service('juju-gui', required=True)
+        graph = ServiceGraph([core, self.mysql])
+        self.assertEqual(graph.state(core)[0], ServiceState.REQUIRED)
+        self.assertFalse(graph.can_deploy())
+        graph.update(core, True, False, 1)
+        self.assertTrue(graph.can_deploy())
+
+    def test_unknown_service(self):
+        removed = make_service('ceph')
+        self.assertEqual(self.graph.state(removed),
+                         (ServiceState.OPTIONAL, [], []))
+        self.graph.update(removed, True, False, 1)
+        self.assertEqual(self.graph.state(removed),
+                         (ServiceState.OPTIONAL, [], []))
+        self.assertTrue(self.graph.can_deploy())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# tests solver.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+
+from bundleplacer.assignmenttype import AssignmentType
+from bundleplacer.bundle import create_service
+from bundleplacer.controller import PlaceholderMachine
+from bundleplacer.fleet import FleetIndex
+from bundleplacer.solver import (BestFitSolver, FirstFitSolver,
+                                 FirstFitDecreasingSolver, get_solver)
+
+log = logging.getLogger('bundleplacer.test_solver')
+
+
+def make_machine(name, cpus, mem):
+    return PlaceholderMachine(name, name, {'arch': 'amd64',
+                                           'cpu_count': cpus,
+                                           'memory': mem,
+                                           'storage': 100000})
+
+
+def make_service(name, num_units=1, constraints=None):
+    return create_service(name, {'num_units': num_units,
+                                 'charm': 'cs:trusty/{}-1'.format(name),
+                                 'constraints': constraints or {}}, {}, [])
+
+
+def machines_of(assignments, service):
+    return sorted(iid for iid, ad in assignments.items()
+                  for services in ad.values() if service in services)
+
+
+class SolverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.machines = [make_machine('big', 16, 65536),
+                         make_machine('small', 2, 4096),
+                         make_machine('medium', 8, 16384)]
+        self.db = make_service('db', constraints={'mem': '12G'})
+        self.web = make_service('web', num_units=2)
+
+    def test_best_fit_uses_tightest_machine(self):
+        a, report = BestFitSolver().solve([self.db, self.web], [],
+                                          self.machines)
+        self.assertEqual(machines_of(a, self.db), ['medium'])
+        self.assertEqual(machines_of(a, self.web), ['big', 'small'])
+        self.assertEqual(report.placed, 3)
+        self.assertEqual(report.unplaced, [])
+        self.assertAlmostEqual(report.utilization['mem'],
+                               12288 / (65536 + 4096 + 16384))
+
+    def test_first_fit_keeps_fleet_order(self):
+        a, report = FirstFitSolver().solve([self.web, self.db], [],
+                                           self.machines)
+        self.assertEqual(machines_of(a, self.web), ['big', 'small'])
+        self.assertEqual(machines_of(a, self.db), ['medium'])
+
+        a, report = FirstFitDecreasingSolver().solve([self.web, self.db],
+                                                     [], self.machines)
+        self.assertEqual(machines_of(a, self.db), ['big'])
+
+    def test_first_fit_shares_one_host(self):
+        shared = [make_service('s1'), make_service('ha', num_units=3)]
+        a, report = FirstFitSolver(lxd_hosts=3).solve(
+            [self.db], shared, self.machines, AssignmentType.LXD)
+        # db takes the first machine, the shared services the next one,
+        # with one assignment each
+        self.assertEqual(machines_of(a, self.db), ['big'])
+        self.assertEqual(dict(a['small']), {AssignmentType.LXD: shared})
+        self.assertEqual(report.placed, 3)
+
+    def test_unplaced(self):
+        huge = make_service('huge', constraints={'mem': '1T'})
+        a, report = BestFitSolver().solve([huge], [], self.machines)
+        self.assertEqual(dict(a), {})
+        self.assertEqual(report.unplaced, [huge])
+
+    def test_shared_services_spread(self):
+        shared = [make_service('s{}'.format(i)) for i in range(4)]
+        ha = make_service('ha', num_units=2)
+        a, report = BestFitSolver(lxd_hosts=2).solve(
+            [], shared + [ha], self.machines, AssignmentType.LXD)
+        self.assertEqual(sorted(a.keys()), ['big', 'medium'])
+        self.assertEqual(machines_of(a, ha), ['big', 'medium'])
+        for iid in a:
+            self.assertEqual(len(a[iid][AssignmentType.LXD]), 3)
+        self.assertEqual(report.machines_used, 2)
+
+    def test_shared_index(self):
+        # the index also has a machine that isn't free, which stays unused
+        spare = make_machine('spare', 32, 131072)
+        index = FleetIndex([spare] + self.machines)
+        for solver in [BestFitSolver(), FirstFitSolver()]:
+            expected, _ = solver.solve([self.db, self.web], [],
+                                       self.machines)
+            a, report = solver.solve([self.db, self.web], [],
+                                     self.machines, index=index)
+            self.assertEqual(a, expected)
+            self.assertNotIn('spare', a)
+
+        # machines the index doesn't cover get an index of their own
+        other = make_machine('big', 16, 65536)
+        a, report = BestFitSolver().solve([self.db], [],
+                                          [other] + self.machines[1:],
+                                          index=index)
+        self.assertEqual(machines_of(a, self.db), ['medium'])
+
+    def test_get_solver(self):
+        self.assertIsInstance(get_solver(), BestFitSolver)
+        self.assertIsInstance(get_solver('first-fit'), FirstFitSolver)
+        with self.assertRaises(ValueError):
+            get_solver('worst-fit')
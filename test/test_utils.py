@@ -18,6 +18,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import errno
+import json
 import logging
 import os
 from subprocess import PIPE
@@ -25,7 +26,8 @@ from subprocess import PIPE
 import unittest
 from unittest.mock import patch
 
-from bundleplacer.utils import get_command_output
+from bundleplacer.utils import (decode_chunks, get_command_output,
+                                iter_json_array)
 
 
 log = logging.getLogger('bundleplacer.test_utils')
@@ -77,3 +79,23 @@ class TestGetCommandOutput(unittest.TestCase):
         mock_Popen.side_effect = OSError()
         with self.assertRaises(OSError):
             get_command_output('foo')
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def test_any_chunking(self):
+        data = [{'a': 1, 'b': [1, 2, "x]y,"]}, 12345, "caf\u00e9", [],
+                {'nested': {'c': None}}]
+        text = json.dumps(data, indent=1, ensure_ascii=False)
+        raw = text.encode('utf-8')
+        for size in [1, 2, 7, 64, len(raw)]:
+            chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+            self.assertEqual(list(iter_json_array(decode_chunks(chunks))),
+                             data, size)
+
+    def test_empty_and_invalid(self):
+        self.assertEqual(list(iter_json_array([' [ ', ' ] '])), [])
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['{"a": 1}']))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['[1, 2']))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# bench-placement.py - times PlacementController operations against
+# generated bundles of increasing size.
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bundleplacer.assignmenttype import AssignmentType  # noqa
+from bundleplacer.config import Config  # noqa
+from bundleplacer.controller import (PlaceholderMachine,  # noqa
+                                     PlacementController)
+
+
+def make_bundle(n_services):
+    services = {}
+    for i in range(n_services):
+        charm = 'cs:xenial/app-{}-1'.format(i)
+        services['app-{}'.format(i)] = {'charm': charm, 'num_units': 1}
+    relations = [['app-{}:rel'.format(i), 'app-{}:rel'.format(i + 1)]
+                 for i in range(n_services - 1)]
+    return dict(series='xenial', services=services, machines={},
+                relations=relations)
+
+
+def make_controller(tmpdir, n_services):
+    fn = os.path.join(tmpdir, 'bundle-{}.yaml'.format(n_services))
+    with open(fn, 'w') as f:
+        yaml.dump(make_bundle(n_services), f)
+    config = Config('bench-placement',
+                    dict(bundle_filename=fn),
+                    save_backups=False)
+    pc = PlacementController(config=config)
+    for i in range(n_services):
+        pc._machines.append(PlaceholderMachine('machine-{}'.format(i),
+                                               'machine-{}'.format(i)))
+    return pc
+
+
+def bench_assign(pc):
+    """Returns mean seconds per assign() over every service."""
+    services = pc.services()
+    machines = pc.machines(include_placeholders=False)
+    start = time.perf_counter()
+    for service, machine in zip(services, machines):
+        pc.assign(machine, service, AssignmentType.LXD)
+    return (time.perf_counter() - start) / len(services)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time PlacementController.assign()")
+    parser.add_argument('sizes', metavar='N', type=int, nargs='*',
+                        default=[10, 100, 1000, 5000],
+                        help="bundle sizes (number of services) to time")
+    opts = parser.parse_args()
+
+    print("{:>8} {:>16}".format("services", "usec/assign"))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n in opts.sizes:
+            pc = make_controller(tmpdir, n)
+            print("{:>8} {:>16.1f}".format(n, bench_assign(pc) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+#
+# fake-maas-server.py - serves synthetic MAAS nodes on localhost, or
+# times MaasState refreshes and memory use against them.
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import gc
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bundleplacer.fixtures.maas_server import FakeMaasServer  # noqa
+from bundleplacer.maas import (MaasState, StreamingMaasClient,  # noqa
+                               connect_to_maas)
+from maasclient import MaasClient  # noqa
+from maasclient.auth import MaasAuth  # noqa
+
+API_KEY = 'fake:consumer:secret'
+
+
+def wait_for_refresh(state):
+    """Calls state.machines() until a background refresh has been
+    collected, and returns the longest call in seconds."""
+    refreshes = state.cache_stats()['refreshes']
+    worst = 0
+    while state.cache_stats()['refreshes'] == refreshes:
+        start = time.perf_counter()
+        state.machines()
+        worst = max(worst, time.perf_counter() - start)
+        time.sleep(0.01)
+    return worst
+
+
+def bench_refresh(server, rounds):
+    """Refreshes a MaasState rounds times, printing how long each fetch
+    took in the background and the longest nodes() call the UI thread
+    made while waiting for it."""
+    creds = dict(api_host=server.api_host, api_key=API_KEY)
+    _, state = connect_to_maas(creds, ttl=0)
+    print("{:>6} {:>8} {:>12} {:>16}".format("round", "nodes", "fetch s",
+                                             "max nodes() ms"))
+    for r in range(rounds):
+        state.invalidate_nodes_cache()
+        worst = wait_for_refresh(state)
+        stats = state.cache_stats()
+        print("{:>6} {:>8} {:>12.3f} {:>16.2f}".format(
+            r, len(state.nodes()), stats['last_refresh_seconds'],
+            worst * 1e3))
+
+
+def _serve(queue, kwargs):
+    with FakeMaasServer(**kwargs) as server:
+        queue.put(server.api_host)
+        while True:
+            time.sleep(1)
+
+
+def bench_memory(server_kwargs):
+    """Prints the peak and retained Python memory of loading a MaasState
+    with the stock MaasClient and with StreamingMaasClient.
+
+    The server runs in another process so that only the client side is
+    measured.
+    """
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_serve, args=(queue, server_kwargs),
+                                   daemon=True)
+    proc.start()
+    try:
+        api_host = queue.get(timeout=60)
+        auth = MaasAuth(api_url='http://{}/MAAS/api/1.0'.format(api_host),
+                        api_key=API_KEY)
+        print("{:>20} {:>8} {:>10} {:>12}".format("client", "nodes",
+                                                  "peak MB", "retained MB"))
+        for cls in [MaasClient, StreamingMaasClient]:
+            gc.collect()
+            tracemalloc.start()
+            state = MaasState(cls(auth))
+            state.nodes()
+            wait_for_refresh(state)
+            n_machines = len(state.machines())
+            gc.collect()
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("{:>20} {:>8} {:>10.1f} {:>12.1f}".format(
+                cls.__name__, n_machines, peak / 2**20, retained / 2**20))
+            del state
+    finally:
+        proc.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Emulate the MAAS nodes API with synthetic nodes")
+    parser.add_argument('--nodes', type=int, default=1000,
+                        help="number of nodes to serve")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=5240)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to each request")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="up to this many random seconds more")
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help="fraction of nodes changed per listing")
+    parser.add_argument('--arch', dest='archs', action='append',
+                        help="architecture to give nodes, may be repeated")
+    parser.add_argument('--tag', dest='tags', action='append',
+                        help="tag to draw node tags from, may be repeated")
+    parser.add_argument('--bench', metavar='ROUNDS', type=int, default=0,
+                        help="time ROUNDS MaasState refreshes and exit")
+    parser.add_argument('--bench-memory', action='store_true',
+                        help="measure the memory used to load the nodes "
+                        "with and without streaming, and exit")
+    opts = parser.parse_args()
+
+    node_options = {}
+    if opts.archs:
+        node_options['archs'] = opts.archs
+    if opts.tags:
+        node_options['tags'] = opts.tags
+    server_kwargs = dict(count=opts.nodes, seed=opts.seed,
+                         latency=opts.latency, jitter=opts.jitter,
+                         churn=opts.churn, api_key=API_KEY,
+                         node_options=node_options)
+    if opts.bench_memory:
+        bench_memory(server_kwargs)
+        return
+    server = FakeMaasServer(port=0 if opts.bench else opts.port,
+                            **server_kwargs)
+    with server:
+        if opts.bench:
+            bench_refresh(server, opts.bench)
+            return
+        print("Serving {} nodes, run:\n  bundle-placer --maas-ip {} "
+              "--maas-cred {} <bundle>".format(opts.nodes, server.api_host,
+                                               API_KEY))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()